@@ -4,6 +4,7 @@
 #include <vector>
 #include <queue>
 #include <algorithm>
+#include <chrono>
 
 // more memory efficient hash tables, slightly slower insertions
 #define SPP_ALLOC_SZ 1
@@ -28,6 +29,12 @@ typedef uint32_t ItemNo;
 typedef uint32_t Label;
 typedef double Prob;
 
+/* Time in seconds of a monotonic clock; used to time parsing phases. */
+static inline double walltime() {
+	return std::chrono::duration<double>(
+			std::chrono::steady_clock::now().time_since_epoch()).count();
+}
+
 // A stable priority queue with a key-value interface.
 // Values are priorities (should be comparable),
 // keeps only one priority per key (should be hashable).
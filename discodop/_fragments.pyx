@@ -31,7 +31,7 @@ from libc.string cimport memset, memcpy
 from libc.stdint cimport uint8_t, uint32_t, uint64_t, SIZE_MAX
 from cpython.array cimport array, clone, extend_buffer, resize
 from .containers cimport (Node, NodeArray, Ctrees, Vocabulary, Rule,
-		yieldranges, termidx)
+		yieldranges, termidx, prodpairbucket)
 from .bit cimport iteratesetbits, abitcount, subset, setunioninplace
 
 cdef extern from "macros.h":
@@ -552,10 +552,15 @@ cdef int countbitset(uint64_t *bitset, Node *anodes, int i, int n,
 
 cdef getcandidates(Node *a, uint64_t *bitset, Ctrees trees, short alen,
 		int start, int end, short SLOTS):
-	"""Get candidates from productions in fragment ``bitset`` at ``a[i]``."""
+	"""Get candidates from productions in fragment ``bitset`` at ``a[i]``.
+
+	If ``trees`` has an index of pairs of productions, the candidates are
+	further restricted to trees with the parent-child pairs of the fragment.
+	"""
 	cdef uint64_t cur = bitset[0]
 	cdef int i, idx = 0, prodindexlen = len(trees.prodindex)
-	cdef list indices = []
+	cdef uint32_t numbuckets = len(trees.pairindex or ())
+	cdef list indices = [], pairs = []
 	end = end or trees.len
 	while True:
 		i = iteratesetbits(bitset, SLOTS, &cur, &idx)
@@ -564,6 +569,12 @@ cdef getcandidates(Node *a, uint64_t *bitset, Ctrees trees, short alen,
 		if a[i].prod >= prodindexlen:
 			return None
 		indices.append(a[i].prod)
+		if numbuckets and a[i].left >= 0 and TESTBIT(bitset, a[i].left):
+			pairs.append(prodpairbucket(a[i].prod, a[a[i].left].prod,
+					False, numbuckets))
+		if numbuckets and a[i].right >= 0 and TESTBIT(bitset, a[i].right):
+			pairs.append(prodpairbucket(a[i].prod, a[a[i].right].prod,
+					True, numbuckets))
 	if isinstance(trees.prodindex, MultiRoaringBitmap):
 		result = trees.prodindex.intersection(
 				indices, start=start, stop=end)
@@ -576,6 +587,11 @@ cdef getcandidates(Node *a, uint64_t *bitset, Ctrees trees, short alen,
 		if len(indices) > 1:  # work around bug for older RoaringBitmap
 			result = result.intersection(
 					*[trees.prodindex[i] for i in indices[1:]])
+	if result is not None and pairs:
+		tmp = trees.pairindex.intersection(pairs, start=start, stop=end)
+		if tmp is None:
+			return None
+		result &= tmp
 	return result
 
 
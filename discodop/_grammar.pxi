@@ -23,6 +23,41 @@ REMOVESTATESPLITS = re.compile(
 		r'(?:\^[^|:\s]+?)?'  # ^name
 		r'(_[0-9]+(\*[0-9]+)?)?$')  # _2*1
 
+# Format of binary grammar files produced by Grammar.tobinfile();
+# header: magic, version, offset and length of pickled metadata.
+BINGRAMMARMAGIC = b'DDOPGRAM'
+DEF BINGRAMMARVERSION = 2
+DEF BINGRAMMARHEADER = 8 + 3 * 8
+# Grammar files are read in chunks of about this many bytes, in parallel.
+DEF LOADCHUNKSIZE = 1 << 20
+# Maximum number of tab-separated fields in a line with a binarized rule.
+DEF MAXFIELDS = 5
+
+
+# A rule or lexical rule parsed from a line of text, before labels are
+# assigned IDs; see Grammar._convertrules() and Grammar._convertlexicon().
+cdef struct ParsedRule:
+	const char *line  # start and end of line, for error messages
+	const char *end
+	const char *labels[3]  # lhs, rhs1, rhs2
+	uint32_t labellens[3]
+	Prob weight
+	uint32_t args, lengths, numlabels, numvars
+	uint8_t fanout, rhs1fanout, rhs2fanout
+	uint8_t error  # non-zero if line is invalid; cf. ruleerror()
+	char badsymbol
+
+
+cdef struct ParsedLexRule:
+	const char *line
+	const char *end
+	const char *word
+	const char *tag
+	uint32_t wordlen, taglen
+	Prob weight
+	uint8_t error  # 1: no tags, 2: no weight for tag, 3: invalid weight
+	bint first  # whether this is the first tag of the line
+
 # comparison functions for sorting rules on LHS/RHS labels.
 cdef bool lt0(const ProbRule &a, const ProbRule &b) nogil:
 	return a.no < b.no if a.lhs == b.lhs else a.lhs < b.lhs
@@ -113,200 +148,234 @@ cdef class Grammar:
 		del rules, lexicon
 
 	def tobinfile(self, filename):
-		"""Store grammar in a binary format for faster loading."""
-		cdef array buf
-		cdef char *ptr
-		cdef ProbRule *ruleptr
-		cdef uint64_t *header
-		cdef size_t idx, n
-		cdef string word
-		cdef size_t buflen = (4 * sizeof(uint64_t)  # header
-				+ sum(label.size() + 1 for label in self.tolabel.ob)
-				+ (self.freqmass.size()) * sizeof(Prob)  # freqmass
-				+ self.numrules * sizeof(ProbRule)
-				+ self.lexical.size() * sizeof(LexicalRule)
-				+ sum(it.first.size() + 1
-					+ (it.second.size() + 1) * sizeof(uint32_t)
-					for it in self.lexicalbyword))
-		buf = clone(chararray, buflen,
-				False)
-		ptr = buf.data.as_chars
-		header = <uint64_t *>ptr
-		# header: numlabels, numrules, numlex
-		header[0] = self.tolabel.ob.size()
-		header[1] = self.numrules
-		header[2] = self.lexical.size()
-		header[3] = self.lexicalbyword.size()
-		idx = 4 * sizeof(uint64_t)
-		# copy freq mass
-		memcpy(&ptr[idx], &self.freqmass[0],
-				self.freqmass.size() * sizeof(Prob))
-		idx += self.freqmass.size() * sizeof(Prob)
-		# copy bylhs; change prob to freq
-		memcpy(&ptr[idx], &self._bylhs[0], self.numrules * sizeof(ProbRule))
-		ruleptr = <ProbRule *>&ptr[idx]
-		for n in range(self.numrules):
-			ruleptr[n].prob = self.rulecounts[ruleptr[n].no]
-		idx += self.numrules * sizeof(ProbRule)
-		# copy lexicon; change prob to freq; add word
-		# flat list of lexical prods
-		memcpy(&ptr[idx], &self.lexical[0],
-				self.lexical.size() * sizeof(LexicalRule))
-		lexruleptr = <LexicalRule *>&ptr[idx]
-		for n in range(self.lexical.size()):
-			lexruleptr[n].prob = self.lexcounts[n]
-		idx += self.lexical.size() * sizeof(LexicalRule)
-		# copy labels
-		for label in self.tolabel.ob:
-			memcpy(&ptr[idx], label.c_str(), label.size() + 1)
-			idx += label.size() + 1
-		# list of words
-		for it in self.lexicalbyword:
-			word = it.first
-			memcpy(&ptr[idx], word.c_str(), word.size() + 1)
-			idx += word.size() + 1
-		# for each word #rules, lex rulenos
-		for it in self.lexicalbyword:
-			(<uint32_t *>&ptr[idx])[0] = it.second.size()
-			idx += sizeof(uint32_t)
-			for n in it.second:
-				(<uint32_t *>&ptr[idx])[0] = n
-				idx += sizeof(uint32_t)
-		assert idx == buflen, (idx, buflen)
-		buf.frombytes(pickle.dumps(self.tblabelmapping))
-		with open(filename, 'wb') as outfile:
-			buf.tofile(outfile)
+		"""Store grammar in a self-contained binary format for fast loading.
+
+		The file contains the rules and their indices, the lexicon, the label
+		and word string tables, alternative weights, the backtransform table,
+		and any label/rule mappings established with :meth:`getmapping` and
+		:meth:`getrulemapping`. It can be loaded with :meth:`frombinfile`
+		without the original grammar files."""
+		cdef list sections = []
+		cdef dict index = {}
+		cdef size_t n, offset
+		cdef str origmodel = self.currentmodel
+		cdef bint origlogprob = self.logprob
+		cdef vector[uint64_t] offsets
+		cdef vector[uint32_t] lexrulenos
+		if self.models is None and self.altweightsfile:
+			self.models = np.load(self.altweightsfile)
+		# store weights of default model as logprobs
+		self.switch('default', logprob=True)
+		sections.append(('fanout', _vecbytes(
+				self.fanout.data(), self.fanout.size() * sizeof(uint8_t))))
+		sections.append(('freqmass', _vecbytes(
+				self.freqmass.data(), self.freqmass.size() * sizeof(Prob))))
+		sections.append(('rulecounts', _vecbytes(
+				self.rulecounts.data(), self.rulecounts.size() * sizeof(Prob))))
+		sections.append(('lexcounts', _vecbytes(
+				self.lexcounts.data(), self.lexcounts.size() * sizeof(Prob))))
+		sections.append(('revrulemap', _vecbytes(self.revrulemap.data(),
+				self.revrulemap.size() * sizeof(uint32_t))))
+		sections.append(('lexical', _vecbytes(self.lexical.data(),
+				self.lexical.size() * sizeof(LexicalRule))))
+		# rules sorted on lhs, rhs1, rhs2 incl. sentinels, and their indices
+		sections.extend(_ruletable('bylhs', &self._bylhs, &self.bylhs))
+		sections.extend(_ruletable('unary', &self._unary, &self.unary))
+		sections.extend(_ruletable('lbinary', &self._lbinary, &self.lbinary))
+		sections.extend(_ruletable('rbinary', &self._rbinary, &self.rbinary))
+		sections.extend(_stringtable('labels', self.tolabel.ob))
+		words = [it.first for it in self.lexicalbyword]
+		sections.extend(_stringtable('words', words))
+		offsets.push_back(0)
+		for word in words:
+			for n in self.lexicalbyword[word]:
+				lexrulenos.push_back(n)
+			offsets.push_back(lexrulenos.size())
+		sections.append(('lexoffsets', _vecbytes(
+				offsets.data(), offsets.size() * sizeof(uint64_t))))
+		sections.append(('lexrulenos', _vecbytes(
+				lexrulenos.data(), lexrulenos.size() * sizeof(uint32_t))))
+		sections.append(('mapping', _vecbytes(
+				self.mapping.data(), self.mapping.size() * sizeof(Label))))
+		sections.append(('selfmapping', _vecbytes(self.selfmapping.data(),
+				self.selfmapping.size() * sizeof(Label))))
+		sections.extend(_raggedtable('splitmapping', &self.splitmapping))
+		sections.extend(_raggedtable('revmap', &self.revmap))
+		if self.backtransform is not None:
+			sections.extend(_stringtable('backtransform',
+					[(a or '').encode('utf8') for a in self.backtransform]))
+		models = []
+		for name in (self.models.keys() if self.models is not None else ()):
+			models.append(name)
+			sections.append(('model:' + name, np.ascontiguousarray(
+					self.models[name], dtype=np.float64).tobytes()))
+		self.switch(origmodel or 'default', logprob=origlogprob)
+
+		offset = BINGRAMMARHEADER
+		for name, data in sections:
+			index[name] = (offset, len(data))
+			offset += len(data) + (8 - len(data) % 8) % 8
+		meta = pickle.dumps(dict(
+				sections=index,
+				start=self.start,
+				nonterminals=self.nonterminals,
+				numrules=self.numrules,
+				numunary=self.numunary,
+				numbinary=self.numbinary,
+				maxfanout=self.maxfanout,
+				bitpar=self.bitpar,
+				models=models,
+				hasbacktransform=self.backtransform is not None,
+				tblabelmapping=self.tblabelmapping,
+				rulemapping=self.rulemapping,
+				selfrulemapping=self.selfrulemapping),
+				protocol=pickle.HIGHEST_PROTOCOL)
+		with open(filename, 'wb') as out:
+			out.write(BINGRAMMARMAGIC)
+			out.write(np.array([BINGRAMMARVERSION, offset, len(meta)],
+					dtype=np.uint64).tobytes())
+			for _, data in sections:
+				out.write(data)
+				out.write(b'\0' * ((8 - len(data) % 8) % 8))
+			out.write(meta)
 
 	@classmethod
-	def frombinfile(cls, filename, rulesfile, lexiconfile, backtransform=None):
-		"""Load grammar from cached binary file.
+	def frombinfile(cls, filename, rulesfile=None, lexiconfile=None,
+			backtransform=None):
+		"""Load grammar from a file produced by :meth:`tobinfile`.
+
+		The file is memory mapped; rules are copied to the Grammar object in
+		bulk without parsing or sorting. Alternative weights and the
+		backtransform table are backed by the memory mapped file, so that
+		processes loading the same file share a single copy through the page
+		cache. Grammars loaded with this method are pickled by filename.
 
-		:param filename: file produced by tobinfile() method; format subject to
-			change, recreate as needed.
-		:param rulesfile: original grammar file, used only when pickling."""
+		:param filename: file produced by tobinfile() method; the format is
+			versioned, recreate the file when the version is not supported.
+		:param rulesfile, lexiconfile: optionally, the original grammar files;
+			used only when pickling.
+		:param backtransform: if given, overrides the backtransform table
+			stored in the file."""
 		cdef Grammar ob = Grammar.__new__(Grammar)
-		cdef bytes data
-		cdef char *ptr
+		cdef Py_buffer buffer
+		cdef Py_ssize_t size = 0
+		cdef char *ptr = NULL
 		cdef uint64_t *header
-		cdef size_t idx, n
-		cdef string word
+		cdef uint64_t *offsets
+		cdef uint32_t *lexrulenos
+		cdef size_t n, m, offset, length
 		cdef ProbRule cur
 		cdef Rule key
-		cdef vector[string] words
-
-		# initialization
-		ob.rulesfile = rulesfile
-		ob.lexiconfile = lexiconfile
-		ob.backtransform = backtransform
-		ob.toid = StringIntDict()
-		ob.tolabel = StringList()
-		ob.numunary = ob.numbinary = 0
-		ob.maxfanout = 1
-		ob.logprob = True
-		ob.bitpar = False
-		ob.models = {}
-		ob.altweightsfile = ob.ruletuples = None
-		# read file
+		cdef string word
 		with open(filename, 'rb') as inp:
-			data = inp.read()
-		ptr = <char *>data
-		header = <uint64_t *>ptr
-		idx = 4 * sizeof(uint64_t)
-		ob.nonterminals = header[0]
-		ob.fanout.push_back(0)
-		ob.fanout.resize(ob.nonterminals, 1)
-		# copy freq mass
-		ob.numrules = header[1]
-		ob.freqmass.resize(ob.nonterminals)
-		memcpy(&ob.freqmass[0], &ptr[idx], ob.freqmass.size() * sizeof(Prob))
-		idx += ob.freqmass.size() * sizeof(Prob)
-		# copy bylhs; change prob to freq
-		ob._bylhs.resize(ob.numrules)
-		ob.rulecounts.resize(ob.numrules)
-		memcpy(&ob._bylhs[0], &ptr[idx], ob.numrules * sizeof(ProbRule))
-		idx += ob.numrules * sizeof(ProbRule)
-		for n in range(ob.numrules):
-			ob.rulecounts[ob._bylhs[n].no] = ob._bylhs[n].prob
-			ob._bylhs[n].prob = fabs(log(ob._bylhs[n].prob
-					/ ob.freqmass[ob._bylhs[n].lhs]))
-			ob.fanout[ob._bylhs[n].lhs] = bit_popcount(
-					<uint64_t>ob._bylhs[n].lengths)
-			if ob.fanout[ob._bylhs[n].lhs] > ob.maxfanout:
-				ob.maxfanout = ob.fanout[ob._bylhs[n].lhs]
-			if ob._bylhs[n].rhs2:
-				ob._lbinary.push_back(ob._bylhs[n])
-				ob._rbinary.push_back(ob._bylhs[n])
-				ob.numbinary += 1
-			elif ob._bylhs[n].rhs1:
-				ob._unary.push_back(ob._bylhs[n])
-				ob.numunary += 1
-		assert ob.numrules == ob.numunary + ob.numbinary
-		# sentinel rules
-		cur.lhs = cur.rhs1 = cur.rhs2 = cur.prob = cur.lengths = cur.args = 0
-		ob._bylhs.push_back(cur)
-		ob._unary.push_back(cur)
-		ob._lbinary.push_back(cur)
-		ob._rbinary.push_back(cur)
-		# copy lexical rules
-		ob.lexical.resize(header[2])
-		ob.lexcounts.resize(header[2])
-		memcpy(&ob.lexical[0], &ptr[idx], header[2] * sizeof(LexicalRule))
-		idx += header[2] * sizeof(LexicalRule)
-		for n in range(ob.lexical.size()):
-			ob.lexcounts[n] = ob.lexical[n].prob
-			ob.lexical[n].prob = fabs(log(ob.lexical[n].prob
-					/ ob.freqmass[ob.lexical[n].lhs]))
-		# copy labels
-		ob.tolabel.ob.resize(header[0])
-		ob.toid.ob.reserve(header[0])
-		for n in range(header[0]):
-			ob.tolabel.ob[n] = string(&ptr[idx])
-			ob.toid.ob[ob.tolabel.ob[n]] = n
-			idx += ob.tolabel.ob[n].size() + 1
-		ob.start = ob.tolabel[1]
-		# copy words
-		for n in range(header[3]):
-			word = string(&ptr[idx])
-			idx += word.size() + 1
-			words.push_back(word)
-		ob.lexicalbyword.reserve(header[3])
-		for n in range(header[3]):
-			numlexrules = (<uint32_t *>&ptr[idx])[0]
-			idx += sizeof(uint32_t)
-			word = words[n]
-			ob.lexicalbyword[word].reserve(numlexrules)
-			for _ in range(numlexrules):
-				lexruleno = (<uint32_t *>&ptr[idx])[0]
-				idx += sizeof(uint32_t)
-				ob.lexicalbyword[word].push_back(lexruleno)
-				ob.lexicallhs.insert(ob.lexical[lexruleno].lhs)
-		ob.currentmodel = 'default'
-
-		ob.bylhs.resize(ob.nonterminals)
-		ob.unary.resize(ob.nonterminals)
-		ob.lbinary.resize(ob.nonterminals)
-		ob.rbinary.resize(ob.nonterminals)
-		ob.bylhs[0] = &(ob._bylhs[0])
-		ob.unary[0] = &(ob._unary[0])
-		ob.lbinary[0] = &(ob._lbinary[0])
-		ob.rbinary[0] = &(ob._rbinary[0])
-
-		ob._indexrules(ob.bylhs, 0, 0, ob.numrules)  # already sorted
-		ob._indexrules(ob.unary, 1, 2, 0)
-		ob._indexrules(ob.lbinary, 1, 3, 0)
-		ob._indexrules(ob.rbinary, 2, 3, 0)
-
-		ob.revrulemap.resize(ob.numrules)
-		for n in range(ob.numrules):
-			ob.revrulemap[ob._bylhs[n].no] = n
-		ob.rulenos.reserve(ob.numrules)
-		for n in range(ob.numrules):
-			cur = ob._bylhs[n]
-			key.lhs, key.rhs1, key.rhs2 = cur.lhs, cur.rhs1, cur.rhs2
-			key.args, key.lengths = cur.args, cur.lengths
-			ob.rulenos[key] = cur.no
-
-		ob.tblabelmapping = pickle.loads(data[idx:])
+			buf = mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ)
+		if getbufptr(buf, &ptr, &size, &buffer) != 0:
+			raise ValueError('could not get buffer from mmap.')
+		try:
+			if (<size_t>size < BINGRAMMARHEADER
+					or buf[:len(BINGRAMMARMAGIC)] != BINGRAMMARMAGIC):
+				raise ValueError('not a binary grammar file: %r' % filename)
+			header = <uint64_t *>&ptr[len(BINGRAMMARMAGIC)]
+			if header[0] != BINGRAMMARVERSION:
+				raise ValueError('binary grammar %r has format version %d, '
+						'expected %d; recreate it with tobinfile().' % (
+						filename, header[0], BINGRAMMARVERSION))
+			meta = pickle.loads(buf[header[1]:header[1] + header[2]])
+			sections = meta['sections']
+
+			ob.rulesfile = rulesfile
+			ob.lexiconfile = lexiconfile
+			ob.binfile = filename
+			ob.altweightsfile = ob.ruletuples = None
+			ob.start = meta['start']
+			ob.nonterminals = meta['nonterminals']
+			ob.numrules = meta['numrules']
+			ob.numunary = meta['numunary']
+			ob.numbinary = meta['numbinary']
+			ob.maxfanout = meta['maxfanout']
+			ob.bitpar = meta['bitpar']
+			ob.tblabelmapping = meta['tblabelmapping']
+			ob.rulemapping = meta['rulemapping']
+			ob.selfrulemapping = meta['selfrulemapping']
+			ob.logprob = True
+			ob.currentmodel = 'default'
+
+			offset, length = sections['fanout']
+			ob.fanout.resize(length // sizeof(uint8_t))
+			memcpy(ob.fanout.data(), &ptr[offset], length)
+			offset, length = sections['freqmass']
+			ob.freqmass.resize(length // sizeof(Prob))
+			memcpy(ob.freqmass.data(), &ptr[offset], length)
+			offset, length = sections['rulecounts']
+			ob.rulecounts.resize(length // sizeof(Prob))
+			memcpy(ob.rulecounts.data(), &ptr[offset], length)
+			offset, length = sections['lexcounts']
+			ob.lexcounts.resize(length // sizeof(Prob))
+			memcpy(ob.lexcounts.data(), &ptr[offset], length)
+			offset, length = sections['revrulemap']
+			ob.revrulemap.resize(length // sizeof(uint32_t))
+			memcpy(ob.revrulemap.data(), &ptr[offset], length)
+			offset, length = sections['lexical']
+			ob.lexical.resize(length // sizeof(LexicalRule))
+			memcpy(ob.lexical.data(), &ptr[offset], length)
+			_readruletable(ptr, sections, 'bylhs', &ob._bylhs, &ob.bylhs)
+			_readruletable(ptr, sections, 'unary', &ob._unary, &ob.unary)
+			_readruletable(ptr, sections, 'lbinary', &ob._lbinary, &ob.lbinary)
+			_readruletable(ptr, sections, 'rbinary', &ob._rbinary, &ob.rbinary)
+			for n in range(ob.numrules):
+				cur = ob._bylhs[n]
+				key.lhs, key.rhs1, key.rhs2 = cur.lhs, cur.rhs1, cur.rhs2
+				key.args, key.lengths = cur.args, cur.lengths
+				ob.rulenos[key] = cur.no
+
+			ob.tolabel = StringList()
+			ob.toid = StringIntDict()
+			_readstringtable(ptr, sections, 'labels', &ob.tolabel.ob)
+			ob.toid.ob.reserve(ob.tolabel.ob.size())
+			for n in range(ob.tolabel.ob.size()):
+				ob.toid.ob[ob.tolabel.ob[n]] = n
+			words = StringList()
+			_readstringtable(ptr, sections, 'words', &words.ob)
+			offsets = <uint64_t *>&ptr[sections['lexoffsets'][0]]
+			lexrulenos = <uint32_t *>&ptr[sections['lexrulenos'][0]]
+			ob.lexicalbyword.reserve(words.ob.size())
+			for n in range(words.ob.size()):
+				word = words.ob[n]
+				ob.lexicalbyword[word].reserve(offsets[n + 1] - offsets[n])
+				for m in range(offsets[n], offsets[n + 1]):
+					ob.lexicalbyword[word].push_back(lexrulenos[m])
+			for n in range(ob.lexical.size()):
+				ob.lexicallhs.insert(ob.lexical[n].lhs)
+
+			offset, length = sections['mapping']
+			ob.mapping.resize(length // sizeof(Label))
+			memcpy(ob.mapping.data(), &ptr[offset], length)
+			offset, length = sections['selfmapping']
+			ob.selfmapping.resize(length // sizeof(Label))
+			memcpy(ob.selfmapping.data(), &ptr[offset], length)
+			_readraggedtable(ptr, sections, 'splitmapping', &ob.splitmapping)
+			_readraggedtable(ptr, sections, 'revmap', &ob.revmap)
+
+			if backtransform is not None:
+				ob.backtransform = backtransform
+			elif meta['hasbacktransform']:
+				bt = MappedStringList()
+				bt.buf = buf
+				bt.offsets = <uint64_t *>&ptr[
+						sections['backtransformoffsets'][0]]
+				bt.data = &ptr[sections['backtransform'][0]]
+				bt.size = (sections['backtransformoffsets'][1]
+						// sizeof(uint64_t))
+				ob.backtransform = bt
+			else:
+				ob.backtransform = None
+			# zero-copy: arrays refer to the memory mapped file.
+			ob.models = {name: np.frombuffer(buf, dtype=np.float64,
+					count=sections['model:' + name][1] // sizeof(Prob),
+					offset=sections['model:' + name][0])
+					for name in meta['models']}
+		finally:
+			PyBuffer_Release(&buffer)
 		return ob
 
 	def addrules(self, bytes rules, bytes lexicon, backtransform=None,
@@ -322,6 +391,9 @@ cdef class Grammar:
 			self._unary.pop_back()
 			self._lbinary.pop_back()
 			self._rbinary.pop_back()
+		if backtransform is not None and isinstance(
+				self.backtransform, MappedStringList):
+			self.backtransform = list(self.backtransform)
 		self._convertrules(rules, backtransform)
 		self._convertlexicon(lexicon, checkdup=init)
 		self.nonterminals = self.toid.ob.size()
@@ -390,170 +462,108 @@ cdef class Grammar:
 
 	def _convertrules(self, bytes rules, list backtransform=None):
 		"""Count unary & binary rules; make a canonical list of all
-		non-terminal labels and assign them unique IDs."""
+		non-terminal labels and assign them unique IDs.
+
+		Lines are tokenized and their yield functions and weights parsed in
+		parallel, in line-aligned chunks without the GIL; the parsed rules
+		are then added in order, since label IDs and rule numbers depend on
+		the order in which they are encountered."""
 		cdef uint32_t n = self.numrules, m
 		cdef uint32_t lineno = 0
-		cdef Prob w
+		cdef int chunk
+		cdef int numchunks
+		cdef bint bitpar = self.bitpar
 		cdef ProbRule cur
 		cdef Rule key
-		cdef string yf = b'<none>'
-		cdef string weight
-		cdef uint8_t fanout = 1, rhs1fanout = 1, rhs2fanout = 1
-		cdef const char *buf = <const char*>rules
-		cdef const char *prev
-		cdef vector[string] fields
+		cdef ParsedRule *parsedrule
+		cdef vector[vector[ParsedRule]] parsed
+		cdef vector[const char *] bounds
 		cdef vector[string] rule
-		while True:
-			fields.clear()
-			prev = buf
-			buf = readfields(buf, fields)
-			if buf is NULL:
-				break
-			elif fields.size() == 0:
-				continue
-			if self.bitpar:
-				weight = fields[0]
-				fields.erase(fields.begin())
-				rule = fields
-				# NB: leave yf at b'<none>'
-				if rule.size() > 1:
-					cur.args, cur.lengths = 0b10, 0b10
-				else:
-					cur.args, cur.lengths = 0b0, 0b1
-			else:
-				weight = fields[fields.size() - 1]
-				yf = fields[fields.size() - 2]
-				fields.pop_back()
-				fields.pop_back()
-				rule = fields
-				cur.lengths = cur.args = m = 0
-				fanout = 1
-				rhs1fanout = rhs2fanout = 0
-				for a in yf:
-					if a == b',':
-						cur.lengths |= 1 << (m - 1)
-						fanout += 1
-						continue
-					elif a == b'0':
-						rhs1fanout += 1
-					elif a == b'1':
-						cur.args += 1 << m
-						rhs2fanout += 1
-					else:
-						raise ValueError('invalid symbol in yield function: %r'
-								' (not in set [01,])\n%r' % (
-								a, prev[:buf - prev].decode('utf8')))
-					m += 1
-				cur.lengths |= 1 << (m - 1)
-				if m >= (8 * sizeof(cur.args)):
-					raise ValueError(
-							'Parsing complexity (%d) too high (max %d).\n'
-							'Rule: %r' % (m, (8 * sizeof(cur.args)),
-							prev[:buf - prev].decode('utf8')))
-				if rule.size() == 2:
-					# if not YFUNARYRE.match(yf):
-					if rhs1fanout == 0 or rhs2fanout != 0:
-						raise ValueError('expected unary yield function: '
-								'%r\t%r' % (yf, rule))
-				elif rule.size() == 3:
-					# if not YFBINARY.match(yf):
-					if rhs1fanout == 0 or rhs2fanout == 0:
-						raise ValueError('expected binary yield function: '
-								'%r\t%r' % (yf, rule))
-					# if b'0' not in yf or b'1' not in yf:
-					# 	raise ValueError('mismatch between non-terminals and '
-					# 			'yield function: %r' %
-					# 			prev[:buf - prev].decode('utf8'))
-			it = self.toid.ob.find(rule[0])
-			if it == self.toid.ob.end():
-				cur.lhs = self.toid.ob[rule[0]] = self.tolabel.ob.size()
-				self.tolabel.ob.push_back(rule[0])
-				self.freqmass.push_back(0)
-				self.fanout.push_back(fanout)
-				if fanout > self.maxfanout:
-					self.maxfanout = fanout
-			else:
-				cur.lhs = dereference(it).second
-				if self.fanout[cur.lhs] != fanout:
-					raise ValueError("conflicting fanouts for symbol "
-						"%r.\nprevious: %d; this non-terminal: %d. rule:\n%r"
-						% (rule[0], self.fanout[cur.lhs], fanout,
-						prev[:buf - prev].decode('utf8')))
-			it = self.toid.ob.find(rule[1])
-			if it == self.toid.ob.end():
-				cur.rhs1 = self.toid.ob[rule[1]] = self.tolabel.ob.size()
-				self.tolabel.ob.push_back(rule[1])
-				self.freqmass.push_back(0)
-				self.fanout.push_back(rhs1fanout)
-				if rhs1fanout > self.maxfanout:
-					self.maxfanout = rhs1fanout
-			else:
-				cur.rhs1 = dereference(it).second
-			if cur.lhs == 0 or cur.rhs1 == 0:
-				raise ValueError('Epsilon symbol may only occur '
-						'in RHS of lexical rules:\n%r' %
-						prev[:buf - prev].decode('utf8'))
-			if rule.size() == 2:
+		cdef size_t k
+		cdef Label *labels[3]
+		cdef uint8_t fanouts[3]
+		labels[0], labels[1], labels[2] = &cur.lhs, &cur.rhs1, &cur.rhs2
+		chunkbounds(<const char *>rules, len(rules), bounds)
+		numchunks = bounds.size() - 1
+		parsed.resize(numchunks)
+		with nogil:
+			for chunk in prange(numchunks, schedule='dynamic'):
+				parserules(bounds[chunk], bounds[chunk + 1], bitpar,
+						&parsed[chunk])
+		for chunk in range(numchunks):
+			for k in range(parsed[chunk].size()):
+				parsedrule = &(parsed[chunk][k])
+				if parsedrule.error:
+					ruleerror(parsedrule)
+				rule.clear()
+				for m in range(parsedrule.numlabels):
+					rule.push_back(string(
+							parsedrule.labels[m], parsedrule.labellens[m]))
+				cur.args = parsedrule.args
+				cur.lengths = parsedrule.lengths
 				cur.rhs2 = 0
-			elif rule.size() == 3:
-				it = self.toid.ob.find(rule[2])
-				if it == self.toid.ob.end():
-					cur.rhs2 = self.toid.ob[rule[2]] = self.tolabel.ob.size()
-					self.tolabel.ob.push_back(rule[2])
-					self.freqmass.push_back(0)
-					self.fanout.push_back(rhs2fanout)
-					if rhs2fanout > self.maxfanout:
-						self.maxfanout = rhs2fanout
-				else:
-					cur.rhs2 = dereference(it).second
-				if cur.rhs2 == 0:
+				fanouts[0] = parsedrule.fanout
+				fanouts[1] = parsedrule.rhs1fanout
+				fanouts[2] = parsedrule.rhs2fanout
+				for m in range(rule.size()):
+					it = self.toid.ob.find(rule[m])
+					if it == self.toid.ob.end():
+						labels[m][0] = self.toid.ob[rule[m]] = (
+								self.tolabel.ob.size())
+						self.tolabel.ob.push_back(rule[m])
+						self.freqmass.push_back(0)
+						self.fanout.push_back(fanouts[m])
+						if fanouts[m] > self.maxfanout:
+							self.maxfanout = fanouts[m]
+					else:
+						labels[m][0] = dereference(it).second
+						if m == 0 and self.fanout[cur.lhs] != fanouts[0]:
+							raise ValueError("conflicting fanouts for symbol "
+								"%r.\nprevious: %d; this non-terminal: %d. "
+								"rule:\n%r" % (rule[0], self.fanout[cur.lhs],
+								fanouts[0],
+								getline(parsedrule.line, parsedrule.end)))
+				if cur.lhs == 0 or cur.rhs1 == 0 or (
+						rule.size() == 3 and cur.rhs2 == 0):
 					raise ValueError('Epsilon symbol may only occur '
 							'in RHS of lexical rules:\n%r'
-						% prev[:buf - prev].decode('utf8'))
-			elif rule.size() < 2:
-				raise ValueError('Not enough nonterminals:\n%r'
-						% prev[:buf - prev].decode('utf8'))
-			else:
-				raise ValueError('Grammar not binarized:\n%r\n%r'
-						% (list(rule), prev[:buf - prev].decode('utf8')))
-			if cur.rhs1 == 1 or cur.rhs2 == 1:
-				raise ValueError('Start symbol should only occur on LHS:\n%r'
-						% prev[:buf - prev].decode('utf8'))
-			w = convertweight(weight.c_str())
-			if w <= 0:
-				raise ValueError('Expected positive non-zero weight\n%r'
-						% prev[:buf - prev].decode('utf8'))
-			key.lhs, key.rhs1, key.rhs2 = cur.lhs, cur.rhs1, cur.rhs2
-			key.args, key.lengths = cur.args, cur.lengths
-			it1 = self.rulenos.find(key)
-			if it1 == self.rulenos.end():  # add new rule
-				self.rulenos[key] = n
-				cur.no = n
-				cur.prob = w  # fabs(log(w))
-				self.rulecounts.push_back(w)
-				self._bylhs.push_back(cur)
-				if backtransform is not None and lineno < len(backtransform):
-					# new fragments come AFTER rules without fragments,
-					# so a gap is created; either fill gap [below],
-					# or re-order previous rules,
-					# FIXME: or use hashtable / sparsetable for backtransform.
-					if len(self.backtransform) != n:
-						self.backtransform.extend(
-								[None] * (n - len(self.backtransform)))
-					self.backtransform.append(backtransform[lineno])
-				if rule.size() == 2:
-					self.numunary += 1
-					self._unary.push_back(cur)
-				elif rule.size() == 3:
-					self.numbinary += 1
-					self._lbinary.push_back(cur)
-					self._rbinary.push_back(cur)
-				n += 1
-			else:  # update weight of existing rule
-				m = dereference(it1).second
-				self.rulecounts[m] += w
-			self.freqmass[cur.lhs] += w
-			lineno += 1
+							% getline(parsedrule.line, parsedrule.end))
+				if cur.rhs1 == 1 or cur.rhs2 == 1:
+					raise ValueError('Start symbol should only occur on LHS:'
+							'\n%r' % getline(parsedrule.line, parsedrule.end))
+				key.lhs, key.rhs1, key.rhs2 = cur.lhs, cur.rhs1, cur.rhs2
+				key.args, key.lengths = cur.args, cur.lengths
+				it1 = self.rulenos.find(key)
+				if it1 == self.rulenos.end():  # add new rule
+					self.rulenos[key] = n
+					cur.no = n
+					cur.prob = parsedrule.weight  # fabs(log(w))
+					self.rulecounts.push_back(parsedrule.weight)
+					self._bylhs.push_back(cur)
+					if (backtransform is not None
+							and lineno < len(backtransform)):
+						# new fragments come AFTER rules without fragments,
+						# so a gap is created; either fill gap [below],
+						# or re-order previous rules,
+						# FIXME: or use hashtable / sparsetable for
+						# backtransform.
+						if len(self.backtransform) != n:
+							self.backtransform.extend(
+									[None] * (n - len(self.backtransform)))
+						self.backtransform.append(backtransform[lineno])
+					if rule.size() == 2:
+						self.numunary += 1
+						self._unary.push_back(cur)
+					elif rule.size() == 3:
+						self.numbinary += 1
+						self._lbinary.push_back(cur)
+						self._rbinary.push_back(cur)
+					n += 1
+				else:  # update weight of existing rule
+					m = dereference(it1).second
+					self.rulecounts[m] += parsedrule.weight
+				self.freqmass[cur.lhs] += parsedrule.weight
+				lineno += 1
 
 		self.numrules = self.numunary + self.numbinary
 		# sentinel rules
@@ -566,44 +576,52 @@ cdef class Grammar:
 			raise ValueError('No rules found')
 
 	def _convertlexicon(self, bytes lexicon, bint checkdup=True):
-		"""Make objects for lexical rules."""
-		cdef int x
-		cdef Prob w
-		cdef const char *buf = <const char*>lexicon
-		cdef const char *prev
-		cdef vector[string] fields
-		cdef string tag, weight
+		"""Make objects for lexical rules.
+
+		As with rules, lines are parsed in parallel chunks and added in
+		order."""
+		cdef int chunk
+		cdef int numchunks
+		cdef string tag
 		cdef string word
 		cdef LexicalRule lexrule
-		cdef uint32_t lexruleno, m
-		cdef vector[uint32_t].iterator first
-		cdef size_t orignumrules
-
-		while True:
-			fields.clear()
-			prev = buf
-			buf = readfields(buf, fields)
-			if buf is NULL:
-				break
-			elif fields.size() == 0:
-				continue
-			elif fields.size() == 1:
-				raise ValueError('Expected: word<TAB>tag1<SPACE>weight1...'
-						'Got: %r' % prev[:buf - prev].decode('utf8'))
-			word = fields[0]
-			if (checkdup and self.lexicalbyword.find(word)
-					!= self.lexicalbyword.end()):
-				raise ValueError('word %r appears more than once '
-						'in lexicon file' % unescape(word.decode('utf8')))
-			orignumrules = self.lexicalbyword[word].size()
-			for n in range(1, fields.size()):
-				x = fields[n].find_first_of(ord(b' '))
-				if x > fields[n].size():
+		cdef uint32_t lexruleno
+		cdef size_t k, orignumrules = 0
+		cdef bint haveword = False
+		cdef ParsedLexRule *parsedrule
+		cdef vector[vector[ParsedLexRule]] parsed
+		cdef vector[const char *] bounds
+		chunkbounds(<const char *>lexicon, len(lexicon), bounds)
+		numchunks = bounds.size() - 1
+		parsed.resize(numchunks)
+		with nogil:
+			for chunk in prange(numchunks, schedule='dynamic'):
+				parselexicon(bounds[chunk], bounds[chunk + 1],
+						&parsed[chunk])
+		for chunk in range(numchunks):
+			for k in range(parsed[chunk].size()):
+				parsedrule = &(parsed[chunk][k])
+				if parsedrule.first:
+					if haveword:
+						self._sortlexical(word, orignumrules)
+					if parsedrule.error == 1:
+						raise ValueError('Expected: word<TAB>tag1<SPACE>'
+								'weight1...Got: %r'
+								% getline(parsedrule.line, parsedrule.end))
+					word = string(parsedrule.word, parsedrule.wordlen)
+					if (checkdup and self.lexicalbyword.find(word)
+							!= self.lexicalbyword.end()):
+						raise ValueError('word %r appears more than once '
+								'in lexicon file' % unescape(
+									word.decode('utf8')))
+					orignumrules = self.lexicalbyword[word].size()
+					haveword = True
+				if parsedrule.error == 2:
 					raise ValueError('Expected: word<TAB>tag1<SPACE>weight1'
 							'<TAB>tag2<SPACE>weight2...\n'
-							'Got: %r' % prev[:buf - prev].decode('utf8'))
-				tag = string(fields[n].c_str(), x)
-				weight = string(fields[n].c_str() + x + 1)
+							'Got: %r'
+							% getline(parsedrule.line, parsedrule.end))
+				tag = string(parsedrule.tag, parsedrule.taglen)
 				it = self.toid.ob.find(tag)
 				if it == self.toid.ob.end():
 					lexrule.lhs = self.toid.ob[tag] = self.tolabel.ob.size()
@@ -619,39 +637,45 @@ cdef class Grammar:
 					if self.fanout[lexrule.lhs] != 1:
 						raise ValueError('POS tag %r has fan-out %d, may only'
 								' be 1.' % (self.fanout[lexrule.lhs], tag))
-				w = convertweight(weight.c_str())
-				if w <= 0:
+				if parsedrule.error == 3:
 					raise ValueError('weights should be positive '
 							'and non-zero:\n%r'
-							% prev[:buf - prev].decode('utf8'))
+							% getline(parsedrule.line, parsedrule.end))
 				it1 = self.lexicalbyword.find(word)
 				found = False
 				if it1 != self.lexicalbyword.end():
 					for lexruleno in dereference(it1).second:
 						if self.lexical[lexruleno].lhs == lexrule.lhs:
 							# update weight
-							self.lexcounts[lexruleno] += w
+							self.lexcounts[lexruleno] += parsedrule.weight
 							found = True
 							break
 				if not found:
 					lexruleno = self.lexical.size()
-					lexrule.prob = w  # fabs(log(w))
-					self.lexcounts.push_back(w)
+					lexrule.prob = parsedrule.weight  # fabs(log(w))
+					self.lexcounts.push_back(parsedrule.weight)
 					self.lexical.push_back(lexrule)
 					self.lexicallhs.insert(lexrule.lhs)
 					self.lexicalbyword[word].push_back(lexruleno)
-				self.freqmass[lexrule.lhs] += w
-			first = self.lexicalbyword[word].begin()
-			m = self.lexicalbyword[word].size()
-			# sort new rules for this word
-			stdsort(first + orignumrules, first + m, LexCmp(self.lexical))
-			# merge sorted new rules with existing sorted rules
-			inplace_merge(
-					first, first + orignumrules, first + m,
-					LexCmp(self.lexical))
+				self.freqmass[lexrule.lhs] += parsedrule.weight
+		if haveword:
+			self._sortlexical(word, orignumrules)
 		if self.lexical.size() == 0:
 			raise ValueError('no lexical rules found.')
 
+	cdef _sortlexical(self, string word, size_t orignumrules):
+		"""Sort the lexical rules added for a word after existing ones."""
+		cdef vector[uint32_t].iterator first
+		cdef uint32_t m
+		first = self.lexicalbyword[word].begin()
+		m = self.lexicalbyword[word].size()
+		# sort new rules for this word
+		stdsort(first + orignumrules, first + m, LexCmp(self.lexical))
+		# merge sorted new rules with existing sorted rules
+		inplace_merge(
+				first, first + orignumrules, first + m,
+				LexCmp(self.lexical))
+
 	cdef _indexrules(Grammar self, vector[ProbRule *]& dest, int idx,
 			int filterlen, int orignumrules):
 		"""Auxiliary function to create Grammar objects. Copies certain
@@ -706,8 +730,8 @@ cdef class Grammar:
 
 	def switch(self, str name, bint logprob=True):
 		cdef int n
-		cdef Prob *tmp
-		cdef Prob [:] ob
+		cdef const Prob *tmp
+		cdef const Prob [:] ob
 		cdef size_t numweights = self.numrules + self.lexical.size()
 		if self.currentmodel == name and self.logprob == logprob:
 			return
@@ -792,8 +816,8 @@ cdef class Grammar:
 			for n in range(self.lexical.size()):
 				tmp[self.numrules + n] = (self.lexcounts[n]
 						/ self.freqmass[self.lexical[n].lhs])
-		else:
-			tmp = self.models[self.currentmodel]
+		else:  # models may be read-only, memory mapped arrays
+			tmp = np.array(self.models[self.currentmodel], dtype=np.float64)
 		# We could be strict about separating POS tags and phrasal categories,
 		# but Negra contains at least one tag (--) used for both.
 		for n in range(self.numrules):
@@ -1053,11 +1077,106 @@ cdef class Grammar:
 
 	def __reduce__(self):
 		"""Helper function for pickling."""
+		if self.binfile is not None:
+			return (_frombinfile, (self.binfile, self.currentmodel,
+					self.logprob))
 		return (Grammar, (self.rulesfile or self.ruletuples, self.lexiconfile,
 				self.start, self.altweightsfile or self.models))
 
 
-cdef inline Prob convertweight(const char *weight):
+cdef bytes _vecbytes(const void *data, size_t size):
+	"""Copy ``size`` bytes at ``data`` to a bytes object."""
+	if size == 0:
+		return b''
+	return (<const char *>data)[:size]
+
+
+cdef list _ruletable(str name, vector[ProbRule] *rules,
+		vector[ProbRule *] *index):
+	"""Sections for a sorted vector of rules and pointers into it."""
+	cdef vector[uint64_t] offsets
+	cdef size_t n
+	for n in range(index.size()):
+		offsets.push_back(index[0][n] - rules.data())
+	return [(name, _vecbytes(rules.data(), rules.size() * sizeof(ProbRule))),
+			(name + 'idx', _vecbytes(
+				offsets.data(), offsets.size() * sizeof(uint64_t)))]
+
+
+cdef list _stringtable(str name, strings):
+	"""Sections for a sequence of bytes: end offsets, concatenated strings."""
+	cdef vector[uint64_t] offsets
+	cdef size_t n = 0
+	for a in strings:
+		n += len(a)
+		offsets.push_back(n)
+	return [(name + 'offsets', _vecbytes(
+				offsets.data(), offsets.size() * sizeof(uint64_t))),
+			(name, b''.join(strings))]
+
+
+cdef list _raggedtable(str name, vector[vector[Label]] *table):
+	"""Sections for a vector of vectors: end offsets, concatenated values."""
+	cdef vector[uint64_t] offsets
+	cdef vector[Label] values
+	cdef size_t n
+	for n in range(table.size()):
+		values.insert(values.end(), table[0][n].begin(), table[0][n].end())
+		offsets.push_back(values.size())
+	return [(name + 'offsets', _vecbytes(
+				offsets.data(), offsets.size() * sizeof(uint64_t))),
+			(name, _vecbytes(values.data(), values.size() * sizeof(Label)))]
+
+
+cdef _readruletable(char *ptr, dict sections, str name,
+		vector[ProbRule] *rules, vector[ProbRule *] *index):
+	"""Copy rules from binary grammar and restore pointers into them."""
+	cdef uint64_t *offsets
+	cdef size_t n, offset, length
+	offset, length = sections[name]
+	rules.resize(length // sizeof(ProbRule))
+	memcpy(rules.data(), &ptr[offset], length)
+	offset, length = sections[name + 'idx']
+	offsets = <uint64_t *>&ptr[offset]
+	index.resize(length // sizeof(uint64_t))
+	for n in range(index.size()):
+		index[0][n] = rules.data() + offsets[n]
+
+
+cdef _readstringtable(char *ptr, dict sections, str name,
+		vector[string] *result):
+	"""Read strings stored with ``_stringtable()``."""
+	cdef uint64_t *offsets = <uint64_t *>&ptr[sections[name + 'offsets'][0]]
+	cdef char *data = &ptr[sections[name][0]]
+	cdef size_t n, prev = 0
+	cdef size_t numstrings = sections[name + 'offsets'][1] // sizeof(uint64_t)
+	result.reserve(numstrings)
+	for n in range(numstrings):
+		result.push_back(string(&data[prev], offsets[n] - prev))
+		prev = offsets[n]
+
+
+cdef _readraggedtable(char *ptr, dict sections, str name,
+		vector[vector[Label]] *result):
+	"""Read vector of vectors stored with ``_raggedtable()``."""
+	cdef uint64_t *offsets = <uint64_t *>&ptr[sections[name + 'offsets'][0]]
+	cdef Label *data = <Label *>&ptr[sections[name][0]]
+	cdef size_t n, prev = 0
+	cdef size_t numvectors = sections[name + 'offsets'][1] // sizeof(uint64_t)
+	result.resize(numvectors)
+	for n in range(numvectors):
+		result[0][n].assign(&data[prev], &data[offsets[n]])
+		prev = offsets[n]
+
+
+def _frombinfile(filename, model='default', logprob=True):
+	"""Helper function for unpickling a grammar loaded from a binary file."""
+	cdef Grammar result = Grammar.frombinfile(filename)
+	result.switch(model, logprob=logprob)
+	return result
+
+
+cdef inline Prob convertweight(const char *weight) nogil:
 	"""Convert weight to float/double; weight may be a fraction '1/2'
 	(returns only first part of fraction), decimal float '0.5',
 	or hex float '0x1.0p-1'. Returns 0 on error."""
@@ -1070,21 +1189,238 @@ cdef inline Prob convertweight(const char *weight):
 	return w
 
 
-cdef inline const char *readfields(const char *buf, vector[string] &result):
-	"""Tokenize a tab-separated line in a string.
-
-	:returns: a pointer of the new position in buf,
-		or NULL if end of string was reached.
-		result is extended with the tokens encountered."""
-	cdef const char *endofline = strchr(buf, b'\n')
-	cdef const char *tmp
-	if endofline is NULL:
-		# NB: if last last line has no end of line, its tokens will be ignored.
-		return NULL
-	tmp = strchr(buf, b'\t')
-	while tmp is not NULL and tmp < endofline:
-		result.push_back(string(buf, tmp - buf))
-		buf = tmp + 1
-		tmp = strchr(buf, b'\t')
-	result.push_back(string(buf, endofline - buf))
-	return endofline + 1
+cdef inline Prob parseweight(const char *weight, size_t length) nogil:
+	"""Convert weight in a string that is not NUL-terminated.
+
+	Returns 0 on error."""
+	cdef char buf[64]
+	cdef char *tmp = buf
+	cdef Prob result
+	if length >= sizeof(buf):  # unusually long; e.g., many digits
+		tmp = <char *>malloc(length + 1)
+		if tmp is NULL:
+			return 0
+	memcpy(tmp, weight, length)
+	tmp[length] = 0
+	result = convertweight(tmp)
+	if length >= sizeof(buf):
+		free(tmp)
+	return result
+
+
+cdef inline int splitline(const char *buf, const char *endofline,
+		const char **fields, uint32_t *lengths) nogil:
+	"""Tokenize a tab-separated line; store up to MAXFIELDS fields.
+
+	:returns: the number of fields in the line."""
+	cdef const char *tab
+	cdef int n = 0
+	while True:
+		tab = <const char *>memchr(buf, b'\t', endofline - buf)
+		if n < MAXFIELDS:
+			fields[n] = buf
+			lengths[n] = (endofline if tab is NULL else tab) - buf
+		n += 1
+		if tab is NULL:
+			return n
+		buf = tab + 1
+
+
+cdef void chunkbounds(const char *buf, size_t size,
+		vector[const char *] &result) nogil:
+	"""Split buf into chunks of about LOADCHUNKSIZE bytes ending in newlines.
+
+	result will contain the start of each chunk, followed by the end of buf.
+	"""
+	cdef const char *end = buf + size
+	cdef const char *endofline
+	result.push_back(buf)
+	while <size_t>(end - buf) > LOADCHUNKSIZE:
+		endofline = <const char *>memchr(
+				buf + LOADCHUNKSIZE, b'\n', end - buf - LOADCHUNKSIZE)
+		if endofline is NULL:
+			break
+		buf = endofline + 1
+		result.push_back(buf)
+	if result.back() != end:
+		result.push_back(end)
+
+
+cdef void parserules(const char *buf, const char *end, bint bitpar,
+		vector[ParsedRule] *result) nogil:
+	"""Tokenize rules and parse their yield functions and weights.
+
+	Errors are not raised but recorded; cf. ruleerror()."""
+	cdef ParsedRule cur
+	cdef const char *endofline
+	cdef const char *fields[MAXFIELDS]
+	cdef uint32_t lengths[MAXFIELDS]
+	cdef const char *yf
+	cdef uint32_t n, m
+	cdef int numfields, firstlabel, weightfield
+	cdef char a
+	while buf < end:
+		endofline = <const char *>memchr(buf, b'\n', end - buf)
+		if endofline is NULL:
+			# NB: if last last line has no end of line, it will be ignored.
+			break
+		numfields = splitline(buf, endofline, fields, lengths)
+		cur.line, cur.end = buf, endofline
+		buf = endofline + 1
+		if numfields == 1 and lengths[0] == 0:
+			continue
+		cur.error = cur.numvars = 0
+		cur.fanout = cur.rhs1fanout = cur.rhs2fanout = 1
+		if bitpar:
+			weightfield, firstlabel = 0, 1
+			cur.numlabels = numfields - 1
+			# NB: yield function is implicit
+			if cur.numlabels > 1:
+				cur.args, cur.lengths = 0b10, 0b10
+			else:
+				cur.args, cur.lengths = 0b0, 0b1
+		elif numfields < 2:
+			weightfield, firstlabel = 0, 0
+			cur.numlabels = 0
+		else:
+			weightfield, firstlabel = numfields - 1, 0
+			cur.numlabels = numfields - 2
+		if numfields > MAXFIELDS:
+			cur.error = 6
+		elif cur.numlabels < 2:
+			cur.error = 5
+		elif cur.numlabels > 3:
+			cur.error = 6
+		elif not bitpar:
+			yf = fields[numfields - 2]
+			cur.lengths = cur.args = m = 0
+			cur.fanout = 1
+			cur.rhs1fanout = cur.rhs2fanout = 0
+			for n in range(lengths[numfields - 2]):
+				a = yf[n]
+				if a == b',':
+					cur.lengths |= 1 << (m - 1)
+					cur.fanout += 1
+					continue
+				elif a == b'0':
+					cur.rhs1fanout += 1
+				elif a == b'1':
+					cur.args += 1 << m
+					cur.rhs2fanout += 1
+				else:
+					cur.error = 1
+					cur.badsymbol = a
+					break
+				m += 1
+				if m >= (8 * sizeof(cur.args)):
+					cur.error = 2
+					break
+			cur.numvars = m
+			if cur.error == 0:
+				cur.lengths |= 1 << (m - 1)
+				if cur.numlabels == 2 and (
+						cur.rhs1fanout == 0 or cur.rhs2fanout != 0):
+					cur.error = 3
+				elif cur.numlabels == 3 and (
+						cur.rhs1fanout == 0 or cur.rhs2fanout == 0):
+					cur.error = 4
+		if cur.error == 0:
+			for n in range(cur.numlabels):
+				cur.labels[n] = fields[firstlabel + n]
+				cur.labellens[n] = lengths[firstlabel + n]
+			cur.weight = parseweight(
+					fields[weightfield], lengths[weightfield])
+			if cur.weight <= 0:
+				cur.error = 7
+		result.push_back(cur)
+
+
+cdef inline str getline(const char *line, const char *end):
+	"""Decode a line of a grammar file for an error message."""
+	return line[:end - line].decode('utf8')
+
+
+cdef ruleerror(ParsedRule *rule):
+	"""Raise the error that was recorded while parsing a rule."""
+	cdef bytes line = rule.line[:rule.end - rule.line]
+	cdef list fields = line.split(b'\t')
+	cdef int n = len(fields) - 2  # index of yield function
+	if rule.error == 1:
+		raise ValueError('invalid symbol in yield function: %r'
+				' (not in set [01,])\n%r' % (
+				chr(rule.badsymbol), line.decode('utf8')))
+	elif rule.error == 2:
+		raise ValueError(
+				'Parsing complexity (%d) too high (max %d).\n'
+				'Rule: %r' % (rule.numvars, (8 * sizeof(rule.args)),
+				line.decode('utf8')))
+	elif rule.error == 3:
+		raise ValueError('expected unary yield function: '
+				'%r\t%r' % (fields[n], fields[:n]))
+	elif rule.error == 4:
+		raise ValueError('expected binary yield function: '
+				'%r\t%r' % (fields[n], fields[:n]))
+	elif rule.error == 5:
+		raise ValueError('Not enough nonterminals:\n%r' % line.decode('utf8'))
+	elif rule.error == 6:
+		raise ValueError('Grammar not binarized:\n%r\n%r' % (
+				fields[1:] if rule.numlabels + 1 == len(fields)
+				else fields[:n], line.decode('utf8')))
+	elif rule.error == 7:
+		raise ValueError('Expected positive non-zero weight\n%r'
+				% line.decode('utf8'))
+
+
+cdef void parselexicon(const char *buf, const char *end,
+		vector[ParsedLexRule] *result) nogil:
+	"""Tokenize lexicon entries and parse their weights.
+
+	Each tag of a word yields a ParsedLexRule; errors are recorded in the
+	``error`` field."""
+	cdef ParsedLexRule cur
+	cdef const char *endofline
+	cdef const char *field
+	cdef const char *fieldend
+	cdef const char *tab
+	cdef const char *space
+	while buf < end:
+		endofline = <const char *>memchr(buf, b'\n', end - buf)
+		if endofline is NULL:
+			# NB: if last last line has no end of line, it will be ignored.
+			break
+		cur.line, cur.end = buf, endofline
+		cur.word = buf
+		cur.first = True
+		cur.tag = NULL
+		cur.taglen = 0
+		cur.weight = 0
+		tab = <const char *>memchr(buf, b'\t', endofline - buf)
+		buf = endofline + 1
+		if tab is NULL:
+			cur.wordlen = endofline - cur.word
+			if cur.wordlen != 0:  # skip empty lines
+				cur.error = 1
+				result.push_back(cur)
+			continue
+		cur.wordlen = tab - cur.word
+		field = tab + 1
+		while True:
+			tab = <const char *>memchr(field, b'\t', endofline - field)
+			fieldend = endofline if tab is NULL else tab
+			space = <const char *>memchr(field, b' ', fieldend - field)
+			cur.tag = field
+			cur.error = 0
+			if space is NULL:
+				cur.taglen = fieldend - field
+				cur.weight = 0
+				cur.error = 2
+			else:
+				cur.taglen = space - field
+				cur.weight = parseweight(space + 1, fieldend - space - 1)
+				if cur.weight <= 0:
+					cur.error = 3
+			result.push_back(cur)
+			cur.first = False
+			if tab is NULL:
+				break
+			field = tab + 1
@@ -0,0 +1,304 @@
+"""Benchmark the parsing pipeline and check for performance regressions.
+
+Times grammar extraction, parsing and its phases, fragment extraction and
+tree search on the sample treebanks distributed with disco-dop, as well as on
+a synthetic corpus of sentences generated from the extracted grammar."""
+import io
+import os
+import sys
+import gzip
+import json
+import codecs
+import random
+import shutil
+import platform
+import tempfile
+from getopt import gnu_getopt, GetoptError
+from collections import OrderedDict
+from functools import partial
+
+SHORTUSAGE = '''Benchmark the parsing pipeline and check for regressions.
+Usage: discodop bench [options]'''
+BENCHMARKS = ('grammar', 'parse', 'fragments', 'treesearch')
+
+
+def runbenchmarks(datadir, workdir, repeat=3, numsents=100, maxlen=25,
+		only=None, seed=1):
+	"""Run the benchmarks and return the best timings.
+
+	:param datadir: directory with ``sample.prm``, the treebanks it refers to,
+		and the directory ``tests/`` with ``t1.mrg`` and ``t2.dbr``.
+	:param workdir: an empty directory for grammars and indices.
+	:param repeat: run each benchmark this many times.
+	:param numsents: the number of synthetic sentences to generate.
+	:param maxlen: the maximum length of synthetic sentences.
+	:param only: if given, a sequence of benchmark names to run; e.g.,
+		``['parse', 'treesearch']``; grammars are always extracted.
+	:param seed: seed of the random generator for synthetic sentences.
+	:returns: an OrderedDict ``{name: {'wall': seconds, 'cpu': seconds}}``
+		with the minimum wall clock and CPU time over all runs."""
+	from . import gen, treebank, treesearch, _fragments
+	from .tree import Tree
+	from .util import PhaseTimer
+	from .fragments import readtreebanks
+	from .parser import Parser, readgrammars
+	from .runexp import (loadtraincorpus, getposmodel, dobinarization,
+			getgrammars)
+	results = OrderedDict()
+
+	def bench(name, func, *args):
+		"""Call ``func(*args)`` ``repeat`` times and record its timings.
+
+		``func`` should return a tuple ``(result, phases)`` where phases is
+		a dict with timings ``(wall, cpu)`` of sub-benchmarks."""
+		for _ in range(repeat):
+			timer = PhaseTimer()
+			result, phases = func(*args)
+			timer.lap(name)
+			timer.phases.update(sorted(phases.items()))
+			for key, (wall, cpu) in timer.phases.items():
+				if key in results:
+					wall = min(wall, results[key]['wall'])
+					cpu = min(cpu, results[key]['cpu'])
+				results[key] = OrderedDict(wall=wall, cpu=cpu)
+		return result
+
+	def grammars():
+		"""Extract grammars from the training corpus and read them back."""
+		timer = PhaseTimer()
+		prm = loadparams(datadir)
+		resultdir = tempfile.mkdtemp(dir=workdir)
+		trees, sents, train_tagged_sents = loadtraincorpus(
+				prm.corpusfmt, prm.traincorpus, prm.binarization, prm.punct,
+				prm.functions, prm.morphology, prm.removeempty,
+				prm.ensureroot, prm.transformations,
+				prm.relationalrealizational, resultdir)
+		lexmodel = None
+		if prm.postagging and prm.postagging.method == 'unknownword':
+			sents, lexmodel = getposmodel(prm.postagging, train_tagged_sents)
+		trees = dobinarization(trees, sents, prm.binarization,
+				prm.relationalrealizational)
+		top = trees[0].label
+		timer.reset()
+		getgrammars(trees, sents, prm.stages, prm.testcorpus.maxwords,
+				resultdir, prm.numproc, lexmodel, top)
+		timer.lap('grammar/getgrammars')
+		prm = loadparams(datadir)
+		prm.update(resultdir=resultdir, verbosity=0)
+		readgrammars(resultdir, prm.stages, prm.postagging,
+				prm.transformations, top=top)
+		timer.lap('grammar/readgrammars')
+		return (prm, top), timer.phases
+
+	def parse(parser, sents):
+		"""Parse sentences and add up the time spent in each phase."""
+		phases = {}
+		results = parser.parsebatch(sents)
+		for result in results:
+			for stage in result:
+				for phase, (wall, cpu) in stage.phases.items():
+					for key in ('parse/%s' % stage.name,
+							'parse/%s/%s' % (stage.name, phase)):
+						prevwall, prevcpu = phases.get(key, (0.0, 0.0))
+						phases[key] = (prevwall + wall, prevcpu + cpu)
+		return results, phases
+
+	def fragments(filename, fmt):
+		"""Extract recurring fragments from a treebank."""
+		corpus = readtreebanks(filename, fmt=fmt)
+		return _fragments.extractfragments(corpus['trees1'], 0, 0,
+				corpus['vocab'], disc=fmt != 'bracket', approx=True), {}
+
+	def search(searcher, filenames, queries):
+		"""Index fresh copies of corpora and run queries."""
+		searchdir = tempfile.mkdtemp(dir=workdir)
+		files = []
+		for filename in filenames:
+			files.append(os.path.join(searchdir, os.path.basename(filename)))
+			shutil.copy(filename, files[-1])
+		with searcher(files, numproc=1) as corpora:
+			return [corpora.counts(query) for query in queries], {}
+
+	def selected(name):
+		return only is None or name in only
+
+	prm, top = bench('grammar', grammars)
+	if not (selected('parse') or selected('fragments')
+			or selected('treesearch')):
+		return results
+
+	# sentences from the test corpus, and synthetic sentences generated from
+	# the grammar of the first (non-DOP) PLCFRS stage.
+	test = treebank.READERS[prm.corpusfmt](prm.testcorpus.path,
+			encoding=prm.testcorpus.encoding)
+	sents = [item.sent for _, item in test.itertrees(
+			0, prm.testcorpus.numsents)]
+	stage = next(stage for stage in prm.stages
+			if stage.mode == 'plcfrs' and not stage.dop)
+	with codecs.getreader('utf8')(gzip.open(os.path.join(
+			prm.resultdir, '%s.rules.gz' % stage.name))) as rules:
+		with codecs.getreader('utf8')(gzip.open(os.path.join(
+				prm.resultdir, '%s.lex.gz' % stage.name))) as lexicon:
+			grammar = gen.splitgrammar(gen.read_lcfrs_grammar(rules, lexicon))
+	random.seed(seed)
+	synthetic = []
+	while len(synthetic) < numsents:
+		_, sent = gen.gen(grammar, start=grammar.toid[top])
+		if len(sent[0]) <= maxlen:
+			synthetic.append(sent[0])
+	parser = Parser(prm)
+	parsed = bench('parse', parse, parser, sents + synthetic)
+
+	# write synthetic treebank of the parse trees of the last stage
+	synthfile = os.path.join(workdir, 'synthetic.dbr')
+	with io.open(synthfile, 'w', encoding='utf8') as out:
+		for n, (result, sent) in enumerate(zip(parsed, sents + synthetic)):
+			if not result[-1].noparse:
+				out.write(treebank.writetree(
+						result[-1].parsetree, sent, n, 'discbracket'))
+	if selected('fragments'):
+		for name, filename, fmt in (
+				('alpinosample', prm.testcorpus.path, prm.corpusfmt),
+				('t1', os.path.join(datadir, 'tests', 't1.mrg'), 'bracket'),
+				('t2', os.path.join(datadir, 'tests', 't2.dbr'),
+					'discbracket'),
+				('synthetic', synthfile, 'discbracket')):
+			bench('fragments/%s' % name, fragments, filename, fmt)
+	if selected('treesearch'):
+		# queries are the productions of the synthetic parse trees
+		queries = OrderedDict()
+		for result in parsed:
+			if not result[-1].noparse:
+				for node in result[-1].parsetree.subtrees(
+						lambda n: isinstance(n[0], Tree)):
+					queries['(%s %s)' % (node.label, ' '.join(
+							'(%s )' % child.label for child in node))] = None
+		queries = list(queries)[:10]
+		bench('treesearch/fragment', search, treesearch.FragmentSearcher,
+				[prm.testcorpus.path, synthfile,
+					os.path.join(datadir, 'tests', 't2.dbr')], queries)
+		textfile = os.path.join(workdir, 'synthetic.txt')
+		with io.open(textfile, 'w', encoding='utf8') as out:
+			out.writelines(' '.join(sent) + '\n' for sent in sents + synthetic)
+		words = sorted({word for sent in synthetic for word in sent})[:10]
+		queries = ([r'\b%s\b' % word for word in words]
+				+ [r'\b\w+ %s\b' % word for word in words])
+		bench('treesearch/regex', search, treesearch.RegexSearcher,
+				[textfile], queries)
+		bench('treesearch/regextrigram', search,
+				partial(treesearch.RegexSearcher, trigramindex=True),
+				[textfile], queries)
+	return results
+
+
+def loadparams(datadir):
+	"""Read ``sample.prm``, resolving its file names relative to datadir."""
+	from .parser import readparam
+	prm = readparam(os.path.join(datadir, 'sample.prm'))
+	prm.traincorpus.path = os.path.join(datadir, prm.traincorpus.path)
+	prm.testcorpus.path = os.path.join(datadir, prm.testcorpus.path)
+	if prm.binarization.headrules:
+		prm.binarization.headrules = os.path.join(
+				datadir, prm.binarization.headrules)
+	return prm
+
+
+def compare(results, baseline, metric='cpu', tolerance=0.25, mindiff=0.01):
+	"""Compare timings with those of a baseline.
+
+	:param results, baseline: dicts of the form
+		``{name: {'wall': seconds, 'cpu': seconds}}``.
+	:param metric: whether to compare ``'wall'`` or ``'cpu'`` time.
+	:param tolerance: relative slowdown that is tolerated; e.g., 0.25 means
+		that a benchmark taking 25 % longer than the baseline is not flagged.
+	:param mindiff: slowdowns of less than this many seconds are not flagged,
+		since timings of short benchmarks are dominated by noise.
+	:returns: a list of tuples ``(name, old, new, regression)`` for the
+		benchmarks that occur in both; regression is a boolean.
+
+	>>> compare({'parse': {'cpu': 2.0}, 'grammar': {'cpu': 1.0}},
+	... 		{'parse': {'cpu': 1.0}, 'grammar': {'cpu': 1.1}})
+	[('parse', 1.0, 2.0, True), ('grammar', 1.1, 1.0, False)]"""
+	comparison = []
+	for name, times in results.items():
+		if name in baseline:
+			old, new = baseline[name][metric], times[metric]
+			comparison.append((name, old, new,
+					new - old > mindiff and new > old * (1 + tolerance)))
+	return comparison
+
+
+def main():
+	"""Command line interface to benchmarks."""
+	options = ('help', 'datadir=', 'repeat=', 'sents=', 'maxlen=', 'only=',
+			'output=', 'baseline=', 'metric=', 'tolerance=')
+	try:
+		opts, args = gnu_getopt(sys.argv[2:], 'ho:', options)
+		opts = dict(opts)
+		if args:
+			raise GetoptError('unexpected arguments: %r' % args)
+		only = opts['--only'].split(',') if '--only' in opts else None
+		if only and not set(only) <= set(BENCHMARKS):
+			raise GetoptError('unrecognized benchmark: %s; choices: %s' % (
+					', '.join(set(only) - set(BENCHMARKS)),
+					', '.join(BENCHMARKS)))
+		metric = opts.get('--metric', 'cpu')
+		if metric not in ('wall', 'cpu'):
+			raise GetoptError('--metric should be wall or cpu.')
+	except GetoptError as err:
+		print('error:', err, file=sys.stderr)
+		print(SHORTUSAGE)
+		sys.exit(2)
+	if '--help' in opts or '-h' in opts:
+		print(SHORTUSAGE)
+		return
+	from . import __version__
+	settings = OrderedDict((
+			('repeat', int(opts.get('--repeat', 3))),
+			('sents', int(opts.get('--sents', 100))),
+			('maxlen', int(opts.get('--maxlen', 25)))))
+	workdir = tempfile.mkdtemp(prefix='discodop-bench')
+	try:
+		results = runbenchmarks(opts.get('--datadir', '.'), workdir,
+				repeat=settings['repeat'], numsents=settings['sents'],
+				maxlen=settings['maxlen'], only=only)
+	finally:
+		shutil.rmtree(workdir)
+	output = opts.get('--output', opts.get('-o'))
+	if output:
+		with io.open(output, 'w', encoding='utf8') as out:
+			out.write(json.dumps(OrderedDict((
+					('version', __version__),
+					('python', platform.python_version()),
+					('platform', platform.platform()),
+					('settings', settings),
+					('results', results))), indent=1) + '\n')
+	if '--baseline' not in opts:
+		print('%-40s %10s %10s' % ('benchmark', 'wall', 'cpu'))
+		for name, times in results.items():
+			print('%-40s %10.3f %10.3f' % (name, times['wall'], times['cpu']))
+		return
+	with io.open(opts['--baseline'], encoding='utf8') as inp:
+		baseline = json.load(inp)
+	if baseline.get('settings', settings) != settings:
+		print('warning: baseline was run with different settings: %s' % (
+				', '.join('%s=%s' % a for a in baseline['settings'].items())),
+				file=sys.stderr)
+	baseline = baseline['results']
+	comparison = compare(results, baseline, metric,
+			float(opts.get('--tolerance', 0.25)))
+	print('%-40s %10s %10s %8s' % ('benchmark', 'baseline', metric, 'change'))
+	for name, old, new, regression in comparison:
+		print('%-40s %10.3f %10.3f %+7.1f%%%s' % (name, old, new,
+				100 * (new - old) / old if old else 0,
+				'  REGRESSION' if regression else ''))
+	regressions = [name for name, _, _, regression in comparison
+			if regression]
+	if regressions:
+		print('%d regression(s) exceeding tolerance of %s%%' % (
+				len(regressions), 100 * float(opts.get('--tolerance', 0.25))),
+				file=sys.stderr)
+		sys.exit(1)
+
+
+__all__ = ['runbenchmarks', 'loadparams', 'compare']
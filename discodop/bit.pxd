@@ -1,6 +1,6 @@
 from libc.stdint cimport uint8_t, uint16_t, uint32_t, uint64_t
 
-cdef extern from "macros.h":
+cdef extern from "macros.h" nogil:
 	int BITSIZE
 	int BITSLOT(int b)
 	uint64_t BITMASK(int b)
@@ -9,7 +9,7 @@ cdef extern from "macros.h":
 	void SETBIT(uint64_t a[], int b)
 
 
-cdef extern from "bitcount.h":
+cdef extern from "bitcount.h" nogil:
 	unsigned int bit_clz(uint64_t)
 	unsigned int bit_ctz(uint64_t)
 	unsigned int bit_popcount(uint64_t)
@@ -27,7 +27,7 @@ ctypedef fused unsigned_fused:
 cpdef int fanout(arg)
 cpdef int pyintnextset(a, int pos)
 # on C integers
-cpdef int bitcount(uint64_t vec)
+cpdef int bitcount(uint64_t vec) nogil
 
 # cdef inline functions defined here:
 # ===================================
@@ -57,7 +57,7 @@ cpdef int bitcount(uint64_t vec)
 # cdef inline int reviteratesetbits(uint64_t *vec, uint64_t *cur, int *idx)
 
 
-cdef inline bint testbit(unsigned_fused vec, uint32_t pos):
+cdef inline bint testbit(unsigned_fused vec, uint32_t pos) nogil:
 	"""Mask a particular bit, return nonzero if set.
 
 	>>> testbit(0b0011101, 0)
@@ -75,7 +75,7 @@ cdef inline bint testbit(unsigned_fused vec, uint32_t pos):
 		return vec & ((<unsigned_fused>1U) << pos) != 0
 
 
-cdef inline int nextset(uint64_t vec, uint32_t pos):
+cdef inline int nextset(uint64_t vec, uint32_t pos) nogil:
 	""" Return next set bit starting from pos, -1 if there is none.
 
 	>>> nextset(0b001101, 1)
@@ -90,7 +90,7 @@ cdef inline int nextset(uint64_t vec, uint32_t pos):
 	# return  __builtin_ffsl(x) - 1
 
 
-cdef inline int nextunset(uint64_t vec, uint32_t pos):
+cdef inline int nextunset(uint64_t vec, uint32_t pos) nogil:
 	""" Return next unset bit starting from pos.
 
 	>> nextunset(0b001101, 2)
@@ -102,7 +102,7 @@ cdef inline int nextunset(uint64_t vec, uint32_t pos):
 	return bit_ctz(x) if x else (sizeof(uint64_t) * 8)
 
 
-cdef inline int bitlength(uint64_t vec):
+cdef inline int bitlength(uint64_t vec) nogil:
 	"""Return number of bits needed to represent vector.
 
 	(equivalently: index of most significant set bit, plus one)
@@ -112,7 +112,7 @@ cdef inline int bitlength(uint64_t vec):
 	return sizeof(vec) * 8 - bit_clz(vec) if vec else 0
 
 
-cdef inline int abitcount(uint64_t *vec, int slots):
+cdef inline int abitcount(uint64_t *vec, int slots) nogil:
 	""" Return number of set bits in variable length bitvector """
 	cdef int a
 	cdef int result = 0
@@ -121,7 +121,7 @@ cdef inline int abitcount(uint64_t *vec, int slots):
 	return result
 
 
-cdef inline int abitlength(uint64_t *vec, int slots):
+cdef inline int abitlength(uint64_t *vec, int slots) nogil:
 	"""Return number of bits needed to represent vector.
 
 	(equivalently: index of most significant set bit, plus one)."""
@@ -133,7 +133,7 @@ cdef inline int abitlength(uint64_t *vec, int slots):
 	return (a + 1) * sizeof(uint64_t) * 8 - bit_clz(vec[a])
 
 
-cdef inline int anextset(uint64_t *vec, uint32_t pos, int slots):
+cdef inline int anextset(uint64_t *vec, uint32_t pos, int slots) nogil:
 	""" Return next set bit starting from pos, -1 if there is none. """
 	cdef int a = BITSLOT(pos)
 	cdef uint64_t x
@@ -148,7 +148,7 @@ cdef inline int anextset(uint64_t *vec, uint32_t pos, int slots):
 	return a * BITSIZE + bit_ctz(x)
 
 
-cdef inline int anextunset(uint64_t *vec, uint32_t pos, int slots):
+cdef inline int anextunset(uint64_t *vec, uint32_t pos, int slots) nogil:
 	""" Return next unset bit starting from pos. """
 	cdef int a = BITSLOT(pos)
 	cdef uint64_t x
@@ -164,7 +164,7 @@ cdef inline int anextunset(uint64_t *vec, uint32_t pos, int slots):
 
 
 cdef inline int iteratesetbits(uint64_t *vec, int slots,
-		uint64_t *cur, int *idx):
+		uint64_t *cur, int *idx) nogil:
 	"""Iterate over set bits in an array of unsigned long.
 
 	:param slots: number of elements in unsigned long array ``vec``.
@@ -195,7 +195,7 @@ cdef inline int iteratesetbits(uint64_t *vec, int slots,
 
 
 cdef inline int iterateunsetbits(uint64_t *vec, int slots,
-		uint64_t *cur, int *idx):
+		uint64_t *cur, int *idx) nogil:
 	"""Like ``iteratesetbits``, but return indices of zero bits.
 
 	:param cur: should be initialized as: ``cur = ~vec[idx]``."""
@@ -210,7 +210,8 @@ cdef inline int iterateunsetbits(uint64_t *vec, int slots,
 	return idx[0] * BITSIZE + tmp
 
 
-cdef inline void setintersectinplace(uint64_t *dest, uint64_t *src, int slots):
+cdef inline void setintersectinplace(uint64_t *dest, uint64_t *src,
+		int slots) nogil:
 	"""dest gets the intersection of dest and src.
 
 	both operands must have at least `slots' slots."""
@@ -219,7 +220,8 @@ cdef inline void setintersectinplace(uint64_t *dest, uint64_t *src, int slots):
 		dest[a] &= src[a]
 
 
-cdef inline void setunioninplace(uint64_t *dest, uint64_t *src, int slots):
+cdef inline void setunioninplace(uint64_t *dest, uint64_t *src,
+		int slots) nogil:
 	"""dest gets the union of dest and src.
 
 	Both operands must have at least ``slots`` slots."""
@@ -229,7 +231,7 @@ cdef inline void setunioninplace(uint64_t *dest, uint64_t *src, int slots):
 
 
 cdef inline void setintersect(uint64_t *dest, uint64_t *src1, uint64_t *src2,
-		int slots):
+		int slots) nogil:
 	"""dest gets the intersection of src1 and src2.
 
 	operands must have at least ``slots`` slots."""
@@ -239,7 +241,7 @@ cdef inline void setintersect(uint64_t *dest, uint64_t *src1, uint64_t *src2,
 
 
 cdef inline void setunion(uint64_t *dest, uint64_t *src1, uint64_t *src2,
-		int slots):
+		int slots) nogil:
 	"""dest gets the union of src1 and src2.
 
 	operands must have at least ``slots`` slots."""
@@ -248,7 +250,7 @@ cdef inline void setunion(uint64_t *dest, uint64_t *src1, uint64_t *src2,
 		dest[a] = src1[a] | src2[a]
 
 
-cdef inline bint subset(uint64_t *vec1, uint64_t *vec2, int slots):
+cdef inline bint subset(uint64_t *vec1, uint64_t *vec2, int slots) nogil:
 	"""Test whether vec1 is a subset of vec2.
 
 	i.e., all set bits of vec1 should be set in vec2."""
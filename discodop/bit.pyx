@@ -16,7 +16,7 @@ def pyintbitcount(a):
 	return count
 
 
-cpdef int bitcount(uint64_t vec):
+cpdef int bitcount(uint64_t vec) nogil:
 	"""Return number of set bits (1s).
 
 	>>> bitcount(0b0011101)
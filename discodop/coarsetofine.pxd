@@ -0,0 +1,7 @@
+from libcpp.vector cimport vector
+from .containers cimport Chart, ItemNo, FlatEdge
+
+cdef vector[FlatEdge] flattenforest(Chart chart, bint logspace) except *
+cdef vector[FlatEdge] computeinside(Chart chart, bint logspace) except *
+cdef vector[FlatEdge] computeinsideoutside(Chart chart, bint logspace
+		) except *
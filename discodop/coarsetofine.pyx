@@ -3,12 +3,14 @@ from __future__ import print_function
 from libcpp.vector cimport vector
 from libcpp.utility cimport pair
 from libcpp.algorithm cimport sort
+from libc.stdint cimport uint64_t
 import re
 from .tree import Tree
 from .treetransforms import mergediscnodes, unbinarize, fanout, addbitsets
 from .containers cimport (Grammar, Chart, Edge, RankedEdge, LexicalRule,
 		Label, ItemNo, cellidx, CFGtoSmallChartItem,
-		CFGtoFatChartItem, SmallChartItem, FatChartItem, Whitelist)
+		CFGtoFatChartItem, SmallChartItem, FatChartItem, Whitelist,
+		smallitemhash, SETBIT, BITNSLOTS)
 from .bit cimport nextset, nextunset, anextset, anextunset
 from .pcfg cimport CFGChart, DenseCFGChart, SparseCFGChart, CFGItem
 from .plcfrs cimport SmallLCFRSChart, FatLCFRSChart
@@ -16,7 +18,7 @@ from .kbest import lazykbest
 from .kbest cimport collectitems, getderiv
 from roaringbitmap import RoaringBitmap
 import numpy as np
-from libc.math cimport exp
+from libc.math cimport exp, log, log1p, HUGE_VAL as INFINITY
 
 include "constants.pxi"
 
@@ -34,7 +36,8 @@ ctypedef fused ChartItem_fused:
 
 def prunechart(Chart coarsechart, Grammar fine, k,
 		bint splitprune, bint markorigin, bint finecfg,
-		set require=None, set block=None):
+		set require=None, set block=None, Whitelist whitelist=None,
+		bint logspace=True, size_t maxitems=0):
 	"""Produce a white list of selected chart items.
 
 	The criterion is that they occur in the `k`-best derivations of ``chart``,
@@ -62,6 +65,16 @@ def prunechart(Chart coarsechart, Grammar fine, k,
 		For example, ``('NP', [0, 1, 2])``; expects ``k > 1``.
 	:param block: optionally, a list of tuples ``(label, indices)``;
 		these labeled spans will be pruned.
+	:param whitelist: optionally, a white list returned by an earlier call
+		with the same fine grammar; its buffers are cleared and reused.
+	:param logspace: with ``0 < k < 1``, whether to compute inside-outside
+		probabilities in log space; see :func:`posteriorthreshold`.
+	:param maxitems: if nonzero, a budget for the number of selected items;
+		when more items are selected, the pruning is tightened for this
+		sentence: with ``0 < k < 1``, only the ``maxitems`` items with the
+		highest posterior probability are selected; with ``k >= 1``, only
+		the first derivations whose items fit in the budget are used. In
+		both cases, the items of the best derivation are always selected.
 	:returns: ``(whitelist, msg)``
 
 	For LCFRS, the white list is indexed as follows:
@@ -69,19 +82,22 @@ def prunechart(Chart coarsechart, Grammar fine, k,
 			SmallChartItem or FatChartItem depending on sent. len.
 		:blocked: ``item not in whitelist[label]``
 
+	with a Bloom filter over the SmallChartItems to reject most blocked items
+	without a hash table lookup.
+
 	For a CFG, indexing is as follows:
-		:whitelisted: ``label in whitelist[span]``,
+		:whitelisted: bit ``label`` of ``whitelist[span]`` is set,
 			``span`` is an integer encoding both begin and end;
 			different from a cell because does not include no. of nonterminals.
-		:blocked: ``label not in whitelist[span]``
+		:blocked: bit ``label`` of ``whitelist[span]`` is not set.
 	"""
-	cdef Whitelist whitelist = Whitelist()
 	cdef vector[ItemNo] items
 	cdef SmallChartItem sitem
 	cdef FatChartItem fitem
 	cdef Label label
 	cdef ItemNo item
-	cdef size_t span
+	cdef size_t span, idx, size
+	cdef uint64_t h, nbits
 	if (fine.mapping.size() == 0 or (splitprune and markorigin
 			and fine.splitmapping.size() == 0)):
 		raise ValueError('need to call fine.getmapping(coarse, ...).')
@@ -114,13 +130,31 @@ def prunechart(Chart coarsechart, Grammar fine, k,
 		msg = 'applied \'required\' constraints; %d of %d derivations left' % (
 				len(derivs), coarsechart.rankededges[root].size())
 	elif 0 < k < 1:  # threshold on posterior probabilities
-		items, msg = posteriorthreshold(coarsechart, k)
+		items, msg = posteriorthreshold(coarsechart, k, logspace, maxitems)
 	elif k == 0:  # only drop items not part of a full derivation
 		coarsechart.filter()
 		items = [n for n in range(coarsechart.parseforest.size())
 				if coarsechart.parseforest[n].size() != 0]
 		msg = ('coarse items before pruning: %d; after filter: %d'
 				% (coarsechart.numitems(), len(items)))
+	elif k >= 1 and maxitems:  # use k-best derivations that fit in budget
+		lazykbest(coarsechart, k, derivs=False)
+		root = coarsechart.root()
+		itemset = set()
+		for n in range(coarsechart.rankededges[root].size()):
+			newitems = set()
+			collectitems(
+					root, coarsechart.rankededges[root][n].first,
+					coarsechart, newitems)
+			if n and len(itemset | newitems) > maxitems:
+				break
+			itemset.update(newitems)
+		else:
+			n = coarsechart.rankededges[root].size()
+		items = [a for a in itemset]
+		msg = ('coarse items before pruning: %d; after: %d, '
+				'based on %d/%d derivations (budget: %d items)' % (
+				coarsechart.numitems(), len(items), n, k, maxitems))
 	elif k >= 1:  # construct a list of the k-best chart items to prune with
 		lazykbest(coarsechart, k, derivs=False)
 		items = [n for n in range(coarsechart.rankededges.size())
@@ -139,32 +173,47 @@ def prunechart(Chart coarsechart, Grammar fine, k,
 		msg += '; applied \'block\' constraints; %d of %d items left' % (
 				len(itemset), items.size())
 		items = [n for n in itemset]
+	if whitelist is None:
+		whitelist = Whitelist()
+	# clear sets instead of the vectors containing them to keep allocations
 	if finecfg:  # index items by cell
-		whitelist.cfg.clear()
-		whitelist.cfg.resize(cellidx(
-				coarsechart.lensent - 1, coarsechart.lensent,
-				coarsechart.lensent, 1) + 1)
+		size = cellidx(coarsechart.lensent - 1, coarsechart.lensent,
+				coarsechart.lensent, 1) + 1
+		whitelist.cfgwords = BITNSLOTS(coarsechart.grammar.nonterminals)
+		whitelist.cfg.assign(size * whitelist.cfgwords, 0)
 		for item in items:
 			span = coarsechart.asCFGspan(item)
 			label = coarsechart.label(item)
-			whitelist.cfg[span].insert(label)
-		# for span in range(whitelist.cfg.size()):
-		# 	sort(whitelist.cfg[span].begin(), whitelist.cfg[span].end())
+			SETBIT(&(whitelist.cfg[span * whitelist.cfgwords]), label)
 	else:  # index items by label
+		size = coarsechart.grammar.nonterminals
 		if <unsigned>coarsechart.lensent >= sizeof(sitem.vec) * 8:
-			whitelist.fat.clear()
-			whitelist.fat.resize(coarsechart.grammar.nonterminals)
+			for idx in range(min(size, whitelist.fat.size())):
+				whitelist.fat[idx].clear()
+			whitelist.fat.resize(size)
 			for item in items:
 				label = coarsechart.label(item)
 				fitem = coarsechart.asFatChartItem(item)
 				whitelist.fat[label].insert(fitem)
 		else:
-			whitelist.small.clear()
-			whitelist.small.resize(coarsechart.grammar.nonterminals)
+			for idx in range(min(size, whitelist.small.size())):
+				whitelist.small[idx].clear()
+			whitelist.small.resize(size)
+			# Bloom filter with >= 16 bits per item and 2 hash functions;
+			# the number of bits is a power of 2 so that it can be masked.
+			nbits = 64
+			while nbits < 16 * items.size() and nbits < (1UL << 30):
+				nbits <<= 1
+			whitelist.bloommask = nbits - 1
+			whitelist.bloom.assign(nbits // 64, 0)
 			for item in items:
 				label = coarsechart.label(item)
 				sitem = coarsechart.asSmallChartItem(item)
 				whitelist.small[label].insert(sitem)
+				h = smallitemhash(sitem)
+				SETBIT(&(whitelist.bloom[0]), h & whitelist.bloommask)
+				SETBIT(&(whitelist.bloom[0]),
+						(h >> 32) & whitelist.bloommask)
 	whitelist.mapping = &(fine.mapping[0])
 	whitelist.splitmapping = &(fine.splitmapping[0])
 	return whitelist, msg
@@ -179,113 +228,231 @@ def getmatchingitems(Chart chart, str strlabel, indices):
 	return matchingitems
 
 
-def posteriorthreshold(Chart chart, double threshold):
+def posteriorthreshold(Chart chart, double threshold, bint logspace=True,
+		size_t maxitems=0):
 	"""Prune labeled spans from chart below given posterior threshold.
 
-	:returns: dictionary of remaining items."""
+	:param logspace: if True, compute inside and outside probabilities in
+		log space; otherwise, use plain probabilities, which underflow on
+		long sentences.
+	:param maxitems: if nonzero and more items pass the threshold, raise the
+		threshold such that only the ``maxitems`` most probable items remain;
+		the items of the best derivation are always kept.
+	:returns: list of remaining items."""
 	cdef ItemNo itemidx
+	cdef size_t numitems = 0
+	cdef double sentprob, score
+	cdef list posterior = [], scores = []
 	if not 0 < threshold < 1:
 		raise ValueError('expected posterior threshold k with 0 < k < 1.')
 	if not chart.inside.size():
-		origlogprob = chart.grammar.logprob
-		chart.grammar.switch(chart.grammar.currentmodel, logprob=False)
-		getinside(chart)
-		getoutside(chart)
-		chart.grammar.switch(chart.grammar.currentmodel, logprob=origlogprob)
+		insideoutside(chart, logspace)
 	sentprob = chart.inside[chart.root()]
-	threshold *= sentprob
-	if not sentprob:
-		raise ValueError('sentence has zero posterior prob.: %g' % sentprob)
-	posterior = [itemidx for itemidx
-			in range(chart.inside.size())
-			if chart.inside[itemidx] * chart.outside[itemidx] > threshold]
-
-	unfiltered = chart.numitems()
-	numitems = 0
-	for itemidx in range(1, chart.numitems() + 1):
-		numitems += chart.outside[itemidx] != 0.0
-	numremain = len(posterior)
+	if (sentprob == -INFINITY) if logspace else not sentprob:
+		raise ValueError('sentence has zero posterior prob.: %g' % (
+				exp(sentprob) if logspace else sentprob))
+	if logspace:
+		threshold = log(threshold) + sentprob
+		for itemidx in range(chart.inside.size()):
+			score = chart.inside[itemidx] + chart.outside[itemidx]
+			if score > threshold:
+				posterior.append(itemidx)
+				scores.append(score)
+		for itemidx in range(1, chart.outside.size()):
+			numitems += chart.outside[itemidx] != -INFINITY
+	else:
+		threshold *= sentprob
+		for itemidx in range(chart.inside.size()):
+			score = chart.inside[itemidx] * chart.outside[itemidx]
+			if score > threshold:
+				posterior.append(itemidx)
+				scores.append(score)
+		for itemidx in range(1, chart.outside.size()):
+			numitems += chart.outside[itemidx] != 0.0
 	msg = ('coarse items before pruning=%d; filtered: %d;'
-			' pruned: %d; sentprob=%g' % (
-			unfiltered, numitems, numremain, sentprob))
+			' pruned: %d; %s=%g' % (
+			chart.numitems(), numitems, len(posterior),
+			'log sentprob' if logspace else 'sentprob', sentprob))
+	if maxitems and <size_t>len(posterior) > maxitems:
+		# keep the items with the highest posteriors; add the items of the
+		# best derivation, to guarantee that a complete derivation remains.
+		selected = np.argsort(scores, kind='mergesort')[
+				len(scores) - maxitems:]
+		threshold = min([scores[n] for n in selected])
+		itemset = {posterior[n] for n in selected}
+		lazykbest(chart, 1, derivs=False)
+		collectitems(chart.root(), chart.rankededges[chart.root()][0].first,
+				chart, itemset)
+		posterior = sorted(itemset)
+		msg += '; budget: %d items, threshold raised to %g' % (
+				maxitems, exp(threshold - sentprob) if logspace
+				else threshold / sentprob)
 	return posterior, msg
 
 
-def getinside(Chart chart):
-	"""Compute inside probabilities for a chart given its parse forest."""
-	# this needs to be bottom up, so need order in which items were added
-	# currently separate list, chart.itemsinorder
-	# NB: sorting items by length is not enough,
-	# unaries have to be in the right order...
+cdef vector[FlatEdge] flattenforest(Chart chart, bint logspace) except *:
+	"""Collect the edges of a chart in bottom-up order.
 
-	# choices for probs:
-	# - normal => underflow (current)
-	# - logprobs => loss of precision w/addition
-	# - normal, scaled => how?
-	cdef ItemNo n, item, leftitem, rightitem
+	Edges are ordered by the order in which their items were added, which
+	respects dependencies between items (including unary rules)."""
+	cdef vector[FlatEdge] result
+	cdef FlatEdge flat
 	cdef Edge edge
-	cdef double prob
-	chart.inside.resize(chart.probs.size(), 0.0)
-
-	# traverse items in bottom-up order
-	for n in range(1, chart.numitems() + 1):
+	cdef ItemNo n, item, numitems = chart.numitems()
+	cdef bint logprob = chart.grammar.logprob
+	for n in range(1, numitems + 1):
 		item = chart.getitemidx(n)
 		for edge in chart.parseforest[item]:
+			flat.item = item
 			if edge.rule is NULL:
+				flat.left = flat.right = 0
 				try:
-					prob = chart.lexprob(item, edge)
+					flat.prob = convertprob(chart.grammar.lexical[
+							chart.lexruleno(item, edge)].prob,
+							logprob, logspace)
 				except ValueError:
 					# fall back to Viterbi score from chart
 					# if there is a single incoming edge this is correct
 					assert chart.parseforest[item].size() == 1
-					if chart.logprob:
-						prob = exp(-chart.probs[item])
-					else:
-						prob = chart.probs[item]
-			elif edge.rule.rhs2 == 0:
-				leftitem = chart._left(item, edge)
-				prob = (edge.rule.prob
-						* chart.inside[leftitem])
+					flat.prob = convertprob(
+							chart.probs[item], chart.logprob, logspace)
 			else:
-				leftitem = chart._left(item, edge)
-				rightitem = chart._right(item, edge)
-				prob = (edge.rule.prob
-						* chart.inside[leftitem]
-						* chart.inside[rightitem])
-			# chart.addprob(item, prob)
-			chart.inside[item] += prob
-
-
-def getoutside(Chart chart):
-	"""Compute outside probabilities for a chart given its parse forest."""
-	cdef ItemNo n, item, leftitem, rightitem
-	cdef Edge edge
+				flat.left = chart._left(item, edge)
+				flat.right = chart._right(item, edge)
+				flat.prob = convertprob(edge.rule.prob, logprob, logspace)
+			result.push_back(flat)
+	return result
+
+
+cdef inline double convertprob(double prob, bint logprob, bint logspace):
+	"""Convert a probability or negative log probability ``prob``.
+
+	:returns: a log probability if ``logspace`` is True, else a probability.
+	"""
+	if logspace:
+		return -prob if logprob else log(prob)
+	return exp(-prob) if logprob else prob
+
+
+cdef inline double logaddexp(double a, double b) nogil:
+	"""Return log(exp(a) + exp(b)) without underflow."""
+	if a == -INFINITY:
+		return b
+	elif b == -INFINITY:
+		return a
+	elif a > b:
+		return a + log1p(exp(b - a))
+	return b + log1p(exp(a - b))
+
+
+cdef void _getinside(vector[FlatEdge]& edges, vector[double]& inside,
+		bint logspace) nogil:
+	cdef size_t n
+	cdef double prob
+	cdef FlatEdge *edge
+	for n in range(edges.size()):
+		edge = &(edges[n])
+		prob = edge.prob
+		if logspace:
+			if edge.left:
+				prob += inside[edge.left]
+			if edge.right:
+				prob += inside[edge.right]
+			inside[edge.item] = logaddexp(inside[edge.item], prob)
+		else:
+			if edge.left:
+				prob *= inside[edge.left]
+			if edge.right:
+				prob *= inside[edge.right]
+			inside[edge.item] += prob
+
+
+cdef void _getoutside(vector[FlatEdge]& edges, vector[double]& inside,
+		vector[double]& outside, bint logspace) nogil:
+	cdef size_t n
 	cdef double outsideprob
-	# cdef double sentprob = chart.inside[chart.root()]
-	# traverse items in top-down order
-	chart.outside.resize(chart.probs.size(), 0.0)
-	chart.outside[chart.root()] = 1.0
-	for n in range(chart.numitems(), 0, -1):
-		item = chart.getitemidx(n)
-		# can we define outside[item] simply as sentprob - inside[item] ?
-		# chart.outside[item] = sentprob - chart.inside[item]
-		for edge in chart.parseforest[item]:
-			if edge.rule is NULL:
-				pass
-			elif edge.rule.rhs2 == 0:
-				leftitem = chart._left(item, edge)
-				chart.outside[leftitem] += (edge.rule.prob
-						* chart.outside[item])
+	cdef FlatEdge *edge
+	# traverse edges in top-down order
+	for n in range(edges.size(), 0, -1):
+		edge = &(edges[n - 1])
+		if not edge.left:
+			continue
+		outsideprob = outside[edge.item]
+		if logspace:
+			if edge.right:
+				outside[edge.left] = logaddexp(outside[edge.left],
+						edge.prob + inside[edge.right] + outsideprob)
+				outside[edge.right] = logaddexp(outside[edge.right],
+						edge.prob + inside[edge.left] + outsideprob)
 			else:
-				leftitem = chart._left(item, edge)
-				rightitem = chart._right(item, edge)
-				outsideprob = chart.outside[item]
-				chart.outside[leftitem] += (edge.rule.prob
-						* chart.inside[rightitem]
-						* outsideprob)
-				chart.outside[rightitem] += (edge.rule.prob
-						* chart.inside[leftitem]
-						* outsideprob)
+				outside[edge.left] = logaddexp(outside[edge.left],
+						edge.prob + outsideprob)
+		elif edge.right:
+			outside[edge.left] += (edge.prob
+					* inside[edge.right] * outsideprob)
+			outside[edge.right] += (edge.prob
+					* inside[edge.left] * outsideprob)
+		else:
+			outside[edge.left] += edge.prob * outsideprob
+
+
+def insideoutside(Chart chart, bint logspace=True):
+	"""Compute inside and outside probabilities for a chart.
+
+	Stored in ``chart.inside`` and ``chart.outside``; as log probabilities
+	(i.e., ``log(p) <= 0``) if ``logspace`` is True; otherwise, as plain
+	probabilities."""
+	computeinsideoutside(chart, logspace)
+
+
+cdef vector[FlatEdge] computeinsideoutside(Chart chart, bint logspace
+		) except *:
+	"""Compute inside and outside probabilities; return the edges used.
+
+	The edges are those of the parse forest, as produced by
+	``flattenforest()``."""
+	cdef vector[FlatEdge] edges = computeinside(chart, logspace)
+	chart.outside.assign(chart.probs.size(), -INFINITY if logspace else 0.0)
+	chart.outside[chart.root()] = 0.0 if logspace else 1.0
+	with nogil:
+		_getoutside(edges, chart.inside, chart.outside, logspace)
+	return edges
+
+
+cdef vector[FlatEdge] computeinside(Chart chart, bint logspace) except *:
+	"""Compute inside probabilities; return the edges used.
+
+	The edges are those of the parse forest, as produced by
+	``flattenforest()``."""
+	cdef vector[FlatEdge] edges = flattenforest(chart, logspace)
+	chart.inside.assign(chart.probs.size(), -INFINITY if logspace else 0.0)
+	with nogil:
+		_getinside(edges, chart.inside, logspace)
+	return edges
+
+
+def getinside(Chart chart, bint logspace=False):
+	"""Compute inside probabilities for a chart given its parse forest.
+
+	:param logspace: if True, store log probabilities.
+
+	The flattened parse forest is kept in the chart for ``getoutside()``;
+	to compute both, ``insideoutside()`` is preferable."""
+	cdef vector[FlatEdge] edges = computeinside(chart, logspace)
+	chart.flatforest.swap(edges)
+
+
+def getoutside(Chart chart, bint logspace=False):
+	"""Compute outside probabilities for a chart given its parse forest.
+
+	Requires inside probabilities computed by ``getinside()`` with the same
+	``logspace`` value; the parse forest flattened there is reused."""
+	if chart.flatforest.empty():
+		chart.flatforest = flattenforest(chart, logspace)
+	chart.outside.assign(chart.probs.size(), -INFINITY if logspace else 0.0)
+	chart.outside[chart.root()] = 0.0 if logspace else 1.0
+	with nogil:
+		_getoutside(chart.flatforest, chart.inside, chart.outside, logspace)
 
 
 def doctftest(coarse, fine, sent, tree, k, split, verbose=False):
@@ -433,4 +600,5 @@ def test():
 		print("time elapsed", process_time() - begin, "s")
 
 
-__all__ = ['prunechart', 'posteriorthreshold', 'getinside', 'getoutside']
+__all__ = ['prunechart', 'posteriorthreshold', 'insideoutside', 'getinside',
+		'getoutside']
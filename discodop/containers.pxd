@@ -31,11 +31,12 @@ cdef extern from "_containers.h":
 	ctypedef uint32_t ItemNo  # numeric ID for chart item
 	ctypedef uint32_t Label  # numeric ID for nonterminal label; max 32 bits.
 	ctypedef double Prob  # precision for regular or log probabilities.
+	double walltime() nogil  # seconds of a monotonic clock
 	# FIXME: considerations when setting to float precision: numpy arrays,
 	# cpython arrays and functions from math.h may need to be changed; Python
 	# float is double.
 
-cdef extern from "macros.h":
+cdef extern from "macros.h" nogil:
 	int BITSIZE
 	int BITSLOT(int b)
 	int BITNSLOTS(int nb)
@@ -286,7 +287,7 @@ cdef extern from "_containers.h" nogil:
 		iterator find(SmallChartItem& k)
 		SmallChartItem& operator[](SmallChartItem&) nogil
 		pair[iterator, bint] insert(SmallChartItem& v) nogil
-		uint64_t count(SmallChartItem& k)
+		uint64_t count(SmallChartItem& k) nogil
 		uint64_t erase(SmallChartItem& k)
 		uint64_t bucket(SmallChartItem& key)
 		uint64_t max_size()
@@ -521,6 +522,15 @@ cdef class StringList(object):
 	cdef vector[string] ob
 
 
+@cython.final
+cdef class MappedStringList(object):
+	cdef object buf  # keeps memory map alive
+	cdef uint64_t *offsets
+	cdef char *data
+	cdef size_t size
+	cdef dict cache  # index => decoded string
+
+
 @cython.final
 cdef class StringIntDict(object):
 	cdef sparse_hash_map[string, Label] ob
@@ -541,7 +551,7 @@ cdef class Grammar:
 	cdef vector[LexicalRule] lexical
 	cdef sparse_hash_map[string, vector[uint32_t]] lexicalbyword
 	cdef sparse_hash_set[uint32_t] lexicallhs
-	cdef readonly list backtransform
+	cdef readonly object backtransform  # list or MappedStringList
 	cdef vector[uint64_t] mask
 	cdef vector[uint8_t] fanout
 	cdef StringList tolabel
@@ -557,19 +567,27 @@ cdef class Grammar:
 	cdef readonly size_t numrules, numunary, numbinary, maxfanout
 	cdef readonly bint logprob, bitpar
 	cdef readonly str start
-	cdef readonly str rulesfile, lexiconfile, altweightsfile
+	cdef readonly str rulesfile, lexiconfile, altweightsfile, binfile
 	cdef readonly object ruletuples
 	cdef readonly str currentmodel
 	cdef readonly object models  # serialized numpy arrays
 	#
 	cdef _indexrules(self, vector[ProbRule *]& dest, int idx, int filterlen,
 			int orignumrules)
+	cdef _sortlexical(self, string word, size_t orignumrules)
 	cpdef rulestr(self, int n)
 	cpdef noderuleno(self, node)
 	cpdef getruleno(self, tuple r, tuple yf)
 	cdef yfstr(self, ProbRule rule)
 
 
+cdef struct FlatEdge:  # an edge of the parse forest with its endpoints
+	ItemNo item
+	ItemNo left  # 0 for lexical edges
+	ItemNo right  # 0 for lexical and unary edges
+	double prob  # log probability or probability of rule
+
+
 # chart improvements todo:
 # [ ] is it useful to have a recognition phase before making parse forest?
 # [ ] symbolic parsing; separate viterbi stage
@@ -579,6 +597,7 @@ cdef class Chart:
 	cdef vector[Prob] probs
 	cdef vector[Prob] inside
 	cdef vector[Prob] outside
+	cdef vector[FlatEdge] flatforest  # edges of last getinside() call
 	cdef vector[vector[Edge]] parseforest
 	cdef vector[vector[pair[RankedEdge, Prob]]] rankededges
 	# cdef vector[string] derivations  # corresponds to rankededges[chart.root()]
@@ -590,6 +609,8 @@ cdef class Chart:
 	cdef Label start
 	cdef readonly bint logprob  # False: 0 < p <= 1; True: 0 <= -log(p) < inf
 	cdef readonly bint viterbi  # False: inside probs; True: viterbi 1-best
+	# time (s) spent on phases of parsing and disambiguation; cf. phasetimes()
+	cdef double postime, binarytime, unarytime, fragmenttime
 	cdef int lexidx(self, Edge edge) except -1
 	cdef Prob subtreeprob(self, ItemNo itemidx)
 	cdef Prob lexprob(self, ItemNo itemidx, Edge edge) except -1
@@ -608,17 +629,24 @@ cdef class Chart:
 
 @cython.final
 cdef class Whitelist:
-	cdef vector[sparse_hash_set[Label]] cfg  # span -> set of labels
-	# cdef vector[vector[Label]] cfg  # span -> sorted array of fine labels
-	# cdef vector[btree_set[Label]] cfg  # span -> set of fine labels
+	# bitset with a bit for each (span, label); cfgwords words per span
+	cdef vector[uint64_t] cfg
+	cdef size_t cfgwords
 	cdef vector[SmallChartItemSet] small  # label -> set of items
 	cdef vector[FatChartItemSet] fat   # label -> set of items
+	# Bloom filter over the items in small; bloommask is its size in bits - 1.
+	# If empty, small is queried directly.
+	cdef vector[uint64_t] bloom
+	cdef uint64_t bloommask
 	cdef Label *mapping  # maps of labels to ones in this whitelist
 	cdef vector[Label] *splitmapping
 
 
 cdef SmallChartItem CFGtoSmallChartItem(Label label, Idx start, Idx end)
 cdef FatChartItem CFGtoFatChartItem(Label label, Idx start, Idx end)
+cdef double walldeadline(double deadline)
+cdef bint exceedsbudget(size_t numitems, size_t itemlimit,
+		double deadline) nogil
 
 
 # start scratch
@@ -675,6 +703,7 @@ cdef class Ctrees:
 	cdef readonly short maxnodes
 	cdef readonly int len
 	cdef readonly object prodindex
+	cdef public object pairindex
 	cdef object _state
 	cpdef alloc(self, int numtrees, long numnodes)
 	cdef realloc(self, int numtrees, int extranodes)
@@ -724,7 +753,7 @@ cdef class FixedVocabulary(Vocabulary):
 
 # defined here because circular import.
 cdef inline size_t cellidx(short start, short end, short lensent,
-		Label nonterminals):
+		Label nonterminals) nogil:
 	"""Return an index to a triangular array, given start < end.
 	The result of this function is the index to chart[start][end][0]."""
 	return nonterminals * (lensent * start
@@ -732,7 +761,7 @@ cdef inline size_t cellidx(short start, short end, short lensent,
 
 
 cdef inline short cellstart(size_t cell, short lensent,
-		Label nonterminals):
+		Label nonterminals) nogil:
 	"""Retrieve start position for a given chart cell."""
 	cell = cell // nonterminals
 	cdef short start = 0, idx = 0
@@ -754,7 +783,7 @@ cdef inline short cellstart(size_t cell, short lensent,
 
 
 cdef inline short cellend(size_t cell, short lensent,
-		Label nonterminals):
+		Label nonterminals) nogil:
 	"""Retrieve end position for a given chart cell."""
 	cell = cell // nonterminals
 	cdef short start = 0, idx = 0
@@ -778,6 +807,53 @@ cdef inline short cellend(size_t cell, short lensent,
 # 	return start + round((lensent - start) * fractional) + 1
 
 
+cdef inline bint cfgwhitelisted(Whitelist whitelist, size_t span,
+		Label label) nogil:
+	"""Test whether a CFG span with given label is in whitelist."""
+	return (whitelist.cfg[span * whitelist.cfgwords + BITSLOT(label)]
+			& BITMASK(label)) != 0
+
+
+cdef inline uint64_t smallitemhash(SmallChartItem& item) nogil:
+	"""A hash of an item for the Bloom filter of a whitelist."""
+	cdef uint64_t result = (item.vec * 0x9E3779B97F4A7C15ULL) ^ item.label
+	result ^= result >> 29
+	result *= 0xBF58476D1CE4E5B9ULL
+	return result ^ (result >> 32)
+
+
+cdef inline bint smallwhitelisted(Whitelist whitelist,
+		SmallChartItem& item) nogil:
+	"""Test whether item is in ``whitelist.small``.
+
+	The Bloom filter rejects most items that are not, without a hash table
+	lookup."""
+	cdef uint64_t h
+	cdef int a, b
+	if whitelist.bloom.size():
+		h = smallitemhash(item)
+		a = h & whitelist.bloommask
+		b = (h >> 32) & whitelist.bloommask
+		if not (whitelist.bloom[BITSLOT(a)] & BITMASK(a)
+				and whitelist.bloom[BITSLOT(b)] & BITMASK(b)):
+			return False
+	return whitelist.small[item.label].count(item) != 0
+
+
+cdef inline uint32_t prodpairbucket(int parent, int child, bint right,
+		uint32_t numbuckets) nogil:
+	"""Return the bucket of a parent-child edge in the pair index.
+
+	The index of pairs of productions has a bucket for each edge from a
+	parent to its left or right child; see ``Ctrees.indexpairs()``."""
+	cdef uint64_t h = ((<uint64_t><uint32_t>parent << 32) | <uint32_t>child)
+	h ^= <uint64_t>right << 63
+	h ^= h >> 29
+	h *= 0xBF58476D1CE4E5B9ULL
+	h ^= h >> 32
+	return h % numbuckets
+
+
 cdef object log1e200 = log(1e200)
 
 
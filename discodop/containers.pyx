@@ -7,6 +7,7 @@ import mmap
 import pickle
 import logging
 import numpy as np
+from time import perf_counter
 from array import array
 from math import isinf, fsum
 from roaringbitmap import RoaringBitmap, MultiRoaringBitmap
@@ -14,8 +15,9 @@ from .tree import escape, unescape
 from .util import readbytes
 from .tree import Tree
 cimport cython
+from cython.parallel cimport prange
 from cython.operator cimport dereference
-from libc.string cimport strchr
+from libc.string cimport memchr
 from libc.stdio cimport FILE, fopen, fread, fclose
 
 cdef extern from "<algorithm>" namespace "std" nogil:
@@ -31,6 +33,28 @@ cdef int maxbitveclen = SLOTS * sizeof(uint64_t) * 8
 include "_grammar.pxi"
 
 
+cdef double walldeadline(double deadline):
+	"""Convert a deadline of ``time.perf_counter()`` to one of walltime().
+
+	The result can be checked without the GIL; 0 means no deadline."""
+	if not deadline:
+		return 0
+	# a deadline that has already passed should remain nonzero
+	return max(walltime() + (deadline - perf_counter()), 1e-9)
+
+
+cdef bint exceedsbudget(size_t numitems, size_t itemlimit,
+		double deadline) nogil:
+	"""Test whether a parser should stop early.
+
+	:param itemlimit: if nonzero, the maximum number of chart items.
+	:param deadline: if nonzero, stop when ``walltime()`` exceeds this value
+		(cf. ``walldeadline()``)."""
+	if itemlimit and numitems >= itemlimit:
+		return True
+	return deadline != 0 and walltime() > deadline
+
+
 cdef SmallChartItem CFGtoSmallChartItem(Label label, Idx start, Idx end):
 	cdef SmallChartItem result = SmallChartItem(
 			label, (1UL << end) - (1UL << start))
@@ -61,6 +85,31 @@ cdef class Chart:
 			grammars.
 
 	Level 1/2 defines a type for labeled spans referred to as ``item``."""
+	def reinit(self, *args, **kwds):
+		"""Clear chart and prepare it for another sentence.
+
+		Takes the same arguments as the constructor; allocated memory is
+		reused where possible."""
+		self.inside.clear()
+		self.outside.clear()
+		self.flatforest.clear()
+		self.rankededges.clear()
+		self.derivations = None
+		self.postime = self.binarytime = self.unarytime = 0
+		self.fragmenttime = 0
+		self.__init__(*args, **kwds)
+
+	def phasetimes(self):
+		"""Return the time in seconds spent on phases within parsing.
+
+		A dictionary with the keys ``pos`` (assigning POS tags), ``binary``
+		and ``unary`` (applying binary and unary rules), and
+		``recoverfragments`` (mapping derivations of a Double-DOP grammar
+		to parse trees). The times are wall clock times; with multiple
+		threads, the times of each thread are added."""
+		return dict(pos=self.postime, binary=self.binarytime,
+				unary=self.unarytime, recoverfragments=self.fragmenttime)
+
 	def root(self):
 		"""Return item with root label spanning the whole sentence."""
 		raise NotImplementedError
@@ -232,12 +281,32 @@ cdef class Chart:
 					m += 1
 		return '\n'.join(result)
 
+	def numedges(self):
+		"""Number of edges in chart."""
+		return sum([self.parseforest[self.getitemidx(n)].size()
+				for n in range(1, self.numitems() + 1)])
+
+	def memoryusage(self):
+		"""Estimate the number of bytes allocated for this chart.
+
+		Counts the capacity of the parse forest and the vectors with
+		probabilities and ranked edges; the item indices of subclasses are
+		not included."""
+		cdef size_t n, result = sizeof(Prob) * (self.probs.capacity()
+				+ self.inside.capacity() + self.outside.capacity())
+		result += self.parseforest.capacity() * sizeof(vector[Edge])
+		for n in range(self.parseforest.size()):
+			result += self.parseforest[n].capacity() * sizeof(Edge)
+		result += self.rankededges.capacity() * sizeof(
+				vector[pair[RankedEdge, Prob]])
+		for n in range(self.rankededges.size()):
+			result += self.rankededges[n].capacity() * sizeof(
+					pair[RankedEdge, Prob])
+		return result
+
 	def stats(self):
 		"""Return a short string with counts of items, edges."""
-		return 'items %d, edges %d' % (
-				self.numitems(),
-				sum([self.parseforest[self.getitemidx(n)].size()
-					for n in range(1, self.numitems() + 1)]))
+		return 'items %d, edges %d' % (self.numitems(), self.numedges())
 		# more stats:
 		# labels: len({self.label(item) for item in range(1, self.numitems() + 1)}),
 		# spans: ...
@@ -277,6 +346,49 @@ cdef class StringList(object):
 		return result.decode('utf8')
 
 
+@cython.final
+cdef class MappedStringList(object):
+	"""Read-only list of strings stored in a memory mapped file.
+
+	Strings are decoded on first access, so that processes mapping the same
+	file share its pages instead of holding copies of all strings; each
+	process only keeps the strings it has used. Empty strings are returned
+	as None."""
+	def __cinit__(self):
+		self.cache = {}
+
+	def __len__(self):
+		return self.size
+
+	def __getitem__(self, Py_ssize_t i):
+		cdef uint64_t start
+		if i < 0:
+			i += self.size
+		if i < 0 or <size_t>i >= self.size:
+			raise IndexError('index %d out of bounds (len=%d)' % (
+					i, self.size))
+		try:
+			return self.cache[i]
+		except KeyError:
+			pass
+		start = self.offsets[i - 1] if i else 0
+		if start == self.offsets[i]:
+			result = None
+		else:
+			result = self.data[start:self.offsets[i]].decode('utf8')
+		self.cache[i] = result
+		return result
+
+	def __iter__(self):
+		cdef size_t n
+		for n in range(self.size):
+			yield self[n]
+
+	def __reduce__(self):
+		"""Helper function for pickling; pickles a copy as a list."""
+		return (list, (list(self), ))
+
+
 @cython.final
 cdef class StringIntDict(object):
 	"""Proxy class to expose sparse_hash_map with read-only dict interface.
@@ -416,6 +528,48 @@ cdef class Ctrees:
 		if freeze:
 			self.prodindex = MultiRoaringBitmap(self.prodindex)
 
+	def indexpairs(self, filename=None, uint32_t numbuckets=0):
+		"""Create index from pairs of productions to trees containing them.
+
+		A pair consists of the production of a node and that of its left or
+		right child; pairs are hashed into a fixed number of buckets. Since a
+		tree fragment can only occur in trees with all of its pairs, this
+		index prunes the candidates for a fragment query more sharply than
+		``prodindex`` when the productions of the fragment are frequent.
+		The index is stored in the attribute ``pairindex``.
+
+		:param filename: if given, store the index in this file; it can be
+			loaded with ``MultiRoaringBitmap.fromfile(filename)``.
+		:param numbuckets: the number of buckets; by default, 4 times the
+			number of productions rounded up to a power of 2."""
+		cdef Node *nodes
+		cdef int n, m
+		cdef set buckets
+		if not numbuckets:
+			numbuckets = 64
+			while numbuckets < 4 * len(self.prodindex or ()):
+				numbuckets <<= 1
+		result = [None] * numbuckets
+		for n in range(self.len):
+			nodes = &self.nodes[self.trees[n].offset]
+			buckets = set()
+			for m in range(self.trees[n].len):
+				if nodes[m].prod < 0:
+					continue
+				if nodes[m].left >= 0:
+					buckets.add(prodpairbucket(nodes[m].prod,
+							nodes[nodes[m].left].prod, False, numbuckets))
+				if nodes[m].right >= 0:
+					buckets.add(prodpairbucket(nodes[m].prod,
+							nodes[nodes[m].right].prod, True, numbuckets))
+			for m in buckets:
+				rb = result[m]
+				if rb is None:
+					rb = result[m] = RoaringBitmap()
+				rb.add(n)
+		self.pairindex = MultiRoaringBitmap(result, filename=filename)
+		return self.pairindex
+
 	def extract(self, int n, Vocabulary vocab, bint disc=True, int node=-1):
 		"""Return given tree in discbracket format.
 
@@ -438,6 +592,38 @@ cdef class Ctrees:
 				if self.nodes[m].left < 0}
 		return [sent.get(m, None) for m in range(max(sent) + 1)]
 
+	def shards(self, int n, int start=0, int end=0):
+		"""Divide trees in at most n ranges with similar numbers of nodes.
+
+		:param start, end: the range of tree indices to divide; by default,
+			all trees.
+		:returns: a list of tuples ``(start, end)``."""
+		cdef long begin, total, target
+		cdef int a, b, lo, hi, m
+		if end <= 0 or end > self.len:
+			end = self.len
+		if start >= end:
+			return []
+		begin = self.trees[start].offset
+		total = self.trees[end - 1].offset + self.trees[end - 1].len - begin
+		result = []
+		a = start
+		for m in range(1, n + 1):
+			# binary search for first tree with offset >= target
+			target = begin + total * m // n
+			lo, hi = a, end
+			while lo < hi:
+				b = (lo + hi) // 2
+				if self.trees[b].offset < target:
+					lo = b + 1
+				else:
+					hi = b
+			b = end if m == n else lo
+			if b > a:
+				result.append((a, b))
+				a = b
+		return result
+
 	def printrepr(self, int n, Vocabulary vocab):
 		"""Print repr of a tree for debugging purposes."""
 		tree = self.extract(n, vocab, disc=True)
@@ -10,7 +10,7 @@ from __future__ import print_function
 import re
 from heapq import nlargest
 from math import exp, log, isinf, fsum
-from random import random
+from random import Random
 from bisect import bisect_right
 from operator import itemgetter, attrgetter
 from itertools import count
@@ -33,10 +33,13 @@ from libc.math cimport HUGE_VAL as INFINITY
 from libcpp.string cimport string
 from libcpp.vector cimport vector
 from libcpp.utility cimport pair
+from libcpp.algorithm cimport upper_bound
 from .bit cimport abitcount
 from .containers cimport (Prob, Grammar, ProbRule, LexicalRule, Chart,
 		SmallChartItem, FatChartItem, Edge, RankedEdge, Whitelist, Label,
-		ItemNo, sparse_hash_map, logprobadd, logprobsum, yieldranges)
+		ItemNo, sparse_hash_map, logprobadd, logprobsum, yieldranges,
+		walltime)
+from .coarsetofine cimport FlatEdge, computeinside, computeinsideoutside
 
 
 cdef extern from "macros.h":
@@ -78,6 +81,93 @@ cpdef getderivations(Chart chart, int k, derivstrings=True):
 	chart.derivations = lazykbest(chart, k, derivs=derivstrings)
 
 
+def samplederivations(Chart chart, int n, seed=None, derivstrings=True):
+	"""Sample *n* derivations from chart in proportion to their probability.
+
+	Each derivation is drawn top-down by choosing an incoming edge for each
+	item with probability proportional to the rule probability times the
+	inside probabilities of its children. Cheaper than extracting the *n*-best
+	derivations, and yields an unbiased estimate of the most probable parse.
+
+	:param n: number of derivations to sample; derivations may occur more
+		than once.
+	:param seed: seed for the random number generator; by default, samples
+		differ each time.
+	:param derivstrings: whether to create derivations as strings
+	:returns: ``None``. Modifies ``chart.derivations`` and
+		``chart.rankededges`` in-place, as :func:`getderivations`; however,
+		instead of its probability, each derivation is assigned the weight
+		``P(sent) / n``, such that the sum of these weights for the
+		derivations of a parse tree estimates its probability."""
+	cdef vector[FlatEdge] edges
+	cdef vector[double] cumprobs  # cumulative probs of edges for each item
+	cdef vector[size_t] firstedge  # the index of the first edge of each item
+	cdef pair[RankedEdge, Prob] entry
+	cdef ItemNo root = chart.root()
+	cdef Prob weight
+	cdef double cumprob = 0.0
+	cdef size_t m
+	if root not in chart:
+		raise ValueError('no complete derivation in chart')
+	# edges are grouped by item; precompute for each item the cumulative
+	# distribution over its edges, conditioned on the item.
+	edges = computeinside(chart, True)
+	if chart.inside[root] == -INFINITY:
+		raise ValueError('sentence has zero probability')
+	firstedge.resize(chart.probs.size())
+	for m in range(edges.size()):
+		if m == 0 or edges[m].item != edges[m - 1].item:
+			firstedge[edges[m].item] = m
+			cumprob = 0.0
+		cumprob += exp(edges[m].prob - chart.inside[edges[m].item]
+				+ (chart.inside[edges[m].left] if edges[m].left else 0.0)
+				+ (chart.inside[edges[m].right] if edges[m].right else 0.0))
+		cumprobs.push_back(cumprob)
+	chart.rankededges.clear()
+	chart.rankededges.resize(chart.parseforest.size())
+	random = Random(seed).random
+	for _ in range(n):
+		_samplederivation(root, chart, edges, cumprobs, firstedge, random)
+	weight = -chart.inside[root] + log(n)
+	for m in range(chart.rankededges[root].size()):
+		chart.rankededges[root][m].second = weight
+	if derivstrings:
+		chart.derivations = [(getderiv(root, entry.first, chart).decode('utf8'),
+				entry.second) for entry in chart.rankededges[root]]
+	else:
+		chart.derivations = None
+
+
+cdef int _samplederivation(ItemNo item, Chart chart, vector[FlatEdge]& edges,
+		vector[double]& cumprobs, vector[size_t]& firstedge, random
+		) except -1:
+	"""Sample a derivation headed by item and add it to chart.rankededges.
+
+	:returns: the rank of the new entry in ``chart.rankededges[item]``."""
+	cdef pair[RankedEdge, Prob] entry
+	cdef size_t start = firstedge[item]
+	cdef size_t end = start + chart.parseforest[item].size()
+	cdef size_t idx
+	cdef int left = -1, right = -1
+	cdef double x = random() * cumprobs[end - 1]
+	idx = upper_bound(&(cumprobs[start]), &(cumprobs[start]) + (end - start),
+			x) - &(cumprobs[0])
+	if idx >= end:  # guard against rounding errors
+		idx = end - 1
+	entry.second = -edges[idx].prob
+	if edges[idx].left:
+		left = _samplederivation(edges[idx].left, chart, edges, cumprobs,
+				firstedge, random)
+		entry.second += chart.rankededges[edges[idx].left][left].second
+	if edges[idx].right:
+		right = _samplederivation(edges[idx].right, chart, edges, cumprobs,
+				firstedge, random)
+		entry.second += chart.rankededges[edges[idx].right][right].second
+	entry.first = RankedEdge(chart.parseforest[item][idx - start], left, right)
+	chart.rankededges[item].push_back(entry)
+	return chart.rankededges[item].size() - 1
+
+
 cpdef marginalize(method, Chart chart, list sent=None, list tags=None,
 		int k=1000, int sldop_n=7, double mcplambda=1.0, set mcplabels=None,
 		bint ostag=False, set require=None, set block=None):
@@ -107,6 +197,9 @@ cpdef marginalize(method, Chart chart, list sent=None, list tags=None,
 		:'sl-dop': Simplicity-Likelihood DOP; select most likely parse from the
 			``sldop_n`` parse trees with the shortest derivations.
 		:'sl-dop-simple': Approximation of Simplicity-Likelihood DOP
+		:'max-rule-product', 'max-rule-sum', 'max-recall': select parse
+			tree directly from the parse forest; does not require k-best
+			derivations. See :func:`maxruleparse`.
 	:param k: when ``method='sl-dop``, number of derivations to consider.
 	:param require: optionally, a list of tuples ``(label, indices)``; only
 		parse trees containing these labeled spans will be kept.
@@ -124,13 +217,16 @@ cpdef marginalize(method, Chart chart, list sent=None, list tags=None,
 			NB: the list is in an arbitrary order.
 		:msg: a message reporting the number of derivations / parses.
 	"""
-	cdef list backtransform = chart.grammar.backtransform
+	cdef object backtransform = chart.grammar.backtransform
 	cdef bint mpd = method == 'mpd'
 	cdef bint shortest = method == 'shortest'
 	cdef bint dopreduction = backtransform is None
+	# DOP reduction derivations can be mapped to trees without strings
+	cdef bint fused = dopreduction and not ostag and not shortest
 	cdef pair[RankedEdge, Prob] entry
 	cdef vector[pair[RankedEdge, Prob]] entries
 	cdef sparse_hash_map[string, vector[Prob]] mpptrees
+	cdef sparse_hash_map[int, vector[Prob]] mpptreeids
 	cdef dict mpdtrees = {}
 	cdef dict derivlen = {}  # parsetree => (derivlen, derivprob)
 	cdef dict derivs = {}
@@ -145,6 +241,8 @@ cpdef marginalize(method, Chart chart, list sent=None, list tags=None,
 		return sldop_simple(sldop_n, chart)
 	elif method == 'mcp':
 		return maxconstituentsparse(chart, mcplambda, mcplabels)
+	elif method in ('max-rule-product', 'max-rule-sum', 'max-recall'):
+		return maxruleparse(chart, method)
 	elif method == 'shortest':
 		# filter out all derivations which are not shortest
 		if not dopreduction:
@@ -192,6 +290,18 @@ cpdef marginalize(method, Chart chart, list sent=None, list tags=None,
 				mpptrees[<string>treestr.encode('utf8')].push_back(-prob)
 				if treestr not in derivs:
 					derivs[treestr] = n
+	elif fused:  # DOP reduction, mpp or mpd
+		treeids, nodes, labels = derivtreeids(chart, mpd)
+		for n, treeid in enumerate(treeids):
+			prob = chart.rankededges[root][n].second
+			if mpd:
+				if treeid not in mpdtrees or -prob > mpdtrees[treeid]:
+					mpdtrees[treeid] = -prob
+					derivs[treeid] = n
+			else:
+				mpptreeids[treeid].push_back(-prob)
+				if treeid not in derivs:
+					derivs[treeid] = n
 	else:  # DOP reduction
 		for n, (deriv, prob) in enumerate(chart.derivations):
 			if ostag:
@@ -222,7 +332,22 @@ cpdef marginalize(method, Chart chart, list sent=None, list tags=None,
 				if treestr not in derivs:
 					derivs[treestr] = deriv
 
-	if ostag:
+	if fused:
+		cache = {}
+		if mpd:
+			results = [(treeidtostr(treeid, nodes, labels, cache), exp(prob),
+					fragmentsinderiv_str(derivstr(chart, derivs[treeid]),
+						chart, backtransform))
+					for treeid, prob in mpdtrees.items()]
+		else:
+			results = []
+			for it1 in mpptreeids:
+				results.append((
+						treeidtostr(it1.first, nodes, labels, cache),
+						logprobsum(it1.second),
+						fragmentsinderiv_str(derivstr(chart, derivs[it1.first]),
+							chart, backtransform)))
+	elif ostag:
 		results = []
 		for it in mpptrees:
 			treestr = REMOVEDEC.sub('', it.first.decode('utf8'))
@@ -269,9 +394,10 @@ cpdef marginalize(method, Chart chart, list sent=None, list tags=None,
 						chart, backtransform)))
 
 	msg = '%d derivations, %d parsetrees' % (
-			len(chart.derivations) if dopreduction
+			len(chart.derivations) if dopreduction and not fused
 				else chart.rankededges[root].size(),
-			len(mpdtrees) or len(derivlen) or mpptrees.size())
+			len(mpdtrees) or len(derivlen) or mpptrees.size()
+				or mpptreeids.size())
 	if require or block:
 		results = [(treestr, score, frags) for treestr, score, frags in results
 				if testconstraints(treestr, require, block)]
@@ -287,6 +413,107 @@ def testconstraints(treestr, require, block):
 	return spans.issuperset(require) and spans.isdisjoint(block)
 
 
+cdef derivtreeids(Chart chart, bint keepids):
+	"""Map the k-best derivations in chart to IDs of their parse trees.
+
+	Trees are hash-consed while walking the ranked edges, so that subtrees
+	shared between derivations are visited once, and derivations with the
+	same parse tree get the same ID, without building derivation strings
+	and removing the IDs of DOP reduction labels with regular expressions.
+
+	:param keepids: if True, nodes with a DOP reduction ID are distinguished
+		from nodes without one, which distinguishes derivations with the
+		same parse tree but different fragments, as with
+		``REMOVEIDS.sub('@1', deriv)``.
+	:returns: a tuple ``(treeids, nodes, labels)``, where ``treeids`` has
+		the tree ID for each derivation in ``chart.rankededges[chart.root()]``;
+		the other two elements are passed to :func:`treeidtostr`."""
+	cdef vector[vector[int]] memo
+	cdef vector[int] proj
+	cdef ItemNo root = chart.root()
+	cdef list treeids = [], nodes = [], labels = []
+	cdef dict nodeids = {}, labelids = {}
+	cdef size_t n
+	memo.resize(chart.rankededges.size())
+	proj.resize(chart.grammar.nonterminals, -1)
+	for n in range(chart.rankededges[root].size()):
+		treeids.append(_derivtreeid(root, n, chart, memo, proj,
+				nodeids, nodes, labelids, labels, keepids))
+	return treeids, nodes, labels
+
+
+cdef int _derivtreeid(ItemNo v, int rank, Chart chart,
+		vector[vector[int]]& memo, vector[int]& proj, dict nodeids,
+		list nodes, dict labelids, list labels, bint keepids) except -1:
+	"""Auxiliary function for ``derivtreeids()``.
+
+	A node is a tuple ``(label, left, right)`` with the IDs of its children,
+	or ``(label, -1, idx)`` for a terminal with index ``idx``."""
+	cdef RankedEdge ej
+	cdef Label label = chart.label(v)
+	cdef int left = -1, right = -1, result
+	cdef tuple node
+	if memo[v].size() == 0:
+		memo[v].resize(chart.rankededges[v].size(), -1)
+	elif memo[v][rank] != -1:
+		return memo[v][rank]
+	if proj[label] == -1:
+		strlabel = chart.grammar.tolabel[label]
+		key = REMOVEIDS.sub('@1' if keepids else '', strlabel)
+		if key not in labelids:
+			labelids[key] = len(labels)
+			labels.append(REMOVEIDS.sub('', strlabel))
+		proj[label] = labelids[key]
+	ej = chart.rankededges[v][rank].first
+	if ej.edge.rule is NULL:
+		right = chart.lexidx(ej.edge)
+	else:
+		left = _derivtreeid(chart.left(v, ej), ej.left, chart, memo, proj,
+				nodeids, nodes, labelids, labels, keepids)
+		if ej.right != -1:
+			right = _derivtreeid(chart.right(v, ej), ej.right, chart, memo,
+					proj, nodeids, nodes, labelids, labels, keepids)
+	node = (proj[label], left, right)
+	try:
+		result = nodeids[node]
+	except KeyError:
+		result = nodeids[node] = len(nodes)
+		nodes.append(node)
+	memo[v][rank] = result
+	return result
+
+
+cdef str derivstr(Chart chart, size_t n):
+	"""Return the n-th derivation in chart as a string."""
+	if chart.derivations:
+		return chart.derivations[n][0]
+	return getderiv(chart.root(), chart.rankededges[chart.root()][n].first,
+			chart).decode('utf8')
+
+
+cdef str treeidtostr(int treeid, list nodes, list labels, dict cache):
+	"""Produce a tree with an ID from ``derivtreeids()`` as a string.
+
+	The tree is in bracket notation; ``cache`` stores the strings of
+	subtrees."""
+	cdef int label, left, right
+	cdef str result
+	if treeid in cache:
+		return cache[treeid]
+	label, left, right = nodes[treeid]
+	if left == -1:
+		result = '(%s %d)' % (labels[label], right)
+	elif right == -1:
+		result = '(%s %s)' % (labels[label],
+				treeidtostr(left, nodes, labels, cache))
+	else:
+		result = '(%s %s %s)' % (labels[label],
+				treeidtostr(left, nodes, labels, cache),
+				treeidtostr(right, nodes, labels, cache))
+	cache[treeid] = result
+	return result
+
+
 cdef maxconstituentsparse(Chart chart, double labda, set labels=None):
 	"""Approximate the Max Constituents Parse (MCP) parse from k-best list.
 
@@ -306,7 +533,7 @@ cdef maxconstituentsparse(Chart chart, double labda, set labels=None):
 	cdef double prob, score, maxcombscore, contribution
 	cdef short start, spanlen
 	cdef object span, leftspan, rightspan, maxleft  # bitsets as Python ints
-	cdef list backtransform = chart.grammar.backtransform
+	cdef object backtransform = chart.grammar.backtransform
 	cdef list derivations = []
 	cdef ItemNo root = chart.root()
 	# FIXME: optimize datastructures
@@ -397,6 +624,123 @@ cdef maxconstituentsparse(Chart chart, double labda, set labels=None):
 				len(chart.derivations), sentprob)
 
 
+def maxruleparse(Chart chart, str method):
+	"""Select the tree with most expected correct rules or constituents.
+
+	Posterior probabilities of rules and labeled spans are computed from
+	inside and outside probabilities, and summed over the DOP annotations of
+	labels (``@n``); the best tree is then selected with a single pass over
+	the parse forest (Goodman 1996; Petrov & Klein 2007).
+
+	:param method: one of
+
+		:'max-rule-product': the product of rule posteriors.
+		:'max-rule-sum': the sum of rule posteriors.
+		:'max-recall': the sum of posteriors of labeled spans.
+	:returns: ``(parses, msg)`` as with :func:`marginalize`, with a single
+		parse tree. With max-rule-product, the score is a probability;
+		otherwise, it is an expected number of correct rules/constituents.
+	"""
+	cdef vector[FlatEdge] edges
+	cdef FlatEdge *edge
+	cdef ItemNo n, item, numitems = chart.numitems()
+	cdef size_t m
+	cdef double sentprob, logprob
+	cdef dict projlabels = {}  # label ID => label without DOP annotation
+	cdef dict itemnodes = {}  # item => node number
+	cdef dict nodeids = {}  # (label, indices) => node number
+	cdef list nodes = []  # node number => (label, indices)
+	cdef list posteriors = []  # node number => log posterior probability
+	cdef list nodeedges = []  # node number => {children: log posterior}
+	if chart.grammar.backtransform is not None:
+		raise ValueError('%s requires a grammar without backtransform; '
+				'e.g., DOP reduction.' % method)
+	edges = computeinsideoutside(chart, True)
+	sentprob = chart.inside[chart.root()]
+	# merge items which only differ in their DOP annotation into nodes
+	for n in range(1, numitems + 1):
+		item = chart.getitemidx(n)
+		logprob = chart.inside[item] + chart.outside[item] - sentprob
+		if logprob == -INFINITY:  # not part of a complete derivation
+			continue
+		label = chart.label(item)
+		if label not in projlabels:
+			projlabels[label] = REMOVEIDS.sub('', chart.grammar.tolabel[label])
+		key = (projlabels[label], tuple(chart.indices(item)))
+		if key not in nodeids:
+			nodeids[key] = len(nodes)
+			nodes.append(key)
+			posteriors.append(-INFINITY)
+			nodeedges.append({})
+		node = itemnodes[item] = nodeids[key]
+		posteriors[node] = logprobadd(posteriors[node], logprob)
+	for m in range(edges.size()):
+		edge = &(edges[m])
+		logprob = chart.outside[edge.item] + edge.prob - sentprob
+		if edge.left:
+			logprob += chart.inside[edge.left]
+		if edge.right:
+			logprob += chart.inside[edge.right]
+		if logprob == -INFINITY:
+			continue
+		children = None  # lexical edge
+		if edge.right:
+			children = (itemnodes[edge.left], itemnodes[edge.right])
+		elif edge.left:
+			children = (itemnodes[edge.left], )
+		tmp = nodeedges[itemnodes[edge.item]]
+		tmp[children] = logprobadd(tmp.get(children, -INFINITY), logprob)
+	if method == 'max-recall':
+		itemscores = [exp(logprob) if '|<' not in label else 0.0
+				for (label, _), logprob in zip(nodes, posteriors)]
+		for tmp in nodeedges:
+			for children in tmp:
+				tmp[children] = 0.0
+	else:
+		itemscores = [0.0] * len(nodes)
+		if method == 'max-rule-sum':
+			for tmp in nodeedges:
+				for children in tmp:
+					tmp[children] = exp(tmp[children])
+	best = [None] * len(nodes)  # node number => (score, children)
+	root = itemnodes[chart.root()]
+	if _maxrulenode(root, nodeedges, itemscores, best) == -INFINITY:
+		return [], '%s failed' % method
+	score = best[root][0]
+	return [(_maxruletree(root, nodes, best),
+			exp(score) if method == 'max-rule-product' else score,
+			None)], '%d nodes, %d edges; sentprob: %g' % (
+			len(nodes), sum(len(a) for a in nodeedges), exp(sentprob))
+
+
+cdef double _maxrulenode(int node, list nodeedges, list itemscores,
+		list best) except *:
+	"""Compute best score of node, memoized in ``best``."""
+	cdef double score, maxscore = -INFINITY
+	if best[node] is not None:
+		return best[node][0]
+	best[node] = (-INFINITY, None)  # break unary cycles
+	maxchildren = None
+	for children, score in nodeedges[node].items():
+		if children is not None:
+			for child in children:
+				score += _maxrulenode(child, nodeedges, itemscores, best)
+		if score > maxscore:
+			maxscore, maxchildren = score, children
+	best[node] = (maxscore + itemscores[node], maxchildren)
+	return best[node][0]
+
+
+def _maxruletree(int node, list nodes, list best):
+	"""Produce tree string from nodes selected by ``_maxrulenode()``."""
+	label, indices = nodes[node]
+	children = best[node][1]
+	if children is None:
+		return '(%s %d)' % (label, indices[0])
+	return '(%s %s)' % (label, ' '.join(
+			_maxruletree(child, nodes, best) for child in children))
+
+
 def gettree(cells, span):
 	"""Extract parse tree from most constituents correct table."""
 	if span not in cells:
@@ -426,7 +770,7 @@ cdef sldop(Chart chart, list sent, list tags, int m, int sldop_n):
 		Does not support PCFG charts."""
 	cdef dict derivations = {}
 	cdef dict derivs = {}
-	cdef list backtransform = chart.grammar.backtransform
+	cdef object backtransform = chart.grammar.backtransform
 	cdef pair[RankedEdge, Prob] entry
 	cdef Chart chart2
 	cdef int n
@@ -494,7 +838,7 @@ cdef sldop_simple(int sldop_n, Chart chart):
 	cdef pair[RankedEdge, Prob] entry
 	cdef dict derivations = {}
 	cdef dict derivs = {}, keys = {}
-	cdef list backtransform = chart.grammar.backtransform
+	cdef object backtransform = chart.grammar.backtransform
 	cdef int n
 	cdef ItemNo root = chart.root()
 	derivsfortree = defaultdict(set)
@@ -544,7 +888,7 @@ cdef sldop_simple(int sldop_n, Chart chart):
 
 
 cdef str recoverfragments(ItemNo root, RankedEdge deriv, Chart chart,
-		list backtransform):
+		backtransform):
 	"""Reconstruct a DOP derivation from a derivation with flattened fragments.
 
 	:param deriv: a RankedEdge representing a derivation.
@@ -559,18 +903,21 @@ cdef str recoverfragments(ItemNo root, RankedEdge deriv, Chart chart,
 	used to avoid blocking nonterminals from the double-dop binarization
 	(containing the string '}<'). Note that this means getmapping() has to have
 	been called on `chart.grammar`, even when not doing coarse-to-fine
-	parsing."""
+	parsing. The time spent is added to ``chart.phasetimes()``."""
+	cdef double begin = walltime()
 	if deriv.edge.rule is NULL:
 		result = '(%s %d)' % (
 				chart.grammar.tolabel[chart.label(root)],
 				chart.lexidx(deriv.edge))
 	else:
 		result = recoverfragments_(root, deriv, chart, backtransform)
-	return REMOVEWORDTAGS.sub('', result)
+	result = REMOVEWORDTAGS.sub('', result)
+	chart.fragmenttime += walltime() - begin
+	return result
 
 
 cdef str recoverfragments_(ItemNo v, RankedEdge deriv, Chart chart,
-		list backtransform):
+		backtransform):
 	cdef RankedEdge child
 	cdef list children = []
 	cdef vector[ItemNo] childitems
@@ -645,7 +992,7 @@ cdef str recoverfragments_(ItemNo v, RankedEdge deriv, Chart chart,
 
 
 cdef fragmentsinderiv_re(ItemNo root, RankedEdge deriv, chart,
-		list backtransform):
+		backtransform):
 	"""Extract the list of fragments that were used in a given derivation.
 
 	:returns: a list of (fragment, weight) in discbracket format."""
@@ -655,7 +1002,7 @@ cdef fragmentsinderiv_re(ItemNo root, RankedEdge deriv, chart,
 	return [(_fragments.pygetsent(frag), w) for frag, w in result]
 
 
-def fragmentsinderiv_str(str deriv, chart, list backtransform):
+def fragmentsinderiv_str(str deriv, chart, backtransform):
 	"""Extract the list of fragments that were used in a given derivation.
 
 	:returns: a list of (fragment, weight) in discbracket format."""
@@ -672,7 +1019,7 @@ def fragmentsinderiv_str(str deriv, chart, list backtransform):
 
 
 cdef fragmentsinderiv_re_(ItemNo v, RankedEdge deriv, Chart chart,
-		list backtransform, list result):
+		backtransform, list result):
 	cdef RankedEdge child
 	cdef vector[ItemNo] childitems
 	cdef vector[int] childranks
@@ -1121,6 +1468,7 @@ def test():
 		'shortest:\t%s %r' % e(short), sep='\n')
 
 
-__all__ = ['getderivations', 'marginalize', 'gettree', 'treeparsing',
-		'viterbiderivation', 'doprerank', 'dopparseprob', 'frontiernt',
-		'splitfrag', 'testconstraints']
+__all__ = ['getderivations', 'samplederivations', 'marginalize',
+		'maxruleparse', 'gettree', 'treeparsing', 'viterbiderivation',
+		'doprerank', 'dopparseprob', 'frontiernt', 'splitfrag',
+		'testconstraints']
@@ -8,14 +8,23 @@ import sys
 import gzip
 import json
 import logging
+import time
+import queue
+import threading
 import traceback
+import socketserver
 import multiprocessing
+import multiprocessing.pool
 from math import exp, log
 from time import process_time
 from heapq import nlargest
+from collections import OrderedDict
 from getopt import gnu_getopt, GetoptError
 from operator import itemgetter
+import copy
 import pickle
+import shutil
+import tempfile
 import numpy as np
 from . import plcfrs, pcfg, disambiguation
 from . import grammar, treetransforms, treebanktransforms
@@ -28,7 +37,7 @@ from .treebank import writetree, handlefunctions
 from .heads import saveheads, readheadrules, applyheadrules
 from .punctuation import punctprune, applypunct
 from .functiontags import applyfunctionclassifier
-from .util import workerfunc, openread
+from .util import workerfunc, openread, boundedimap, PhaseTimer
 from .treetransforms import binarizetree, binarize, splitdiscnodes
 from .grammar import UniqueIDs
 from .kbest import partitionincompletechart
@@ -83,7 +92,15 @@ DEFAULTS = dict(
 				# grammatical functions in postprocessing step
 		evalparam='proper.prm',  # EVALB-style parameter file
 		verbosity=2,
-		numproc=1)  # increase to use multiple CPUs; None: use all CPUs.
+		timeout=None,  # limit on the wall clock time to parse a sentence (s)
+		numproc=1,  # increase to use multiple CPUs; None: use all CPUs.
+		sharegrammars=False)  # with numproc > 1, store binary grammars in
+				# result directory and share them among processes
+
+# Objectives for which disambiguation switches the weights of the grammar
+# (cf. Grammar.switch()) or masks its rules (Grammar.setmask(), used by
+# treeparsing()); these cannot be used by threads sharing a grammar.
+GRAMMARCHANGINGOBJECTIVES = ('shortest', 'sl-dop', 'sl-dop-simple', 'mcp')
 
 DEFAULTSTAGE = dict(
 		name='stage1',  # identifier, used for filenames
@@ -105,7 +122,12 @@ DEFAULTSTAGE = dict(
 		mode='plcfrs',  # use the agenda-based PLCFRS parser
 		prune=False,  # whether to use previous chart to prune this stage
 		k=50,  # no. of coarse pcfg derivations to prune with; k=0: filter only
+		insideoutside='logprob',  # with 0 < k < 1; choices: logprob, prob
+		maxitems=0,  # if > 0, tighten pruning to select at most this many items
+		itemlimit=0,  # if > 0, stop parsing when chart has this many items
 		m=10,  # number of derivations to enumerate
+		sample=False,  # sample m derivations instead of taking the m-best
+		seed=None,  # seed for the random number generator with sample=True
 		estimator='rfe',  # choices: rfe, ewe
 		objective='mpp',  # choices: mpp, mpd, shortest, sl-dop[-simple]
 			# NB: w/shortest derivation, estimator only affects tie breaking.
@@ -114,8 +136,9 @@ DEFAULTSTAGE = dict(
 		mcplabels=None,  # optionally, set of labels to optimize for with mcp
 		beam_beta=1.0,  # beam pruning factor, between 0 and 1; 1 to disable.
 		beam_delta=40,  # maximum span length to which beam_beta is applied
+		numthreads=1,  # with mode='pcfg', threads to fill cells of a span
 		# deprecated options
-		kbest=True, sample=False, binarized=True,
+		kbest=True, binarized=True,
 		iterate=False, complement=False,
 		# now automatically inferred:
 		splitprune=False,  # treat VP_2[101] as {VP*[100], VP*[001]} for pruning
@@ -153,9 +176,18 @@ class Parser(object):
 		:py:func:`parser.readparam()`.
 	:param funcclassifier: optionally, a function tag classifier trained by
 		:py:func:`functiontags.trainfunctionclassifier`.
+	:param chartcache: if nonzero, keep the charts of this many recently
+		parsed sentences for stages without pruning; when the same sentence
+		is parsed again, e.g., with different ``require`` or ``block``
+		constraints, the chart is reused and only pruning and later stages
+		are redone.
+	:param profile: if True, record the number of edges and the memory usage
+		of the chart of each stage (``numedges``, ``chartmemory``); these
+		statistics require a pass over the chart.
 	"""
 
-	def __init__(self, prm, funcclassifier=None, loadtrees=False):
+	def __init__(self, prm, funcclassifier=None, loadtrees=False,
+			chartcache=0, profile=False):
 		self.prm = prm
 		self.stages = prm.stages
 		self.transformations = prm.transformations
@@ -164,11 +196,16 @@ class Parser(object):
 		self.relationalrealizational = prm.relationalrealizational
 		self.verbosity = prm.verbosity
 		self.funcclassifier = funcclassifier
+		self.profile = profile
 		self.headrules = None
 		if prm.binarization and prm.binarization.headrules and os.path.exists(
 				prm.binarization.headrules):
 			# FIXME: store headrules in grammar? non-essential
 			self.headrules = readheadrules(prm.binarization.headrules)
+		# per-stage settings that do not depend on the sentence
+		self.models = []  # name of the weights each stage parses with
+		self.prevn = []  # index of the stage used for pruning
+		stageidx = {stage.name: n for n, stage in enumerate(prm.stages)}
 		for stage in prm.stages:
 			model = 'default'
 			if stage.dop:
@@ -176,16 +213,29 @@ class Parser(object):
 					model = 'shortest'
 				elif stage.estimator != 'rfe':
 					model = stage.estimator
+			self.models.append(model)
+			self.prevn.append(stageidx[stage.prune] if stage.prune else 0)
 			if stage.mode != 'mc-rerank':
 				stage.grammar.switch(model, logprob=True)
 			if prm.verbosity >= 3:
 				print(stage.name)
 				print(stage.grammar)
+		self.chartpool = {}  # stage.name => chart that may be reused
+		# (stage.name, mode, sent, tags, root) => (chart, msg); LRU order
+		self.chartcache = OrderedDict()
+		self.chartcachesize = chartcache
+		self.itemsratio = {}  # stage.name => chart items / len(sent) ** 2
 		self.ctrees = self.newctrees = self.vocab = None
 		self.phrasallabels = self.functiontags = self.poslabels = None
 		if loadtrees:
 			self._loadtrees()
 
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['chartpool'] = {}  # charts are not picklable
+		state['chartcache'] = OrderedDict()
+		return state
+
 	def _loadtrees(self):
 		from .runexp import loadtraincorpus, getposmodel, dobinarization
 		from .containers import REMOVESTATESPLITS
@@ -241,6 +291,28 @@ class Parser(object):
 							stage.name), 'rt', encoding='utf8'))}
 		self.cnt = 0
 
+	def parsebatch(self, sents, tags=None, root=None):
+		"""Parse a list of sentences.
+
+		Sentences are parsed in order of length, which allows buffers of
+		pruning stages to be reused without reallocating them for each
+		sentence.
+
+		:param sents: a list of sentences, each a sequence of tokens.
+		:param tags: optionally, a list with a sequence of POS tags for each
+			sentence.
+		:param root: optionally, specify a non-default root label.
+		:returns: a list with, for each sentence in the original order, a
+			list with the result of each stage as yielded by
+			:meth:`Parser.parse`."""
+		whitelists = {}  # stage.name => Whitelist
+		results = [None] * len(sents)
+		for n in sorted(range(len(sents)), key=lambda n: len(sents[n])):
+			results[n] = list(self._parse(sents[n],
+					tags[n] if tags is not None else None,
+					root, None, (), (), whitelists))
+		return results
+
 	def parse(self, sent, tags=None, root=None, goldtree=None,
 			require=(), block=()):
 		"""Parse a sentence and perform postprocessing.
@@ -257,7 +329,31 @@ class Parser(object):
 			parse trees containing these labeled spans will be returned.
 			For example, ``('NP', [0, 1, 2])``.
 		:param block: optionally, a list of tuples ``(label, indices)``;
-			these labeled spans will be pruned."""
+			these labeled spans will be pruned.
+
+		Besides the parse trees, the result of each stage records its CPU
+		time, ``elapsedtime``, and the statistics ``numitems``, and with
+		``profile=True``, ``numedges`` and ``chartmemory`` (estimated bytes)
+		of its chart;
+		``phases`` maps the phases ``prune``, ``parse``, ``kbest``,
+		``marginalize`` and ``postprocess`` to tuples ``(wall, cpu)``
+		with their wall clock and CPU time in seconds; ``parsephases`` gives
+		the wall clock time of parts of these phases for this stage's chart,
+		as returned by :meth:`Chart.phasetimes`: assigning POS tags, binary
+		rules and unary rules (within ``parse``), and recovering fragments
+		(within ``marginalize``). When the time limit
+		(parameter ``timeout``) or the item limit of a stage (``itemlimit``)
+		is exceeded, ``stopped`` is ``'timeout'`` or ``'itemlimit'``. If the
+		stage did not produce a parse, the result of an earlier stage is
+		used; if there is none and the item limit was exceeded, the sentence
+		is parsed in parts, as when the parser fails."""
+		return self._parse(sent, tags, root, goldtree, require, block, None)
+
+	def _parse(self, sent, tags, root, goldtree, require, block, whitelists):
+		"""Generator for :meth:`Parser.parse`.
+
+		:param whitelists: if not None, a dictionary with white lists of
+			earlier sentences that will be reused."""
 		if 'PUNCT-PRUNE' in (self.transformations or ()):
 			origsent = sent[:]
 			punctprune(None, sent)
@@ -287,7 +383,11 @@ class Parser(object):
 					self.relationalrealizational)
 			treetransforms.addfanoutmarkers(goldtree)
 
+		deadline = (time.perf_counter() + self.prm.timeout
+				if self.prm.timeout else 0)
 		charts = {}  # stage.name => chart
+		usedcharts = {}  # stage.name => chart, returned to pool when done
+		cachedcharts = {}  # key => (chart, msg), added to cache when done
 		prevparsetrees = {}  # stage.name => parsetrees
 		chart = lastsuccessfulparse = None
 		totalgolditems = 0
@@ -295,28 +395,30 @@ class Parser(object):
 		# parse with each coarse-to-fine stage
 		for n, stage in enumerate(self.stages):
 			begin = process_time()
+			timer = PhaseTimer()
 			noparse = False
 			parsetrees = fragments = None
 			golditems = 0
 			msg = '%s:\t' % stage.name.upper()
-			model = 'default'
-			if stage.dop:
-				if stage.objective == 'shortest':
-					model = 'shortest'
-				elif stage.estimator != 'rfe':
-					model = stage.estimator
+			# when the time for this sentence is up, fall back to the result
+			# of an earlier stage.
+			stopped = None
+			basetimes = None  # phase times of chart before this stage
+			if deadline and time.perf_counter() > deadline:
+				stopped = 'timeout'
+				chart = None
 			if stage.mode != 'mc-rerank':
-				stage.grammar.switch(model, logprob=True)
+				stage.grammar.switch(self.models[n], logprob=True)
 
 			# do parsing; if CTF pruning enabled, require parent stage to
 			# be successful.
 			splitprune = False
-			if sent and (not stage.prune or charts[stage.prune]):
-				prevn = 0
-				if stage.prune:
-					prevn = [a.name for a in self.stages].index(stage.prune)
-					if not stage.split and self.stages[prevn].split:
-						splitprune = True
+			if sent and not stopped and (
+					not stage.prune or charts[stage.prune]):
+				prevn = self.prevn[n]
+				if (stage.prune and not stage.split
+						and self.stages[prevn].split):
+					splitprune = True
 				tree = goldtree
 				if goldtree is not None and self.stages[prevn].split:
 					tree = treetransforms.splitdiscnodes(
@@ -324,25 +426,48 @@ class Parser(object):
 				if n > 0 and stage.prune and stage.mode not in (
 						'dop-rerank', 'mc-rerank'):
 					beginprune = process_time()
+					timer.reset()
 					whitelist, msg1 = prunechart(
 							charts[stage.prune], stage.grammar, stage.k,
 							splitprune, self.stages[prevn].markorigin,
 							stage.mode.startswith('pcfg'),
-							set(require or ()), set(block or ()))
+							set(require or ()), set(block or ()),
+							whitelists.get(stage.name)
+								if whitelists is not None else None,
+							stage.insideoutside == 'logprob', stage.maxitems)
+					timer.lap('prune')
+					if whitelists is not None:
+						whitelists[stage.name] = whitelist
 					msg += '%s; %gs\n\t' % (msg1, process_time() - beginprune)
 				else:
 					whitelist = None
+				timer.reset()
+				cachekey = cached = None
+				if (self.chartcachesize and not stage.prune
+						and stage.mode in ('pcfg', 'plcfrs')):
+					cachekey = (stage.name, stage.mode, tuple(sent),
+							tuple(tags) if tags else None, root)
+					# reuse chart of an earlier call with this sentence
+					cached = self.chartcache.pop(cachekey, None)
+				if stage.mode in ('pcfg', 'plcfrs') and cached is None:
+					itemsestimate = self.estimateitems(sent, stage)
+					# NB: pop() so that concurrent calls get distinct charts
+					chart = self.chartpool.pop(stage.name, None)
 				if not sent:
 					pass
+				elif cached is not None:
+					chart, msg1 = cached
+					msg1 += '; reused chart'
 				elif stage.mode == 'pcfg':
 					chart, msg1 = pcfg.parse(
 							sent, stage.grammar, tags=tags, start=root,
 							whitelist=whitelist if stage.prune else None,
 							beam_beta=-log(stage.beam_beta),
 							beam_delta=stage.beam_delta,
-							itemsestimate=estimateitems(
-								sent, stage.prune, stage.mode, stage.dop),
-							postagging=self.postagging)
+							itemsestimate=itemsestimate,
+							postagging=self.postagging, chart=chart,
+							numthreads=stage.numthreads,
+							itemlimit=stage.itemlimit, deadline=deadline)
 				elif stage.mode == 'plcfrs':
 					chart, msg1 = plcfrs.parse(
 							sent, stage.grammar, tags=tags, start=root,
@@ -357,9 +482,9 @@ class Parser(object):
 								else None,
 							beam_beta=-log(stage.beam_beta),
 							beam_delta=stage.beam_delta,
-							itemsestimate=estimateitems(
-								sent, stage.prune, stage.mode, stage.dop),
-							postagging=self.postagging)
+							itemsestimate=itemsestimate,
+							postagging=self.postagging, chart=chart,
+							itemlimit=stage.itemlimit, deadline=deadline)
 				elif stage.mode == 'dop-rerank':
 					if prevparsetrees[stage.prune]:
 						parsetrees, msg1 = disambiguation.doprerank(
@@ -372,6 +497,20 @@ class Parser(object):
 								stage.grammar.trees1, stage.grammar.vocab)
 				else:
 					raise ValueError('unknown mode specified: %s' % stage.mode)
+				timer.lap('parse')
+				if stage.mode in ('pcfg', 'plcfrs'):
+					basetimes = chart.phasetimes() if cached else {}
+					self.updateitemsratio(stage, sent, chart.numitems())
+					if stage.itemlimit and chart.numitems() >= stage.itemlimit:
+						stopped = 'itemlimit'
+					elif deadline and time.perf_counter() > deadline:
+						stopped = 'timeout'
+					if cachekey is not None and not stopped:
+						cachedcharts[cachekey] = cached or (chart, msg1)
+					else:
+						usedcharts[stage.name] = chart
+					if stopped:
+						msg1 += '; stopped: %s' % stopped
 				if n > 0 and stage.prune and stage.mode not in (
 						'dop-rerank', 'mc-rerank') and goldtree is not None:
 					# count number of gold bracketings in pruned chart.
@@ -387,13 +526,19 @@ class Parser(object):
 							'pruning' % (golditems, totalgolditems))
 				msg += '%s\n\t' % msg1
 				if (n > 0 and stage.prune and not chart and not noparse
+						and not stopped
 						and stage.split == self.stages[prevn].split):
 					logging.error('ERROR: expected successful parse;\n'
 							'sent: %s\nstage %d: %s',
 							' '.join(sent), n, stage.name)
 					# raise ValueError('ERROR: expected successful parse. '
 					# 		'sent %s, %s.' % (nsent, stage.name))
-			numitems = chart.numitems() if hasattr(chart, 'numitems') else 0
+			numitems = numedges = chartmemory = 0
+			if hasattr(chart, 'numitems'):
+				numitems = chart.numitems()
+				if self.profile:
+					numedges = chart.numedges()
+					chartmemory = chart.memoryusage()
 
 			if self.verbosity >= 3 and chart:
 				print('sent: %s\nstage: %s' % (' '.join(sent), stage.name))
@@ -403,14 +548,30 @@ class Parser(object):
 			if (sent and chart and stage.mode not in ('dop-rerank', 'mc-rerank')
 					and not (self.relationalrealizational and stage.split)):
 				begindisamb = process_time()
-				disambiguation.getderivations(
-						chart, stage.m,
-						derivstrings=stage.dop not in ('doubledop', 'dop1')
-								or stage.objective == 'mcp'
-								or self.verbosity >= 3)
-				if self.verbosity >= 3:
-					print('%d-best derivations:\n%s' % (
+				timer.reset()
+				# these objectives work on the parse forest directly
+				kbest = not stage.dop or stage.objective not in (
+						'max-rule-product', 'max-rule-sum', 'max-recall')
+				# with mpp or mpd, derivations are mapped to parse trees
+				# directly, except with Double-DOP and OSTAG.
+				derivstrings = (stage.objective == 'mcp'
+						or self.verbosity >= 3 or (stage.dop
+							and stage.dop not in ('doubledop', 'dop1')
+							and (stage.dop == 'ostag' or stage.objective
+								not in ('mpp', 'mpd'))))
+				if kbest and stage.sample:
+					disambiguation.samplederivations(
+							chart, stage.m, seed=stage.seed,
+							derivstrings=derivstrings)
+				elif kbest:
+					disambiguation.getderivations(
+							chart, stage.m, derivstrings=derivstrings)
+				if kbest:
+					timer.lap('kbest')
+				if self.verbosity >= 3 and kbest:
+					print('%d %s derivations:\n%s' % (
 						min(stage.m, 100),
+						'sampled' if stage.sample else 'best',
 						'\n'.join('%d. %s %s' % (n + 1,
 							('subtrees=%d' % abs(int(prob / log(0.5))))
 							if stage.objective == 'shortest'
@@ -423,6 +584,7 @@ class Parser(object):
 					stage.grammar.switch('default'
 							if stage.estimator == 'rfe'
 							else stage.estimator, True)
+				timer.reset()
 				parsetrees, msg1 = disambiguation.marginalize(
 						stage.objective if stage.dop else 'mpd',
 						chart, sent=sent, tags=tags,
@@ -432,6 +594,7 @@ class Parser(object):
 						ostag=stage.dop == 'ostag',
 						require=set(require or ()),
 						block=set(block or ()))
+				timer.lap('marginalize')
 				msg += 'disambiguation: %s, %gs\n\t' % (
 						msg1, process_time() - begindisamb)
 				if self.verbosity >= 3:
@@ -455,7 +618,9 @@ class Parser(object):
 			elif (sent and not chart
 					and stage.mode not in ('dop-rerank', 'mc-rerank')
 					and not (self.relationalrealizational and stage.split)
-					and not partialparse):  # sentence could not be parsed
+					and not partialparse
+					and (not stopped or (stopped == 'itemlimit'
+						and lastsuccessfulparse is None))):  # could not parse
 				partition = partitionincompletechart(chart, 0, len(sent))
 				msg = '%spartition: %s\n' % (
 						msg.rstrip('\t'), repr(partition))
@@ -496,6 +661,7 @@ class Parser(object):
 				prevparsetrees[stage.name] = parsetrees
 
 			# postprocess, yield result
+			timer.reset()
 			if parsetrees:
 				resultstr = ''
 				try:
@@ -523,14 +689,49 @@ class Parser(object):
 						stage, xsent, tags, lastsuccessfulparse, n)
 				parsetrees = [(lastsuccessfulparse or str(parsetree),
 						prob, None)]
+			timer.lap('postprocess')
+			parsephases = {}
+			if basetimes is not None:
+				parsephases = {name: sec - basetimes.get(name, 0.0)
+						for name, sec in chart.phasetimes().items()}
 			elapsedtime = process_time() - begin
 			msg += '%.2fs cpu time elapsed\n' % (elapsedtime)
 			yield DictObj(name=stage.name, parsetree=parsetree, prob=prob,
 					parsetrees=parsetrees, fragments=fragments,
 					noparse=noparse, elapsedtime=elapsedtime,
-					numitems=numitems, golditems=golditems,
-					totalgolditems=totalgolditems, msg=msg)
+					numitems=numitems, numedges=numedges,
+					chartmemory=chartmemory, phases=timer.phases,
+					parsephases=parsephases, stopped=stopped,
+					golditems=golditems, totalgolditems=totalgolditems,
+					msg=msg)
 		del charts, prevparsetrees
+		self.chartpool.update(usedcharts)
+		for key, value in cachedcharts.items():
+			self.chartcache[key] = value
+			if len(self.chartcache) > self.chartcachesize:
+				# return least recently used chart to pool
+				key, (chart, _) = self.chartcache.popitem(last=False)
+				self.chartpool.setdefault(key[0], chart)
+
+	def estimateitems(self, sent, stage):
+		"""Estimate number of chart items needed for a sentence.
+
+		Based on the number of items of previous sentences parsed with this
+		stage; before the first sentence, :func:`estimateitems` is used."""
+		ratio = self.itemsratio.get(stage.name)
+		if ratio is None:
+			return estimateitems(sent, stage.prune, stage.mode, stage.dop)
+		return int(ratio * len(sent) ** 2) + 1
+
+	def updateitemsratio(self, stage, sent, numitems):
+		"""Update estimate of chart items with a parsed sentence.
+
+		Increases immediately, but decreases gradually, since reallocation
+		is more costly than reserving a bit too much memory."""
+		observed = numitems / len(sent) ** 2
+		ratio = self.itemsratio.get(stage.name, observed)
+		self.itemsratio[stage.name] = max(
+				observed, 0.9 * ratio + 0.1 * observed)
 
 	def postprocess(self, treestr, sent, stage):
 		"""Take parse tree and apply postprocessing."""
@@ -568,7 +769,8 @@ class Parser(object):
 					in enumerate(tags or (len(sent) * ['NN']))])
 			parsetree = ParentedTree(
 					'(%s %s)' % (stage.grammar.start, default))
-			applyheadrules(parsetree, self.headrules)
+			if self.headrules:
+				applyheadrules(parsetree, self.headrules)
 		noparse = True
 		prob = 1.0
 		return parsetree, prob, noparse
@@ -700,7 +902,13 @@ def readgrammars(resultdir, stages, postagging=None,
 	"""Read the grammars from a previous experiment.
 
 	Expects a directory ``resultdir`` which contains the relevant grammars and
-	the parameter file ``params.prm``, as produced by ``runexp``."""
+	the parameter file ``params.prm``, as produced by ``runexp``.
+
+	:param cache: if True, load each grammar from a binary file
+		``resultdir/<stage>.g`` if it exists, or create it after the grammar
+		has been read and its mappings have been computed. Loading a binary
+		grammar avoids parsing the text grammar, indexing its rules, and
+		computing the mappings between stages."""
 	if os.path.exists('%s/mapping.json.gz' % resultdir):
 		mappings = json.load(openread('%s/mapping.json.gz' % resultdir))
 		for stage, mapping in zip(stages, mappings):
@@ -718,7 +926,12 @@ def readgrammars(resultdir, stages, postagging=None,
 		logging.info('reading: %s', stage.name)
 		backtransform = outside = None
 		prevn = 0
-		if stage.mode != 'mc-rerank':
+		binfile = '%s/%s.g' % (resultdir, stage.name)
+		cached = (cache and stage.mode != 'mc-rerank'
+				and os.path.exists(binfile))
+		if cached:
+			gram = Grammar.frombinfile(binfile)
+		elif stage.mode != 'mc-rerank':
 			rules = '%s/%s.rules.gz' % (resultdir, stage.name)
 			lexicon = '%s/%s.lex.gz' % (resultdir, stage.name)
 			probsfile = '%s/%s.probs.npz' % (resultdir, stage.name)
@@ -727,14 +940,8 @@ def readgrammars(resultdir, stages, postagging=None,
 			if stage.dop in ('doubledop', 'dop1'):
 				backtransform = openread('%s/%s.backtransform.gz' % (
 						resultdir, stage.name)).read().splitlines()
-			if cache and os.path.exists('%s/%s.g' % (resultdir, stage.name)):
-				gram = Grammar.frombinfile('%s/%s.g' % (resultdir, stage.name),
-						rules, lexicon, backtransform=backtransform)
-			else:
-				gram = Grammar(rules, lexicon, start=top, altweights=probsfile,
-						backtransform=backtransform)
-				if cache:
-					gram.tobinfile('%s/%s.g' % (resultdir, stage.name))
+			gram = Grammar(rules, lexicon, start=top, altweights=probsfile,
+					backtransform=backtransform)
 		if n and stage.prune:
 			prevn = [a.name for a in stages].index(stage.prune)
 		if stage.mode == 'mc-rerank':
@@ -743,7 +950,9 @@ def readgrammars(resultdir, stages, postagging=None,
 		elif stage.dop:
 			if stage.estimates is not None:
 				raise ValueError('not supported')
-			if stage.dop in ('doubledop', 'dop1'):
+			if cached:  # mappings are stored in binary grammar
+				pass
+			elif stage.dop in ('doubledop', 'dop1'):
 				# recoverfragments() relies on this mapping to identify
 				# binarization nodes. treeparsing() relies on this as well.
 				_ = gram.getmapping(
@@ -775,7 +984,7 @@ def readgrammars(resultdir, stages, postagging=None,
 					# defaults to 1-1 mapping otherwise.
 					gram.getrulemapping(gram, re.compile(r'@[-0-9]+\b'))
 		else:  # not stage.dop
-			if n and stage.prune:
+			if n and stage.prune and not cached:
 				_ = gram.getmapping(stages[prevn].grammar,
 					neverblockre=re.compile(stage.neverblockre)
 						if stage.neverblockre else None,
@@ -793,8 +1002,13 @@ def readgrammars(resultdir, stages, postagging=None,
 			elif stage.estimates:
 				raise ValueError('unrecognized value; specify SX or SXlrgaps.')
 
-		if stage.mode != 'mc-rerank':
+		if cached:
+			msg = 'loaded binary grammar %s' % binfile
+		elif stage.mode != 'mc-rerank':
 			_sumsto1, msg = gram.testgrammar()
+			if cache:
+				gram.tobinfile(binfile)
+				gram = Grammar.frombinfile(binfile)
 		logging.info('%s: %s', stage.name, msg)
 		stage.update(grammar=gram, outside=outside)
 	if postagging and postagging.method == 'unknownword':
@@ -808,6 +1022,39 @@ def readgrammars(resultdir, stages, postagging=None,
 				None, None, resultdir + '/compounds.txt')
 
 
+def sharegrammars(stages, directory):
+	"""Replace grammars with copies backed by memory mapped binary files.
+
+	Grammars that were not loaded from a binary file are stored in
+	``directory`` with :meth:`Grammar.tobinfile`. Worker processes then share
+	a single copy of the backtransform tables and alternative weights through
+	the page cache, instead of holding private copies (with fork, pages with
+	Python objects are gradually copied as reference counts are updated).
+	With the spawn or forkserver start methods, workers unpickle the grammars
+	by mapping these files, instead of re-reading the text grammars.
+
+	:param directory: should exist as long as the worker processes."""
+	for stage in stages:
+		if stage.mode == 'mc-rerank' or stage.grammar.binfile is not None:
+			continue
+		model, logprob = stage.grammar.currentmodel, stage.grammar.logprob
+		filename = os.path.join(directory, '%s.g' % stage.name)
+		stage.grammar.tobinfile(filename)
+		stage.grammar = Grammar.frombinfile(filename)
+		stage.grammar.switch(model, logprob=logprob)
+
+
+def _sharedparser(parser, directory):
+	"""Return a copy of parser with grammars shared through files.
+
+	The stages of ``parser`` itself are not modified, so its grammars remain
+	usable after ``directory`` is removed."""
+	result = copy.copy(parser)
+	result.stages = [DictObj(vars(stage)) for stage in parser.stages]
+	sharegrammars(result.stages, directory)
+	return result
+
+
 def probstr(prob):
 	"""Render probability / number of subtrees as string."""
 	if isinstance(prob, tuple):
@@ -846,7 +1093,7 @@ def readparam(filename):
 			else:
 				params[key] = DEFAULTS[key]
 	for stage in params['stages']:
-		for key in ('sample', 'iterate', 'complement'):
+		for key in ('iterate', 'complement'):
 			if stage.get(key):
 				raise ValueError('option %r no longer supported' % key)
 		if not stage.get('binarized', True):
@@ -865,6 +1112,9 @@ def readparam(filename):
 		if stage.mode not in (
 				'plcfrs', 'pcfg', 'dop-rerank', 'mc-rerank'):
 			raise ValueError('unrecognized mode argument: %r.' % stage.mode)
+		if stage.insideoutside not in ('logprob', 'prob'):
+			raise ValueError('unrecognized insideoutside argument: %r.'
+					% stage.insideoutside)
 		if n == 0 and stage.prune:
 			raise ValueError('need previous stage to prune, '
 					'but this stage is first.')
@@ -878,7 +1128,14 @@ def readparam(filename):
 		if stage.dop:
 			assert stage.estimator in ('rfe', 'ewe', 'bon')
 			assert stage.objective in ('mpp', 'mpd', 'mcp', 'shortest',
-					'sl-dop', 'sl-dop-simple')
+					'sl-dop', 'sl-dop-simple', 'max-rule-product',
+					'max-rule-sum', 'max-recall')
+			if stage.objective.startswith('max-') and stage.dop != 'reduction':
+				raise ValueError('objective %r requires dop=\'reduction\'.'
+						% stage.objective)
+			if stage.sample and stage.objective in ('mpd', 'shortest'):
+				raise ValueError('objective %r not compatible with sampled '
+						'derivations.' % stage.objective)
 	assert params['binarization'].method in (
 			None, 'default', 'optimal', 'optimalhead')
 	postagging = params['postagging']
@@ -933,18 +1190,24 @@ def mpworker(args):
 
 
 def worker(args):
-	"""Parse a single sentence."""
+	"""Parse a single sentence.
+
+	:returns: a tuple ``(output, noparse, sec, msg, stagetimes, profile)``
+		where ``stagetimes`` is a list of ``(stagename, cputime)`` tuples,
+		and ``profile`` a list with a dictionary of timings and chart
+		statistics for each stage."""
 	key, line = args
 	line = line.strip()
 	if not line:
-		return '', True, 0, ''
+		return '', True, 0, '', [], []
 	begin = process_time()
 	sent = line.split(' ')
 	tags = None
 	if PARAMS.usetags:
 		sent, tags = zip(*(a.rsplit('/', 1) for a in sent))
 	msg = 'parsing %s: %s' % (key, ' '.join(sent))
-	result = list(PARAMS.parser.parse(sent, tags=tags))[-1]
+	results = list(PARAMS.parser.parse(sent, tags=tags))
+	result = results[-1]
 	output = ''
 	if result.noparse:
 		msg += '\nNo parse for "%s"' % ' '.join(sent)
@@ -972,56 +1235,359 @@ def worker(args):
 		output += ''.join(tmp)
 	sec = process_time() - begin
 	msg += '\n%g s' % sec
-	return output, result.noparse, sec, msg
+	stagetimes = [(a.name, a.elapsedtime) for a in results]
+	profile = [dict(sentid=key, len=len(sent), stage=a.name,
+			elapsedtime=a.elapsedtime, noparse=a.noparse, stopped=a.stopped,
+			numitems=a.numitems, numedges=a.numedges,
+			chartmemory=a.chartmemory,
+			phases={name: dict(wall=wall, cpu=cpu)
+				for name, (wall, cpu) in a.phases.items()},
+			parsephases=a.parsephases)
+			for a in results]
+	return output, result.noparse, sec, msg, stagetimes, profile
 
 
 def doparsing(parser, infile, out, printprob, oneline, usetags, numparses,
-		numproc, fmt, morphology, sentid):
-	"""Parse sentences from file and write results to file, log to stdout."""
-	times = []
-	unparsed = 0
+		numproc, fmt, morphology, sentid, chunksize=1, window=None,
+		threads=False, profile=None, share=False):
+	"""Parse sentences from file and write results to file, log to stdout.
+
+	Input is read lazily and results are written in input order as soon as
+	they are available.
+
+	:param chunksize: number of sentences sent to a worker process at once.
+	:param window: maximum number of chunks being parsed or waiting to be
+		written; defaults to 4 chunks per worker process.
+	:param threads: if True, parse with ``numproc`` threads instead of
+		processes; the threads share the parser and its grammars in memory,
+		and release the GIL while parsing a chart.
+	:param profile: optionally, a file to which timings and chart statistics
+		of each stage and sentence are written, as lines of JSON; create
+		``parser`` with ``profile=True`` to include the number of edges and
+		the memory usage of the charts.
+	:param share: if True, worker processes share the grammars through
+		memory mapped files in a temporary directory (cf.
+		:py:func:`sharegrammars`); grammars loaded from binary files are
+		always shared."""
+	numsents = unparsed = 0
+	totaltime = 0.0
 	if not oneline:
 		infile = readinputbitparstyle(infile)
 	if sentid:
 		infile = (line.split('|', 1) for line in infile if line.strip())
 	else:
 		infile = enumerate((line for line in infile if line.strip()), 1)
+	tmpdir = None
 	if numproc == 1:
 		initworker(parser, printprob, usetags, numparses, fmt, morphology)
-		mymap, myworker = map, worker
+		results = map(worker, infile)
 	else:
-		pool = multiprocessing.Pool(
+		if threads:
+			for stage in parser.stages:
+				if stage.dop and stage.objective in GRAMMARCHANGINGOBJECTIVES:
+					raise ValueError('objective %r of stage %r changes the '
+							'weights or mask of its grammar while parsing; '
+							'not supported with threads.' % (
+							stage.objective, stage.name))
+			poolcls = multiprocessing.pool.ThreadPool
+		else:
+			if share:
+				tmpdir = tempfile.mkdtemp(prefix='discodop')
+				parser = _sharedparser(parser, tmpdir)
+			poolcls = multiprocessing.Pool
+		pool = poolcls(
 				processes=numproc, initializer=initworker,
 				initargs=(parser, printprob, usetags, numparses, fmt,
 					morphology))
-		mymap, myworker = pool.map, mpworker
-	for output, noparse, sec, msg in mymap(myworker, infile):
+		results = boundedimap(pool, mpworker, infile, chunksize=chunksize,
+				window=window or 4 * (numproc or os.cpu_count() or 1))
+	for output, noparse, sec, msg, _, stageprofile in results:
 		if output:
 			print(msg, file=sys.stderr)
 			out.write(output)
+			if profile is not None:
+				for record in stageprofile:
+					profile.write(json.dumps(record) + '\n')
 			if noparse:
 				unparsed += 1
-			times.append(sec)
+			numsents += 1
+			totaltime += sec
 			sys.stderr.flush()
 			out.flush()
-	print('average time per sentence', sum(times) / len(times),
+	if numproc != 1:
+		pool.close()
+		pool.join()
+	if tmpdir is not None:
+		shutil.rmtree(tmpdir)
+	print('average time per sentence', totaltime / (numsents or 1),
 			'\nunparsed sentences:', unparsed,
 			'\nfinished',
 			file=sys.stderr)
 	out.close()
 
 
+@workerfunc
+def serverworker(args):
+	"""Parse a single sentence for the server; also return start time."""
+	started = time.time()
+	return started, worker(args)
+
+
+class ServerStats(object):
+	"""Thread-safe counters for the queue and latencies of a parser server."""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.started = time.time()
+		self.received = self.parsed = self.unparsed = self.failed = 0
+		self.waittime = self.walltime = 0.0
+		self.stagetimes = {}  # stage name => [total cpu time, max cpu time]
+
+	def submit(self):
+		"""Register a newly queued sentence."""
+		with self.lock:
+			self.received += 1
+
+	def done(self, submitted, started, noparse, stagetimes):
+		"""Register a finished sentence."""
+		finished = time.time()
+		with self.lock:
+			self.parsed += 1
+			self.unparsed += noparse
+			self.waittime += max(0.0, started - submitted)
+			self.walltime += finished - submitted
+			for name, sec in stagetimes:
+				total = self.stagetimes.setdefault(name, [0.0, 0.0])
+				total[0] += sec
+				total[1] = max(total[1], sec)
+
+	def error(self):
+		"""Register a sentence for which the worker raised an exception."""
+		with self.lock:
+			self.failed += 1
+
+	def summary(self):
+		"""Return a dictionary with current queue depth and mean latencies."""
+		with self.lock:
+			parsed = self.parsed or 1
+			return dict(
+					queued=self.received - self.parsed - self.failed,
+					received=self.received,
+					parsed=self.parsed,
+					unparsed=self.unparsed,
+					failed=self.failed,
+					uptime=time.time() - self.started,
+					meanwait=self.waittime / parsed,
+					meanlatency=self.walltime / parsed,
+					stages={name: dict(meancputime=total / parsed,
+							maxcputime=maxsec)
+						for name, (total, maxsec) in self.stagetimes.items()})
+
+
+class ServerHandler(socketserver.StreamRequestHandler):
+	"""Handle a connection to the parser server.
+
+	Each line received is a request, and for each request exactly one line
+	with a JSON object is sent back, in the same order as the requests.
+	A request is either a sentence (in the same format as the input of the
+	command line parser), or a JSON object of the form
+	``{"sent": "...", "id": "..."}`` or ``{"cmd": "stats"}``.
+	Requests are dispatched to the worker pool as soon as they are read, so
+	that a single connection may send many sentences without waiting; when
+	the responses of ``server.window`` requests are pending, reading stops
+	until the first of these has been sent."""
+
+	def handle(self):
+		pending = queue.Queue(self.server.window)
+		writer = threading.Thread(target=self.writeresults, args=(pending, ))
+		writer.start()
+		try:
+			for line in self.rfile:
+				try:
+					line = line.decode('utf8').strip()
+				except UnicodeDecodeError as err:
+					pending.put(dict(error='invalid UTF-8: %s' % err))
+					continue
+				if not line:
+					continue
+				key = None
+				if line.startswith('{'):
+					try:
+						request = json.loads(line)
+					except ValueError as err:
+						pending.put(dict(error='invalid JSON: %s' % err))
+						continue
+					if request.get('cmd') == 'stats':
+						pending.put(self.server.stats.summary)
+						continue
+					elif not isinstance(request.get('sent'), str):
+						pending.put(dict(error='expected "cmd", or "sent" '
+								'with a string.'))
+						continue
+					key, line = request.get('id'), request['sent'].strip()
+				elif self.server.sentid:
+					if '|' not in line:
+						pending.put(dict(error='expected "id|sentence".'))
+						continue
+					key, line = line.split('|', 1)
+				with self.server.stats.lock:
+					self.server.count += 1
+					if key is None:
+						key = self.server.count
+				pending.put((key, self.submit(key, line)))
+		finally:
+			pending.put(None)
+			writer.join()
+
+	def submit(self, key, line):
+		"""Queue a sentence for parsing; return an ``AsyncResult``."""
+		stats = self.server.stats
+		submitted = time.time()
+
+		def callback(result):
+			"""Update statistics when sentence has been parsed."""
+			started, (_, noparse, _, _, stagetimes, _) = result
+			stats.done(submitted, started, noparse, stagetimes)
+
+		def errorcallback(_err):
+			"""Update statistics when worker raised an exception."""
+			stats.error()
+
+		stats.submit()
+		return self.server.pool.apply_async(
+				serverworker, ((key, line), ),
+				callback=callback, error_callback=errorcallback)
+
+	def writeresults(self, pending):
+		"""Write responses in order of requests, as they become available."""
+		while True:
+			item = pending.get()
+			if item is None:
+				break
+			elif callable(item):
+				response = item()
+			elif isinstance(item, dict):
+				response = item
+			else:
+				key, asyncresult = item
+				try:
+					_, (output, noparse, sec, msg, stagetimes, _
+							) = asyncresult.get()
+				except Exception as err:  # pylint: disable=W0703
+					logging.error('%s', err)
+					response = dict(id=key, error=str(err))
+				else:
+					if self.server.verbosity >= 2:
+						print(msg, file=sys.stderr)
+					response = dict(id=key, output=output, noparse=noparse,
+							cputime=sec, stages=dict(stagetimes),
+							queued=self.server.stats.summary()['queued'])
+			try:
+				self.wfile.write(
+						(json.dumps(response) + '\n').encode('utf8'))
+				self.wfile.flush()
+			except (BrokenPipeError, ConnectionResetError):
+				pass  # keep consuming results so that the reader can finish
+
+
+class ParserServer(socketserver.ThreadingMixIn):
+	"""A server with a thread per connection and a pool of parser workers.
+
+	:param pool: a ``multiprocessing.Pool`` initialized with
+		:py:func:`initworker`.
+	:param sentid: whether sentences are prefixed by an ID and ``|``.
+	:param verbosity: with 2 or more, print parser messages to stderr.
+	:param window: the maximum number of requests of a connection that are
+		being parsed or whose responses have not been sent yet; 0 for no
+		limit."""
+	daemon_threads = True
+
+	def __init__(self, address, pool, sentid=False, verbosity=2, window=0):
+		super().__init__(address, ServerHandler, bind_and_activate=False)
+		self.pool = pool
+		self.stats = ServerStats()
+		self.sentid = sentid
+		self.verbosity = verbosity
+		self.window = window
+		self.count = 0  # number of sentences received, for default IDs
+
+
+class ThreadingUnixServer(ParserServer, socketserver.UnixStreamServer):
+	"""A parser server listening on a Unix domain socket."""
+
+
+class ThreadingTCPServer(ParserServer, socketserver.TCPServer):
+	"""A parser server listening on a TCP port."""
+	allow_reuse_address = True
+
+
+def serve(parser, address, printprob, usetags, numparses, numproc, fmt,
+		morphology, sentid, verbosity=2, share=False, window=None):
+	"""Load grammars once and parse sentences received over a socket.
+
+	:param address: either the path of a Unix domain socket, or a string
+		``host:port`` to listen on a TCP port (use only on trusted networks).
+	:param window: the maximum number of sentences of a connection that are
+		being parsed or whose responses have not been sent; defaults to 4
+		per worker process.
+
+	Sentences are parsed by a pool of ``numproc`` worker processes, which are
+	started once; with ``share=True``, they share the grammars through memory
+	mapped files (cf. :py:func:`doparsing`). See :py:class:`ServerHandler` for
+	the protocol. Runs until interrupted."""
+	host, sep, port = address.rpartition(':')
+	istcp = sep and port.isdigit()
+	if not istcp and os.path.exists(address):
+		raise ValueError('socket path exists: %r' % address)
+	tmpdir = None
+	if share:
+		tmpdir = tempfile.mkdtemp(prefix='discodop')
+		parser = _sharedparser(parser, tmpdir)
+	pool = multiprocessing.Pool(
+			processes=numproc, initializer=initworker,
+			initargs=(parser, printprob, usetags, numparses, fmt,
+				morphology))
+	window = window or 4 * (numproc or os.cpu_count() or 1)
+	if istcp:
+		server = ThreadingTCPServer((host or 'localhost', int(port)),
+				pool, sentid, verbosity, window)
+	else:
+		server = ThreadingUnixServer(
+				address, pool, sentid, verbosity, window)
+	try:
+		server.server_bind()
+		server.server_activate()
+		print('listening on %s with %d worker processes' % (
+				address, pool._processes),  # pylint: disable=W0212
+				file=sys.stderr)
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		pool.terminate()
+		pool.join()
+		if tmpdir is not None:
+			shutil.rmtree(tmpdir)
+		if isinstance(server, ThreadingUnixServer) and os.path.exists(
+				address):
+			os.unlink(address)
+		print(json.dumps(server.stats.summary()), file=sys.stderr)
+
+
 def main():
 	"""Handle command line arguments."""
-	flags = 'help prob tags sentid simple'.split()
-	options = flags + 'obj= bt= numproc= fmt= verbosity='.split()
+	flags = 'help prob tags sentid simple cache share threads'.split()
+	options = flags + ('obj= bt= numproc= fmt= verbosity= serve= '
+			'chunksize= profile=').split()
 	try:
 		opts, args = gnu_getopt(sys.argv[2:], 'hb:s:m:x', options)
 	except GetoptError as err:
 		print('error:', err, file=sys.stderr)
 		print(SHORTUSAGE)
 		sys.exit(2)
-	if not 1 <= len(args) <= 4:
+	if not 1 <= len(args) <= 4 or ('--serve' in dict(opts) and len(args) > (
+			2 if '--simple' in dict(opts) else 1)):
 		print('error: incorrect number of arguments', file=sys.stderr)
 		print(SHORTUSAGE)
 		sys.exit(2)
@@ -1066,7 +1632,7 @@ def main():
 		prm = DictObj(stages=stages, verbosity=int(opts.get('--verbosity', 2)),
 				transformations=None, binarization=None, postagging=None,
 				relationalrealizational=None)
-		parser = Parser(prm)
+		parser = Parser(prm, profile='--profile' in opts)
 		morph = None
 		del args[:2]
 	else:
@@ -1076,18 +1642,35 @@ def main():
 		params = readparam(os.path.join(directory, 'params.prm'))
 		params.update(resultdir=directory)
 		readgrammars(directory, params.stages, params.postagging,
-				params.transformations, top=getattr(params, 'top', top))
+				params.transformations, top=getattr(params, 'top', top),
+				cache='--cache' in opts)
 		params.update(verbosity=int(opts.get('--verbosity', params.verbosity)))
-		parser = Parser(params)
+		parser = Parser(params, profile='--profile' in opts)
 		morph = params.morphology
 		del args[:1]
+	if '--serve' in opts:
+		numproc = opts.get('--numproc')
+		serve(parser, opts['--serve'], prob, tags, numparses,
+				int(numproc) if numproc else None,
+				opts.get('--fmt', 'discbracket'), morph, sentid,
+				verbosity=parser.verbosity, share='--share' in opts)
+		return
+	profile = None
+	if opts.get('--profile'):
+		profile = io.open(opts['--profile'], 'w', encoding='utf8')
 	with openread(args[0] if len(args) >= 1 else '-') as infile:
 		with io.open(args[1] if len(args) == 2 and args[1] != '-'
 				else sys.stdout.fileno(), 'w', encoding='utf8') as out:
 			doparsing(parser, infile, out, prob, oneline, tags, numparses,
 					int(opts.get('--numproc', 1)),
-					opts.get('--fmt', 'discbracket'), morph, sentid)
+					opts.get('--fmt', 'discbracket'), morph, sentid,
+					chunksize=int(opts.get('--chunksize', 1)),
+					threads='--threads' in opts, profile=profile,
+					share='--share' in opts)
+	if profile is not None:
+		profile.close()
 
 
 __all__ = ['DictObj', 'Parser', 'doparsing', 'initworker', 'probstr',
-		'readgrammars', 'readinputbitparstyle', 'readparam']
+		'readgrammars', 'readinputbitparstyle', 'readparam', 'serve',
+		'sharegrammars', 'ServerStats', 'ServerHandler', 'ParserServer']
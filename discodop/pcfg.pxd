@@ -8,13 +8,14 @@ from .containers cimport (Chart, Grammar, ProbRule, LexicalRule,
 		Edge, RankedEdge, Idx, Prob, Label, ItemNo,
 		cellidx, cellstart, cellend,
 		sparse_hash_map, sparse_hash_set, Agenda, Whitelist,
-		SmallChartItem, FatChartItem, CFGtoSmallChartItem, CFGtoFatChartItem)
+		SmallChartItem, FatChartItem, CFGtoSmallChartItem, CFGtoFatChartItem,
+		exceedsbudget, walldeadline, cfgwhitelisted, walltime)
 
 cdef extern from "<cmath>" namespace "std" nogil:
 	bint isfinite(double v)
 	bint isinf(double v)
 
-cdef extern from "macros.h":
+cdef extern from "macros.h" nogil:
 	uint64_t TESTBIT(uint64_t a[], int b)
 
 
@@ -56,21 +57,23 @@ cdef class CFGChart(Chart):
 
 @cython.final
 cdef class DenseCFGChart(CFGChart):
-	cdef void addedge(self, uint64_t item, Idx mid, ProbRule *rule)
-	cdef bint updateprob(self, uint64_t item, Prob prob, Prob beam)
-	cdef Label _label(self, uint64_t item)
-	cdef Prob _subtreeprob(self, uint64_t item)
-	cdef bint _hasitem(self, uint64_t item)
+	cdef void addedge(self, uint64_t item, Idx mid, ProbRule *rule) nogil
+	cdef bint updateprob(self, uint64_t item, Prob prob, Prob beam) nogil
+	cdef bint _updateprob(self, uint64_t item, Prob prob, Prob beam,
+			vector[uint64_t]& items) nogil
+	cdef Label _label(self, uint64_t item) nogil
+	cdef Prob _subtreeprob(self, uint64_t item) nogil
+	cdef bint _hasitem(self, uint64_t item) nogil
 
 
 @cython.final
 cdef class SparseCFGChart(CFGChart):
 	cdef sparse_hash_map[uint64_t, ItemNo] itemindex
-	cdef void addedge(self, uint64_t item, Idx mid, ProbRule *rule)
-	cdef bint updateprob(self, uint64_t item, Prob prob, Prob beam)
-	cdef Label _label(self, uint64_t item)
-	cdef Prob _subtreeprob(self, uint64_t item)
-	cdef bint _hasitem(self, uint64_t item)
+	cdef void addedge(self, uint64_t item, Idx mid, ProbRule *rule) nogil
+	cdef bint updateprob(self, uint64_t item, Prob prob, Prob beam) nogil
+	cdef Label _label(self, uint64_t item) nogil
+	cdef Prob _subtreeprob(self, uint64_t item) nogil
+	cdef bint _hasitem(self, uint64_t item) nogil
 
 
 # @cython.final
@@ -12,11 +12,12 @@ from .util import which
 
 cimport cython
 from cython.operator cimport postincrement, dereference
+from cython.parallel cimport prange, threadid
 from libc.math cimport HUGE_VAL as INFINITY
 include "constants.pxi"
 
 
-cdef inline uint64_t cellstruct(Idx start, Idx end):
+cdef inline uint64_t cellstruct(Idx start, Idx end) nogil:
 	cdef CFGItem result
 	result.st.start = start
 	result.st.end = end
@@ -51,6 +52,7 @@ cdef class DenseCFGChart(CFGChart):
 	non-terminal labels (and to a lesser extent the sentence length)."""
 	def __init__(self, Grammar grammar, list sent,
 			start=None, logprob=True, viterbi=True):
+		cdef size_t n, entries
 		self.grammar = grammar
 		self.sent = sent
 		self.lensent = len(sent)
@@ -59,6 +61,12 @@ cdef class DenseCFGChart(CFGChart):
 		self.viterbi = viterbi
 		entries = cellidx(self.lensent - 1, self.lensent,
 				self.lensent, grammar.nonterminals) + grammar.nonterminals
+		# when the chart is reused, clear edges but keep their memory
+		for n in range(min(entries, self.parseforest.size())):
+			self.parseforest[n].clear()
+		self.items.clear()
+		self.probs.clear()
+		self.beambuckets.clear()
 		self.items.reserve(entries)
 		self.items.push_back(0)
 		# NB: resize not reserve; will not resize again.
@@ -84,17 +92,25 @@ cdef class DenseCFGChart(CFGChart):
 				bestitem = cell + label
 		return bestitem
 
-	cdef void addedge(self, uint64_t item, Idx mid, ProbRule *rule):
+	cdef void addedge(self, uint64_t item, Idx mid, ProbRule *rule) nogil:
 		"""Add new edge to parse forest."""
 		cdef Edge edge
 		edge.rule = rule
 		edge.pos.lvec = mid
 		self.parseforest[item].push_back(edge)
 
-	cdef bint updateprob(self, uint64_t item, Prob prob, Prob beam):
+	cdef bint updateprob(self, uint64_t item, Prob prob, Prob beam) nogil:
 		"""Update probability for item if better than current one.
 
 		Add item if not seen before; return False if pruned."""
+		return self._updateprob(item, prob, beam, self.items)
+
+	cdef bint _updateprob(self, uint64_t item, Prob prob, Prob beam,
+			vector[uint64_t]& items) nogil:
+		"""Variant of updateprob that appends new items to ``items``.
+
+		Since the probabilities, edges and beams are stored per item or cell,
+		cells can be filled concurrently when each has its own ``items``."""
 		cdef uint64_t beamitem, itemx
 		cdef bint newitem = self.probs[item] == INFINITY
 		if beam:
@@ -111,7 +127,7 @@ cdef class DenseCFGChart(CFGChart):
 			self.probs[item] = prob
 		# can infer order of binary rules, but need to track unaries explicitly
 		if newitem:
-			self.items.push_back(item)
+			items.push_back(item)
 		return True
 
 	cdef ItemNo _left(self, ItemNo itemidx, Edge edge):
@@ -134,14 +150,14 @@ cdef class DenseCFGChart(CFGChart):
 		return cellidx(edge.pos.mid, end, self.lensent,
 				self.grammar.nonterminals) + edge.rule.rhs2
 
-	cdef Label _label(self, uint64_t item):
+	cdef Label _label(self, uint64_t item) nogil:
 		return item % self.grammar.nonterminals
 
 	cdef Label label(self, ItemNo itemidx):
 		cdef uint64_t item = itemidx
 		return item % self.grammar.nonterminals
 
-	cdef Prob _subtreeprob(self, uint64_t item):
+	cdef Prob _subtreeprob(self, uint64_t item) nogil:
 		"""Get viterbi / inside probability of a subtree headed by `item`."""
 		return self.probs[item]
 
@@ -149,7 +165,7 @@ cdef class DenseCFGChart(CFGChart):
 		cdef uint64_t item = itemidx
 		return self.probs[item]
 
-	cdef bint _hasitem(self, uint64_t item):
+	cdef bint _hasitem(self, uint64_t item) nogil:
 		"""Test if item is in chart."""
 		return self.probs[item] != INFINITY
 		# return self.parseforest[item].size() != 0
@@ -199,8 +215,9 @@ cdef class DenseCFGChart(CFGChart):
 		item = cellidx(left, right, self.lensent,
 				self.grammar.nonterminals) + labelid
 		if whitelist is not None:
-			return whitelist.cfg[cellidx(left, right, self.lensent, 1)
-					].count(whitelist.mapping[labelid]) != 0 and item
+			return cfgwhitelisted(whitelist,
+					cellidx(left, right, self.lensent, 1),
+					whitelist.mapping[labelid]) and item
 		return self.parseforest[item].size() != 0 and item
 
 	cdef SmallChartItem asSmallChartItem(self, ItemNo itemidx):
@@ -239,6 +256,11 @@ cdef class SparseCFGChart(CFGChart):
 		self.start = grammar.toid[grammar.start if start is None else start]
 		self.logprob = logprob
 		self.viterbi = viterbi
+		self.items.clear()
+		self.itemindex.clear()
+		self.parseforest.clear()
+		self.probs.clear()
+		self.beambuckets.clear()
 		if itemsestimate is not None:
 			self.items.reserve(itemsestimate)
 			self.itemindex.reserve(itemsestimate)
@@ -269,7 +291,7 @@ cdef class SparseCFGChart(CFGChart):
 				bestitem = self.itemindex[cell + label]
 		return bestitem
 
-	cdef void addedge(self, uint64_t item, Idx mid, ProbRule *rule):
+	cdef void addedge(self, uint64_t item, Idx mid, ProbRule *rule) nogil:
 		"""Add new edge to parse forest."""
 		cdef ItemNo itemidx = self.itemindex[item]
 		cdef Edge edge
@@ -278,7 +300,7 @@ cdef class SparseCFGChart(CFGChart):
 		edge.pos.mid = mid
 		self.parseforest[itemidx].push_back(edge)
 
-	cdef bint updateprob(self, uint64_t item, Prob prob, Prob beam):
+	cdef bint updateprob(self, uint64_t item, Prob prob, Prob beam) nogil:
 		"""Update probability for item if better than current one.
 
 		Add item if not seen before; return False if pruned."""
@@ -324,7 +346,7 @@ cdef class SparseCFGChart(CFGChart):
 		return self.itemindex[cellstruct(
 				edge.pos.mid, item.st.end) + edge.rule.rhs2]
 
-	cdef Label _label(self, uint64_t item):
+	cdef Label _label(self, uint64_t item) nogil:
 		cdef CFGItem itemx
 		itemx.dt = item
 		return itemx.st.label
@@ -334,7 +356,7 @@ cdef class SparseCFGChart(CFGChart):
 		item.dt = self.items[itemidx]
 		return item.st.label
 
-	cdef Prob _subtreeprob(self, uint64_t item):
+	cdef Prob _subtreeprob(self, uint64_t item) nogil:
 		"""Get viterbi / inside probability of a subtree headed by `item`."""
 		it = self.itemindex.find(item)
 		if it == self.itemindex.end():
@@ -344,7 +366,7 @@ cdef class SparseCFGChart(CFGChart):
 	cdef Prob subtreeprob(self, ItemNo itemidx):
 		return self.probs[itemidx]
 
-	cdef bint _hasitem(self, uint64_t item):
+	cdef bint _hasitem(self, uint64_t item) nogil:
 		"""Test if item is in chart."""
 		return self.itemindex.find(item) != self.itemindex.end()
 
@@ -373,8 +395,9 @@ cdef class SparseCFGChart(CFGChart):
 		cdef short right = max(indices) + 1
 		item = cellstruct(left, right) + labelid
 		if whitelist is not None:
-			return whitelist.cfg[cellidx(left, right, self.lensent, 1)
-					].count(whitelist.mapping[labelid]) != 0 and item
+			return cfgwhitelisted(whitelist,
+					cellidx(left, right, self.lensent, 1),
+					whitelist.mapping[labelid]) and item
 		return self.itemindex.find(item) != self.itemindex.end() and item
 
 	cdef SmallChartItem asSmallChartItem(self, ItemNo itemidx):
@@ -396,7 +419,8 @@ cdef class SparseCFGChart(CFGChart):
 
 def parse(sent, Grammar grammar, tags=None, start=None, whitelist=None,
 		Prob beam_beta=0.0, int beam_delta=50, itemsestimate=None,
-		postagging=None):
+		postagging=None, chart=None, int numthreads=1, size_t itemlimit=0,
+		double deadline=0):
 	"""PCFG parsing using CKY.
 
 	:param sent: A sequence of tokens that will be parsed.
@@ -418,42 +442,65 @@ def parse(sent, Grammar grammar, tags=None, start=None, whitelist=None,
 		Should be a negative log probability. Pass ``0.0`` to disable.
 	:param beam_delta: the maximum span length to which beam search is applied.
 	:param itemsestimate: the number of chart items to pre-allocate.
+	:param chart: optionally, a chart from an earlier call that is no longer
+		used; if it is of the required type, its memory will be reused.
+	:param numthreads: the number of threads with which the cells of each
+		span length are filled in parallel; only applies without whitelist,
+		when a dense chart is used.
+	:param itemlimit: if nonzero, stop parsing when the chart contains
+		(approximately) this many items.
+	:param deadline: if nonzero, stop parsing when ``time.perf_counter()``
+		exceeds this value.
 	"""
 	if grammar.maxfanout != 1:
 		raise ValueError('Not a PCFG! fanout: %d' % grammar.maxfanout)
 	if not grammar.logprob:
 		raise ValueError('Expected grammar with log probabilities.')
+	deadline = walldeadline(deadline)
 	if whitelist is None and grammar.nonterminals < 20000:
-		chart = DenseCFGChart(grammar, sent, start)
+		if isinstance(chart, DenseCFGChart):
+			chart.reinit(grammar, sent, start)
+		else:
+			chart = DenseCFGChart(grammar, sent, start)
 		return parse_grammarloop[DenseCFGChart](
 				sent, <DenseCFGChart>chart, tags, beam_beta, beam_delta,
-				postagging)
-	chart = SparseCFGChart(grammar, sent, start, itemsestimate=itemsestimate)
+				postagging, numthreads, itemlimit, deadline)
+	if isinstance(chart, SparseCFGChart):
+		chart.reinit(grammar, sent, start, itemsestimate=itemsestimate)
+	else:
+		chart = SparseCFGChart(
+				grammar, sent, start, itemsestimate=itemsestimate)
 	if whitelist is None:
 		return parse_grammarloop[SparseCFGChart](
 				sent, <SparseCFGChart>chart, tags, beam_beta, beam_delta,
-				postagging)
-	return parse_leftchildloop(
-			sent, chart, tags, whitelist, beam_beta, beam_delta, postagging)
+				postagging, 1, itemlimit, deadline)
+	return parse_leftchildloop(sent, chart, tags, whitelist, beam_beta,
+			beam_delta, postagging, itemlimit, deadline)
 
 
 cdef parse_grammarloop(sent, CFGChart_fused chart, tags,
-		Prob beam_beta, int beam_delta, postagging):
-	"""A CKY parser modeled after Bodenstab's 'fast grammar loop'."""
+		Prob beam_beta, int beam_delta, postagging, int numthreads,
+		size_t itemlimit, double deadline):
+	"""A CKY parser modeled after Bodenstab's 'fast grammar loop'.
+
+	With a dense chart and ``numthreads > 1``, the cells of each span length
+	are filled in parallel; their new items are collected per cell and
+	appended to the chart in order, so that the result is the same."""
 	cdef:
 		Grammar grammar = chart.grammar
 		Agenda[Label, Prob] unaryagenda
+		vector[Agenda[Label, Prob]] unaryagendas
+		vector[vector[uint64_t]] cellitems
+		vector[uint64_t] cellblocked
+		vector[double] celltimes  # time of binary and unary rules per cell
 		MidFilter midfilter
-		ProbRule *rule
-		short left, right, mid, span, lensent = len(sent)
-		short narrowl, narrowr, widel, wider, minmid, maxmid
-		Prob prevprob, prob
-		Label lhs = 0
+		short left, span, lensent = len(sent)
+		Prob beam
+		double begin, times[2]
 		uint32_t n
-		uint64_t item, leftitem, rightitem, cell, blocked = 0, pruned = 0
-		ItemNo lastidx
+		uint64_t blocked = 0, pruned = 0
 		size_t nts = grammar.nonterminals
-		bint usemask = grammar.mask.size() != 0
+		bint stopped = False
 	# Create matrices to track minima and maxima for binary splits.
 	n = (lensent + 1) * nts + 1
 	midfilter.minleft.resize(n, -1)
@@ -466,75 +513,149 @@ cdef parse_grammarloop(sent, CFGChart_fused chart, tags,
 				cellidx(lensent - 1, lensent, lensent, 1) + 1,
 				INFINITY)
 	# assign POS tags
+	begin = walltime()
 	covered, msg = populatepos[CFGChart_fused](chart, sent, tags,
 			unaryagenda, None, &blocked, &midfilter, NULL, postagging)
+	chart.postime += walltime() - begin
 	if not covered:
 		return chart, msg
 
-	for span in range(2, lensent + 1):
-		# constituents from left to right
-		for left in range(lensent - span + 1):
-			right = left + span
-			if CFGChart_fused is DenseCFGChart:
-				cell = cellidx(left, right, lensent, nts)
-			elif CFGChart_fused is SparseCFGChart:
-				cell = cellstruct(left, right)
-			lastidx = chart.items.size()
-			# apply all binary rules
-			for lhs in range(1, grammar.nonterminals):
-				n = 0
-				rule = &(grammar.bylhs[lhs][n])
-				item = lhs + cell
-				prevprob = chart._subtreeprob(item)
-				while rule.lhs == lhs:
-					narrowr = midfilter.minright[left * nts + rule.rhs1]
-					narrowl = midfilter.minleft[right * nts + rule.rhs2]
-					if (rule.rhs2 == 0 or narrowr >= right or narrowl < narrowr
-							or (usemask and TESTBIT(
-								&(grammar.mask[0]), rule.no))):
-						n += 1
-						rule = &(grammar.bylhs[lhs][n])
-						continue
-					widel = midfilter.maxleft[right * nts + rule.rhs2]
-					minmid = narrowr if narrowr > widel else widel
-					wider = midfilter.maxright[left * nts + rule.rhs1]
-					maxmid = wider if wider < narrowl else narrowl
-					for mid in range(minmid, maxmid + 1):
-						if CFGChart_fused is DenseCFGChart:
-							leftitem = rule.rhs1 + cellidx(left, mid,
-									lensent, nts)
-							rightitem = rule.rhs2 + cellidx(mid, right,
-									lensent, nts)
-						elif CFGChart_fused is SparseCFGChart:
-							leftitem = rule.rhs1 + cellstruct(left, mid)
-							rightitem = rule.rhs2 + cellstruct(mid, right)
-						prob = chart._subtreeprob(leftitem)
-						if isinf(prob):
-							continue
-						prob += chart._subtreeprob(rightitem)
-						if isfinite(prob):
-							if chart.updateprob(item, prob + rule.prob,
-									beam_beta if span <= beam_delta else 0.0):
-								chart.addedge(item, mid, rule)
-							else:
-								blocked += 1
-					n += 1
-					rule = &(grammar.bylhs[lhs][n])
-
-				if isinf(prevprob) and isfinite(chart._subtreeprob(item)):
-					updatemidfilter(midfilter, left, right, lhs, nts)
-
-			applyunaryrules[CFGChart_fused](chart, left, right, cell, lastidx,
-					unaryagenda, &midfilter, &blocked, None)
-
-	msg = '%s%s, blocked %s%s' % (
+	times[0] = times[1] = 0
+	if CFGChart_fused is DenseCFGChart and numthreads > 1:
+		unaryagendas.resize(numthreads)
+		cellitems.resize(lensent)
+		cellblocked.resize(lensent)
+		celltimes.resize(2 * lensent)
+	with nogil:
+		for span in range(2, lensent + 1):
+			beam = beam_beta if span <= beam_delta else 0.0
+			if CFGChart_fused is DenseCFGChart and numthreads > 1:
+				if (itemlimit or deadline) and exceedsbudget(
+						chart.items.size() - 1, itemlimit, deadline):
+					stopped = True
+					break
+				# the cells of a span only read items of shorter spans,
+				# and only write to their own items and midfilter entries.
+				for left in prange(lensent - span + 1,
+						num_threads=numthreads, schedule='dynamic'):
+					cellitems[left].clear()
+					cellblocked[left] = 0
+					celltimes[2 * left] = celltimes[2 * left + 1] = 0
+					processcell[CFGChart_fused](chart, grammar, left,
+							left + span, cellitems[left],
+							unaryagendas[threadid()], midfilter,
+							&(cellblocked[left]), beam, &(celltimes[2 * left]))
+				for left in range(lensent - span + 1):
+					chart.items.insert(chart.items.end(),
+							cellitems[left].begin(), cellitems[left].end())
+					blocked += cellblocked[left]
+					times[0] += celltimes[2 * left]
+					times[1] += celltimes[2 * left + 1]
+			else:
+				# constituents from left to right
+				for left in range(lensent - span + 1):
+					if (itemlimit or deadline) and exceedsbudget(
+							chart.items.size() - 1, itemlimit, deadline):
+						stopped = True
+						break
+					processcell[CFGChart_fused](chart, grammar, left,
+							left + span, chart.items, unaryagenda,
+							midfilter, &blocked, beam, times)
+				if stopped:
+					break
+	chart.binarytime += times[0]
+	chart.unarytime += times[1]
+
+	msg = '%s%s, blocked %s%s%s' % (
 			'' if chart else 'no parse; ', chart.stats(), blocked,
-			', pruned %s' % pruned if beam_beta else '')
+			', pruned %s' % pruned if beam_beta else '',
+			', stopped early' if stopped else '')
 	return chart, msg
 
 
+cdef inline void processcell(CFGChart_fused chart, Grammar grammar,
+		short left, short right, vector[uint64_t]& items,
+		Agenda[Label, Prob]& unaryagenda, MidFilter& midfilter,
+		uint64_t *blocked, Prob beam, double *times) nogil:
+	"""Apply all binary and unary rules in a given cell.
+
+	:param items: the vector to which new items are added; for a sparse
+		chart, this must be ``chart.items``.
+	:param times: the time spent on binary and unary rules is added to
+		``times[0]`` and ``times[1]``, respectively."""
+	cdef:
+		ProbRule *rule
+		short mid, narrowl, narrowr, widel, wider, minmid, maxmid
+		short lensent = chart.lensent
+		Prob prevprob, prob
+		Label lhs
+		uint32_t n
+		uint64_t item, leftitem, rightitem, cell
+		ItemNo lastidx = items.size()
+		size_t nts = grammar.nonterminals
+		bint usemask = grammar.mask.size() != 0
+		double begin = walltime(), end
+	if CFGChart_fused is DenseCFGChart:
+		cell = cellidx(left, right, lensent, nts)
+	elif CFGChart_fused is SparseCFGChart:
+		cell = cellstruct(left, right)
+	# apply all binary rules
+	for lhs in range(1, grammar.nonterminals):
+		n = 0
+		rule = &(grammar.bylhs[lhs][n])
+		item = lhs + cell
+		prevprob = chart._subtreeprob(item)
+		while rule.lhs == lhs:
+			narrowr = midfilter.minright[left * nts + rule.rhs1]
+			narrowl = midfilter.minleft[right * nts + rule.rhs2]
+			if (rule.rhs2 == 0 or narrowr >= right or narrowl < narrowr
+					or (usemask and TESTBIT(&(grammar.mask[0]), rule.no))):
+				n += 1
+				rule = &(grammar.bylhs[lhs][n])
+				continue
+			widel = midfilter.maxleft[right * nts + rule.rhs2]
+			minmid = narrowr if narrowr > widel else widel
+			wider = midfilter.maxright[left * nts + rule.rhs1]
+			maxmid = wider if wider < narrowl else narrowl
+			for mid in range(minmid, maxmid + 1):
+				if CFGChart_fused is DenseCFGChart:
+					leftitem = rule.rhs1 + cellidx(left, mid, lensent, nts)
+					rightitem = rule.rhs2 + cellidx(mid, right, lensent, nts)
+				elif CFGChart_fused is SparseCFGChart:
+					leftitem = rule.rhs1 + cellstruct(left, mid)
+					rightitem = rule.rhs2 + cellstruct(mid, right)
+				prob = chart._subtreeprob(leftitem)
+				if isinf(prob):
+					continue
+				prob += chart._subtreeprob(rightitem)
+				if isfinite(prob):
+					if CFGChart_fused is DenseCFGChart:
+						if chart._updateprob(item, prob + rule.prob, beam,
+								items):
+							chart.addedge(item, mid, rule)
+						else:
+							blocked[0] += 1
+					elif CFGChart_fused is SparseCFGChart:
+						if chart.updateprob(item, prob + rule.prob, beam):
+							chart.addedge(item, mid, rule)
+						else:
+							blocked[0] += 1
+			n += 1
+			rule = &(grammar.bylhs[lhs][n])
+
+		if isinf(prevprob) and isfinite(chart._subtreeprob(item)):
+			updatemidfilter(midfilter, left, right, lhs, nts)
+
+	end = walltime()
+	times[0] += end - begin
+	applyunaryrules[CFGChart_fused](chart, left, right, cell, items, lastidx,
+			unaryagenda, &midfilter, blocked, None)
+	times[1] += walltime() - end
+
+
 cdef parse_leftchildloop(sent, SparseCFGChart chart, tags,
-		Whitelist whitelist, Prob beam_beta, int beam_delta, postagging):
+		Whitelist whitelist, Prob beam_beta, int beam_delta, postagging,
+		size_t itemlimit, double deadline):
 	"""A CKY parser that iterates over items in chart and compatible rules."""
 	cdef:
 		Grammar grammar = chart.grammar
@@ -549,65 +670,85 @@ cdef parse_leftchildloop(sent, SparseCFGChart chart, tags,
 		uint32_t n
 		short left, right, mid, span, lensent = len(sent)
 		CFGItem li
-		bint usemask = grammar.mask.size() != 0
+		bint usemask = grammar.mask.size() != 0, stopped = False
+		double begin, end
 	cellindex.resize(cellidx(lensent - 1, lensent, lensent, 1) + 2, 0)
 	if beam_beta:
 		chart.beambuckets.resize(
 				cellidx(lensent - 1, lensent, lensent, 1) + 1, INFINITY)
 	# assign POS tags
+	begin = walltime()
 	covered, msg = populatepos(chart, sent, tags, unaryagenda, whitelist,
 			&blocked, NULL, &cellindex, postagging)
+	chart.postime += walltime() - begin
 	if not covered:
 		return chart, msg
 
-	for span in range(2, lensent + 1):
-		# constituents from left to right
-		for left in range(lensent - span + 1):
-			right = left + span
-			cell = cellstruct(left, right)
-			ccell = cellidx(left, right, lensent, 1)
-			cellindex[ccell] = lastidx = chart.items.size()
-			# apply binary rules; if whitelist is given, skip labels not in set
-			for mid in range(left + 1, right):
-				rightcell = cellstruct(mid, right)
-				leftitemidx = cellindex[cellidx(left, mid, lensent, 1)]
-				leftitem = chart.items[leftitemidx]
-				li.dt = leftitem
-				while li.st.end == mid:
-					leftprob = (<Chart>chart).subtreeprob(leftitemidx)
-					rhs1 = chart._label(leftitem)
-					n = 0
-					rule = &(grammar.lbinary[rhs1][n])
-					while rule.rhs1 == rhs1 and n < grammar.numbinary:
-						# This requires a hash table lookup of right item;
-						# might be better if items in cell are together
-						# in own datastructure
-						rightprob = chart._subtreeprob(rightcell + rule.rhs2)
-						item = cell + rule.lhs
-						if isfinite(rightprob):
-							if (usemask and TESTBIT(&(grammar.mask[0]), rule.no
-									)) or (whitelist is not None
-									and whitelist.mapping[rule.lhs]
-									and not whitelist.cfg[ccell].count(
-										whitelist.mapping[rule.lhs])):
-								blocked += 1
-							elif not chart.updateprob(
-									item, leftprob + rightprob + rule.prob,
-									beam_beta if span <= beam_delta else 0.0):
-								blocked += 1
-							else:
-								chart.addedge(item, mid, rule)
-						n += 1
-						rule = &(grammar.lbinary[rhs1][n])
-					leftitemidx += 1
+	with nogil:
+		for span in range(2, lensent + 1):
+			# constituents from left to right
+			for left in range(lensent - span + 1):
+				if (itemlimit or deadline) and exceedsbudget(
+						chart.items.size() - 1, itemlimit, deadline):
+					stopped = True
+					break
+				right = left + span
+				cell = cellstruct(left, right)
+				ccell = cellidx(left, right, lensent, 1)
+				cellindex[ccell] = lastidx = chart.items.size()
+				begin = walltime()
+				# apply binary rules; if whitelist is given,
+				# skip labels not in set
+				for mid in range(left + 1, right):
+					rightcell = cellstruct(mid, right)
+					leftitemidx = cellindex[cellidx(left, mid, lensent, 1)]
 					leftitem = chart.items[leftitemidx]
 					li.dt = leftitem
-
-			applyunaryrules(chart, left, right, cell, lastidx, unaryagenda,
-					NULL, &blocked, whitelist)
-			cellindex[ccell + 1] = chart.items.size()
-	msg = '%s%s, blocked %s' % (
-			'' if chart else 'no parse; ', chart.stats(), blocked)
+					while li.st.end == mid:
+						leftprob = chart.probs[leftitemidx]
+						rhs1 = chart._label(leftitem)
+						n = 0
+						rule = &(grammar.lbinary[rhs1][n])
+						while rule.rhs1 == rhs1 and n < grammar.numbinary:
+							# This requires a hash table lookup of right item;
+							# might be better if items in cell are together
+							# in own datastructure
+							rightprob = chart._subtreeprob(
+									rightcell + rule.rhs2)
+							item = cell + rule.lhs
+							if isfinite(rightprob):
+								if (usemask and TESTBIT(
+										&(grammar.mask[0]), rule.no)) or (
+										whitelist is not None
+										and whitelist.mapping[rule.lhs]
+										and not cfgwhitelisted(
+											whitelist, ccell,
+											whitelist.mapping[rule.lhs])):
+									blocked += 1
+								elif not chart.updateprob(
+										item, leftprob + rightprob + rule.prob,
+										beam_beta if span <= beam_delta
+										else 0.0):
+									blocked += 1
+								else:
+									chart.addedge(item, mid, rule)
+							n += 1
+							rule = &(grammar.lbinary[rhs1][n])
+						leftitemidx += 1
+						leftitem = chart.items[leftitemidx]
+						li.dt = leftitem
+
+				end = walltime()
+				chart.binarytime += end - begin
+				applyunaryrules(chart, left, right, cell, chart.items,
+						lastidx, unaryagenda, NULL, &blocked, whitelist)
+				chart.unarytime += walltime() - end
+				cellindex[ccell + 1] = chart.items.size()
+			if stopped:
+				break
+	msg = '%s%s, blocked %s%s' % (
+			'' if chart else 'no parse; ', chart.stats(), blocked,
+			', stopped early' if stopped else '')
 	return chart, msg
 
 
@@ -662,8 +803,8 @@ cdef populatepos(CFGChart_fused chart, sent, tags,
 			for n in dereference(it).second:
 				lexrule = grammar.lexical[n]
 				if (whitelist is not None and whitelist.mapping[lexrule.lhs]
-						and whitelist.cfg[ccell].count(
-							whitelist.mapping[lexrule.lhs]) == 0):
+						and not cfgwhitelisted(whitelist, ccell,
+							whitelist.mapping[lexrule.lhs])):
 					blocked[0] += 1
 					continue
 				lhs = lexrule.lhs
@@ -690,8 +831,8 @@ cdef populatepos(CFGChart_fused chart, sent, tags,
 						continue
 					if (whitelist is not None
 							and whitelist.mapping[lexrule.lhs]
-							and whitelist.cfg[ccell].count(
-								whitelist.mapping[lexrule.lhs]) == 0):
+							and not cfgwhitelisted(whitelist, ccell,
+								whitelist.mapping[lexrule.lhs])):
 						blocked[0] += 1
 						continue
 					lhs = lexrule.lhs
@@ -721,8 +862,9 @@ cdef populatepos(CFGChart_fused chart, sent, tags,
 			return False, 'no parse: all tags for word %r blocked' % word
 
 		# unary rules on the span of this POS tag
-		applyunaryrules[CFGChart_fused](chart, left, right, cell, lastidx,
-				unaryagenda, midfilter, blocked, whitelist)
+		applyunaryrules[CFGChart_fused](chart, left, right, cell,
+				chart.items, lastidx, unaryagenda, midfilter, blocked,
+				whitelist)
 	if cellindex is not NULL:
 		cellindex[0][ccell + 1] = chart.items.size()
 	return True, ''
@@ -730,25 +872,33 @@ cdef populatepos(CFGChart_fused chart, sent, tags,
 
 cdef inline void applyunaryrules(
 		CFGChart_fused chart, short left, short right, uint64_t cell,
-		ItemNo lastidx, Agenda[Label, Prob]& unaryagenda, MidFilter *midfilter,
-		uint64_t *blocked, Whitelist whitelist):
-	"""Apply unary rules in a given cell."""
+		vector[uint64_t]& items, ItemNo lastidx,
+		Agenda[Label, Prob]& unaryagenda, MidFilter *midfilter,
+		uint64_t *blocked, Whitelist whitelist) nogil:
+	"""Apply unary rules in a given cell.
+
+	:param items: the vector to which new items of this cell have been and
+		will be added, starting at ``lastidx``; see ``processcell``."""
 	cdef:
-		Grammar grammar = chart.grammar
 		Label lhs, rhs1
 		Prob prob
 		ProbRule *rule
 		uint64_t item, leftitem
+		size_t itemidx, n
+		bint updated
 		uint64_t ccell = cellidx(left, right, chart.lensent, 1)
-		size_t nts = grammar.nonterminals
-		bint usemask = grammar.mask.size() != 0
+		size_t nts = chart.grammar.nonterminals
+		bint usemask = chart.grammar.mask.size() != 0
 		# pair[Label, Prob] unaryentry
 		# vector[pair[Label, Prob]] unaryentries
 	# collect possible rhs items for unaries
-	for itemidx in range(lastidx, chart.items.size()):
-		item = chart.items[itemidx]
-		unaryagenda.setifbetter(
-				chart._label(item), (<Chart>chart).subtreeprob(itemidx))
+	for itemidx in range(lastidx, items.size()):
+		item = items[itemidx]
+		if CFGChart_fused is DenseCFGChart:
+			prob = chart.probs[item]
+		elif CFGChart_fused is SparseCFGChart:
+			prob = chart.probs[itemidx]
+		unaryagenda.setifbetter(chart._label(item), prob)
 	# 	unaryentry.first = chart._label(item)
 	# 	unaryentry.second = chart._subtreeprob(item)
 	# 	unaryentries.push_back(unaryentry)
@@ -763,23 +913,29 @@ cdef inline void applyunaryrules(
 		# FIXME: chart.updateprob here
 		# FIXME: maybe better to iterate over whitelist and check for
 		# unary prod. Or: compute intersection before loop;
-		for n in range(grammar.numunary):
-			rule = &(grammar.unary[rhs1][n])
+		for n in range(chart.grammar.numunary):
+			rule = &(chart.grammar.unary[rhs1][n])
 			lhs = rule.lhs
 			if rule.rhs1 != rhs1:
 				break
-			elif (usemask and TESTBIT(&(grammar.mask[0]), rule.no)) or (
+			elif (usemask and TESTBIT(
+					&(chart.grammar.mask[0]), rule.no)) or (
 					whitelist is not None
 					and whitelist.mapping[lhs]
-					and whitelist.cfg[ccell].count(
-						whitelist.mapping[lhs]) == 0):
+					and not cfgwhitelisted(whitelist, ccell,
+						whitelist.mapping[lhs])):
 				continue
 			item = cell + lhs
 			if rule.prob + prob < chart._subtreeprob(item):
-				if chart.updateprob(item, rule.prob + prob, 0.0):
+				if CFGChart_fused is DenseCFGChart:
+					updated = chart._updateprob(
+							item, rule.prob + prob, 0.0, items)
+				elif CFGChart_fused is SparseCFGChart:
+					updated = chart.updateprob(item, rule.prob + prob, 0.0)
+				if updated:
 					unaryagenda.setifbetter(lhs, rule.prob + prob)
 				else:
-					blocked += 1
+					blocked[0] += 1
 			chart.addedge(item, right, rule)
 			if midfilter is not NULL:
 				updatemidfilter(midfilter[0], left, right, lhs, nts)
@@ -787,7 +943,7 @@ cdef inline void applyunaryrules(
 
 cdef inline void updatemidfilter(
 		MidFilter& midfilter, short left, short right, Label lhs,
-		size_t nts):
+		size_t nts) nogil:
 	"""Update mid point filter arrays."""
 	if left > midfilter.minleft[right * nts + lhs]:
 		midfilter.minleft[right * nts + lhs] = left
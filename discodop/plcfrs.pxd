@@ -7,11 +7,12 @@ from cpython.set cimport PySet_Contains
 from .containers cimport (Chart, Grammar, Prob, Label, ItemNo,
 		ProbRule, LexicalRule, SmallChartItem, FatChartItem, Edge,
 		Whitelist, Agenda, SmallChartItemBtreeMap, FatChartItemBtreeMap,
-		BITSIZE, CFGtoSmallChartItem, CFGtoFatChartItem, cellidx)
+		BITSIZE, CFGtoSmallChartItem, CFGtoFatChartItem, cellidx,
+		exceedsbudget, walldeadline, smallwhitelisted, walltime)
 from .bit cimport (nextset, nextunset, bitcount, bitlength,
 	testbit, anextset, anextunset, abitcount, abitlength, setunion)
 
-cdef extern from "macros.h":
+cdef extern from "macros.h" nogil:
 	int BITSLOT(int b)
 	uint64_t BITMASK(int b)
 	int BITNSLOTS(int nb)
@@ -27,10 +28,10 @@ ctypedef fused LCFRSItem_fused:
 	FatChartItem
 
 cdef class LCFRSChart(Chart):
-	cdef void addlexedge(self, ItemNo itemidx, short wordidx)
-	cdef void updateprob(self, ItemNo itemidx, Prob prob)
-	cdef void addprob(self, ItemNo itemidx, Prob prob)
-	cdef Prob _subtreeprob(self, ItemNo itemidx)
+	cdef void addlexedge(self, ItemNo itemidx, short wordidx) nogil
+	cdef void updateprob(self, ItemNo itemidx, Prob prob) nogil
+	cdef void addprob(self, ItemNo itemidx, Prob prob) nogil
+	cdef Prob _subtreeprob(self, ItemNo itemidx) nogil
 
 
 @cython.final
@@ -39,9 +40,9 @@ cdef class SmallLCFRSChart(LCFRSChart):
 	cdef SmallChartItemBtreeMap[ItemNo] itemindex
 	cdef SmallChartItemBtreeMap[Prob] beambuckets
 	cdef SmallChartItem _root(self)
-	cdef Label _label(self, ItemNo itemidx)
+	cdef Label _label(self, ItemNo itemidx) nogil
 	cdef void addedge(self, ItemNo itemidx, ItemNo leftitemidx,
-			SmallChartItem& left, ProbRule *rule)
+			SmallChartItem& left, ProbRule *rule) nogil
 
 
 @cython.final
@@ -50,6 +51,6 @@ cdef class FatLCFRSChart(LCFRSChart):
 	cdef FatChartItemBtreeMap[ItemNo] itemindex
 	cdef FatChartItemBtreeMap[Prob] beambuckets
 	cdef FatChartItem _root(self)
-	cdef Label _label(self, ItemNo itemidx)
+	cdef Label _label(self, ItemNo itemidx) nogil
 	cdef void addedge(self, ItemNo itemidx, ItemNo leftitemidx,
-			FatChartItem& left, ProbRule *rule)
+			FatChartItem& left, ProbRule *rule) nogil
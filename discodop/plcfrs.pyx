@@ -28,21 +28,21 @@ cdef class LCFRSChart(Chart):
 		self.logprob = logprob
 		self.viterbi = viterbi
 
-	cdef void addlexedge(self, ItemNo itemidx, short wordidx):
+	cdef void addlexedge(self, ItemNo itemidx, short wordidx) nogil:
 		"""Add lexical edge."""
 		cdef Edge edge
 		edge.rule = NULL
 		edge.pos.mid = wordidx + 1
 		self.parseforest[itemidx].push_back(edge)
 
-	cdef void updateprob(self, ItemNo itemidx, Prob prob):
+	cdef void updateprob(self, ItemNo itemidx, Prob prob) nogil:
 		if prob < self.probs[itemidx]:
 			self.probs[itemidx] = prob
 
-	cdef void addprob(self, ItemNo itemidx, Prob prob):
+	cdef void addprob(self, ItemNo itemidx, Prob prob) nogil:
 		self.probs[itemidx] += prob
 
-	cdef Prob _subtreeprob(self, ItemNo itemidx):
+	cdef Prob _subtreeprob(self, ItemNo itemidx) nogil:
 		return self.probs[itemidx]
 
 	cdef Prob subtreeprob(self, ItemNo itemidx):
@@ -60,6 +60,11 @@ cdef class SmallLCFRSChart(LCFRSChart):
 			itemsestimate=None):
 		cdef SmallChartItem tmp = SmallChartItem(0, 0)
 		super().__init__(grammar, sent, start, logprob, viterbi)
+		self.items.clear()
+		self.itemindex.clear()
+		self.parseforest.clear()
+		self.probs.clear()
+		self.beambuckets.clear()
 		if itemsestimate is not None:
 			self.items.reserve(itemsestimate)
 			# NB: self.itemindex does not support reserve
@@ -71,7 +76,7 @@ cdef class SmallLCFRSChart(LCFRSChart):
 		self.probs.push_back(INFINITY)
 
 	cdef void addedge(self, ItemNo itemidx, ItemNo leftitemidx,
-			SmallChartItem& left, ProbRule *rule):
+			SmallChartItem& left, ProbRule *rule) nogil:
 		"""Add new edge."""
 		cdef Edge edge
 		edge.rule = rule
@@ -123,7 +128,7 @@ cdef class SmallLCFRSChart(LCFRSChart):
 	cdef Label label(self, ItemNo itemidx):
 		return self.items[itemidx].label
 
-	cdef Label _label(self, ItemNo itemidx):
+	cdef Label _label(self, ItemNo itemidx) nogil:
 		return self.items[itemidx].label
 
 	cdef ItemNo getitemidx(self, uint64_t n):
@@ -153,7 +158,7 @@ cdef class SmallLCFRSChart(LCFRSChart):
 		if whitelist is not None:
 			tmp1.label = whitelist.mapping[labelid]
 			tmp1.vec = tmp.vec
-			return (whitelist.small[tmp1.label].count(tmp1)
+			return (smallwhitelisted(whitelist, tmp1)
 					and self.itemindex[tmp])
 		return self.itemindex[tmp]
 
@@ -180,6 +185,11 @@ cdef class FatLCFRSChart(LCFRSChart):
 			itemsestimate=None):
 		super().__init__(grammar, sent, start, logprob, viterbi)
 		cdef FatChartItem tmp = FatChartItem(0)
+		self.items.clear()
+		self.itemindex.clear()
+		self.parseforest.clear()
+		self.probs.clear()
+		self.beambuckets.clear()
 		if itemsestimate is not None:
 			self.items.reserve(itemsestimate)
 			# NB: self.itemindex does not support reserve
@@ -190,7 +200,7 @@ cdef class FatLCFRSChart(LCFRSChart):
 		self.probs.push_back(INFINITY)
 
 	cdef void addedge(self, ItemNo itemidx, ItemNo leftitemidx,
-			FatChartItem& left, ProbRule *rule):
+			FatChartItem& left, ProbRule *rule) nogil:
 		"""Add new edge and update viterbi probability."""
 		cdef Edge edge
 		edge.rule = rule
@@ -243,7 +253,7 @@ cdef class FatLCFRSChart(LCFRSChart):
 	cdef Label label(self, ItemNo itemidx):
 		return self._label(itemidx)  # somehow needed
 
-	cdef Label _label(self, ItemNo itemidx):
+	cdef Label _label(self, ItemNo itemidx) nogil:
 		return self.items[itemidx].label
 
 	cdef ItemNo getitemidx(self, uint64_t n):
@@ -308,7 +318,7 @@ def parse(sent, Grammar grammar, tags=None, bint exhaustive=True,
 		start=None, Whitelist whitelist=None, bint splitprune=False,
 		bint markorigin=False, estimates=None,
 		Prob beam_beta=0.0, int beam_delta=50, itemsestimate=None,
-		postagging=None):
+		postagging=None, chart=None, size_t itemlimit=0, double deadline=0):
 	"""Parse sentence and produce a chart.
 
 	:param sent: A sequence of tokens that will be parsed.
@@ -340,29 +350,44 @@ def parse(sent, Grammar grammar, tags=None, bint exhaustive=True,
 		Should be a negative log probability. Pass ``0.0`` to disable.
 	:param beam_delta: the maximum span length to which beam search is applied.
 	:param itemsestimate: the number of chart items to pre-allocate.
+	:param chart: optionally, a chart from an earlier call that is no longer
+		used; if it is of the required type, its memory will be reused.
+	:param itemlimit: if nonzero, stop parsing when the chart contains
+		(approximately) this many items.
+	:param deadline: if nonzero, stop parsing when ``time.perf_counter()``
+		exceeds this value.
 	"""
+	deadline = walldeadline(deadline)
 	if <unsigned>len(sent) < sizeof(COMPONENT.vec) * 8:
-		chart = SmallLCFRSChart(grammar, list(sent), start,
-			itemsestimate=itemsestimate)
+		if isinstance(chart, SmallLCFRSChart):
+			chart.reinit(grammar, list(sent), start,
+				itemsestimate=itemsestimate)
+		else:
+			chart = SmallLCFRSChart(grammar, list(sent), start,
+				itemsestimate=itemsestimate)
 		return parse_main[SmallLCFRSChart, SmallChartItem](
 				<SmallLCFRSChart>chart,
 				<SmallChartItem>(<SmallLCFRSChart>chart)._root(),
 				sent, grammar, tags, exhaustive, whitelist,
 				splitprune, markorigin, estimates, beam_beta, beam_delta,
-				postagging)
-	chart = FatLCFRSChart(grammar, list(sent), start,
-			itemsestimate=itemsestimate)
+				postagging, itemlimit, deadline)
+	if isinstance(chart, FatLCFRSChart):
+		chart.reinit(grammar, list(sent), start, itemsestimate=itemsestimate)
+	else:
+		chart = FatLCFRSChart(grammar, list(sent), start,
+				itemsestimate=itemsestimate)
 	return parse_main[FatLCFRSChart, FatChartItem](
 			<FatLCFRSChart>chart, <FatChartItem>(<FatLCFRSChart>chart)._root(),
 			sent, grammar, tags, exhaustive, whitelist,
 			splitprune, markorigin, estimates, beam_beta, beam_delta,
-			postagging)
+			postagging, itemlimit, deadline)
 
 
 cdef parse_main(LCFRSChart_fused chart, LCFRSItem_fused goal, sent,
 		Grammar grammar, tags, bint exhaustive, Whitelist whitelist,
 		bint splitprune, bint markorigin, estimates,
-		Prob beam_beta, int beam_delta, postagging):
+		Prob beam_beta, int beam_delta, postagging, size_t itemlimit,
+		double deadline):
 	cdef:
 		Agenda[ItemNo, pair[Prob, Prob]] agenda  # prioritized items to explore
 		pair[ItemNo, pair[Prob, Prob]] entry
@@ -374,8 +399,9 @@ cdef parse_main(LCFRSChart_fused chart, LCFRSItem_fused goal, sent,
 		short lensent = len(sent), estimatetype = 0
 		int length = 1, left = 0, right = 0, gaps = 0
 		ItemNo itemidx, sibidx
-		size_t blocked = 0, maxA = 0, n
-		bint usemask = grammar.mask.size() != 0
+		size_t blocked = 0, maxA = 0, n, numpopped = 0
+		bint usemask = grammar.mask.size() != 0, stopped = False
+		double begin, end, unarytime = 0, binarytime = 0
 	# avoid generating code for spurious fused type combinations
 	if ((LCFRSItem_fused is SmallChartItem
 			and LCFRSChart_fused is FatLCFRSChart)
@@ -394,206 +420,235 @@ cdef parse_main(LCFRSChart_fused chart, LCFRSItem_fused goal, sent,
 	agenda.reserve(1024)
 
 	# assign POS tags
+	begin = walltime()
 	covered, msg = populatepos[LCFRSChart_fused, LCFRSItem_fused](
 			grammar, agenda, chart, newitem,
 			sent, tags, whitelist, estimates, postagging)
+	chart.postime += walltime() - begin
 	if not covered:
 		return chart, msg
 	assert not agenda.empty()
 
-	while not agenda.empty():  # main parsing loop
-		entry = agenda.pop()
-		itemidx = entry.first
-		prob = entry.second.second
-		item = chart.items[itemidx]
-		# store viterbi probability; cannot do this when this item is added to
-		# the agenda because that would give rise to duplicate edges.
-		chart.updateprob(itemidx, prob)
-		if item == goal:
-			if not exhaustive:
+	with nogil:
+		while not agenda.empty():  # main parsing loop
+			numpopped += 1
+			# check the budget periodically, as reading the clock has a cost
+			if ((itemlimit or deadline) and numpopped % 64 == 0
+					and exceedsbudget(
+						chart.items.size() - 1, itemlimit, deadline)):
+				stopped = True
 				break
-		else:
-			# unary
-			if LCFRSItem_fused is SmallChartItem:
-				length = bitcount(item.vec)
-				newitem.vec = item.vec
-			elif LCFRSItem_fused is FatChartItem:
-				length = abitcount(item.vec, SLOTS)
-				memcpy(<void *>newitem.vec, <void *>item.vec,
-						SLOTS * sizeof(uint64_t))
-			if estimates is not None:
+			entry = agenda.pop()
+			itemidx = entry.first
+			prob = entry.second.second
+			item = chart.items[itemidx]
+			# store viterbi probability; cannot do this when this item is added
+			# to the agenda because that would give rise to duplicate edges.
+			chart.updateprob(itemidx, prob)
+			if item == goal:
+				if not exhaustive:
+					break
+			else:
+				begin = walltime()
+				# unary
 				if LCFRSItem_fused is SmallChartItem:
-					left = nextset(item.vec, 0)
-					gaps = bitlength(item.vec) - length - left
-					right = lensent - length - left - gaps
+					length = bitcount(item.vec)
+					newitem.vec = item.vec
 				elif LCFRSItem_fused is FatChartItem:
-					left = anextset(item.vec, 0, SLOTS)
-					gaps = abitlength(item.vec, SLOTS) - length - left
-					right = lensent - length - left - gaps
-			for n in range(grammar.numunary):
-				rule = &(grammar.unary[item.label][n])
-				if rule.rhs1 != item.label:
-					break
-				elif usemask and TESTBIT(&(grammar.mask[0]), rule.no):
-					continue
-				score = newprob = prob + rule.prob
-				if estimatetype == SX:
-					score += outside[rule.lhs, left, right, 0]
-					if score > MAX_LOGPROB:
-						continue
-				elif estimatetype == SXlrgaps:
-					score += outside[
-							rule.lhs, length, left + right, gaps]
-					if score > MAX_LOGPROB:
-						continue
-				else:
-					# add length of span to score so that all items of length n
-					# have a strictly lower score than items with length n + 1.
-					score += length * MAX_LOGPROB
-				newitem.label = rule.lhs
-				if process_edge[LCFRSItem_fused, LCFRSChart_fused](
-						newitem, newprob, score, rule, itemidx, item,
-						agenda, chart, estimatetype, whitelist,
-						splitprune and grammar.fanout[rule.lhs] != 1,
-						markorigin, 0.0):
+					length = abitcount(item.vec, SLOTS)
+					memcpy(<void *>newitem.vec, <void *>item.vec,
+							SLOTS * sizeof(uint64_t))
+				if estimatetype:
 					if LCFRSItem_fused is SmallChartItem:
-						newitem.vec = item.vec
+						left = nextset(item.vec, 0)
+						gaps = bitlength(item.vec) - length - left
+						right = lensent - length - left - gaps
 					elif LCFRSItem_fused is FatChartItem:
-						memcpy(<void *>newitem.vec, <void *>item.vec,
-								SLOTS * sizeof(uint64_t))
-				else:
-					blocked += 1
-			# binary production, item from agenda is on the right
-			for n in range(grammar.numbinary):
-				rule = &(grammar.rbinary[item.label][n])
-				if rule.rhs2 != item.label:
-					break
-				# elif chart.probs[rule.rhs1] is None:
-				# 	continue
-				elif usemask and TESTBIT(&(grammar.mask[0]), rule.no):
-					continue
-				tmpitem.label = rule.rhs1
-				itemidxit = chart.itemindex.lower_bound(tmpitem)
-				sibvec.clear()
-				while (itemidxit != chart.itemindex.end()
-						and dereference(itemidxit).first.label == rule.rhs1):
-					sib = dereference(itemidxit).first
-					sibidx = dereference(itemidxit).second
-					sibvec.push_back(sibidx)
-					postincrement(itemidxit)
-				for sibidx in sibvec:
-					sib = chart.items[sibidx]
-					postincrement(itemidxit)
-					if concat[LCFRSItem_fused](rule, &sib, &item):
-						newitem.label = rule.lhs
-						combine_item[LCFRSItem_fused](&newitem, &sib, &item)
-						siblingprob = chart.probs[sibidx]
-						if siblingprob == INFINITY:
+						left = anextset(item.vec, 0, SLOTS)
+						gaps = abitlength(item.vec, SLOTS) - length - left
+						right = lensent - length - left - gaps
+				for n in range(grammar.numunary):
+					rule = &(grammar.unary[item.label][n])
+					if rule.rhs1 != item.label:
+						break
+					elif usemask and TESTBIT(&(grammar.mask[0]), rule.no):
+						continue
+					score = newprob = prob + rule.prob
+					if estimatetype == SX:
+						score += outside[rule.lhs, left, right, 0]
+						if score > MAX_LOGPROB:
 							continue
-						score = newprob = prob + siblingprob + rule.prob
-						if LCFRSItem_fused is SmallChartItem:
-							length = bitcount(newitem.vec)
-						elif LCFRSItem_fused is FatChartItem:
-							length = abitcount(newitem.vec, SLOTS)
-						if estimatetype == SX or estimatetype == SXlrgaps:
-							if LCFRSItem_fused is SmallChartItem:
-								left = nextset(newitem.vec, 0)
-							elif LCFRSItem_fused is FatChartItem:
-								left = anextset(newitem.vec, 0, SLOTS)
-						if estimatetype == SX:
-							right = lensent - length - left
-							score += outside[rule.lhs, left, right, 0]
-							if score > MAX_LOGPROB:
-								continue
-						elif estimatetype == SXlrgaps:
-							if LCFRSItem_fused is SmallChartItem:
-								gaps = bitlength(newitem.vec) - length - left
-							elif LCFRSItem_fused is FatChartItem:
-								gaps = abitlength(newitem.vec, SLOTS
-										) - length - left
-							right = lensent - length - left - gaps
-							score += outside[
-									rule.lhs, length, left + right, gaps]
-							if score > MAX_LOGPROB:
-								continue
-						else:
-							score += length * MAX_LOGPROB
-						if process_edge[LCFRSItem_fused, LCFRSChart_fused](
-								newitem, newprob, score, rule, sibidx, sib,
-								agenda, chart, estimatetype, whitelist,
-								splitprune and grammar.fanout[rule.lhs] != 1,
-								markorigin,
-								beam_beta if length <= beam_delta else 0.0):
-							pass
-						else:
-							blocked += 1
-			# binary production, item from agenda is on the left
-			for n in range(grammar.numbinary):
-				rule = &(grammar.lbinary[item.label][n])
-				if rule.rhs1 != item.label:
-					break
-				# elif chart.probs[rule.rhs2] is None:
-				# 	continue
-				elif usemask and TESTBIT(&(grammar.mask[0]), rule.no):
-					continue
-				tmpitem.label = rule.rhs2
-				itemidxit = chart.itemindex.lower_bound(tmpitem)
-				sibvec.clear()
-				while (itemidxit != chart.itemindex.end()
-						and dereference(itemidxit).first.label == rule.rhs2):
-					sib = dereference(itemidxit).first
-					sibidx = dereference(itemidxit).second
-					sibvec.push_back(sibidx)
-					postincrement(itemidxit)
-				for sibidx in sibvec:
-					sib = chart.items[sibidx]
-					if concat[LCFRSItem_fused](rule, &item, &sib):
-						newitem.label = rule.lhs
-						combine_item[LCFRSItem_fused](&newitem, &item, &sib)
-						siblingprob = chart.probs[sibidx]
-						if siblingprob == INFINITY:
+					elif estimatetype == SXlrgaps:
+						score += outside[
+								rule.lhs, length, left + right, gaps]
+						if score > MAX_LOGPROB:
 							continue
-						score = newprob = prob + siblingprob + rule.prob
+					else:
+						# add length of span to score so that all items of
+						# length n have a strictly lower score than items with
+						# length n + 1.
+						score += length * MAX_LOGPROB
+					newitem.label = rule.lhs
+					if process_edge[LCFRSItem_fused, LCFRSChart_fused](
+							newitem, newprob, score, rule, itemidx, item,
+							agenda, chart, estimatetype, whitelist,
+							splitprune and grammar.fanout[rule.lhs] != 1,
+							markorigin, 0.0):
 						if LCFRSItem_fused is SmallChartItem:
-							length = bitcount(newitem.vec)
+							newitem.vec = item.vec
 						elif LCFRSItem_fused is FatChartItem:
-							length = abitcount(newitem.vec, SLOTS)
-						if estimatetype == SX or estimatetype == SXlrgaps:
+							memcpy(<void *>newitem.vec, <void *>item.vec,
+									SLOTS * sizeof(uint64_t))
+					else:
+						blocked += 1
+				end = walltime()
+				unarytime += end - begin
+				# binary production, item from agenda is on the right
+				for n in range(grammar.numbinary):
+					rule = &(grammar.rbinary[item.label][n])
+					if rule.rhs2 != item.label:
+						break
+					# elif chart.probs[rule.rhs1] is None:
+					# 	continue
+					elif usemask and TESTBIT(&(grammar.mask[0]), rule.no):
+						continue
+					tmpitem.label = rule.rhs1
+					itemidxit = chart.itemindex.lower_bound(tmpitem)
+					sibvec.clear()
+					while (itemidxit != chart.itemindex.end()
+							and dereference(itemidxit).first.label
+								== rule.rhs1):
+						sib = dereference(itemidxit).first
+						sibidx = dereference(itemidxit).second
+						sibvec.push_back(sibidx)
+						postincrement(itemidxit)
+					for sibidx in sibvec:
+						sib = chart.items[sibidx]
+						postincrement(itemidxit)
+						if concat[LCFRSItem_fused](rule, &sib, &item):
+							newitem.label = rule.lhs
+							combine_item[LCFRSItem_fused](
+									&newitem, &sib, &item)
+							siblingprob = chart.probs[sibidx]
+							if siblingprob == INFINITY:
+								continue
+							score = newprob = prob + siblingprob + rule.prob
 							if LCFRSItem_fused is SmallChartItem:
-								left = nextset(newitem.vec, 0)
+								length = bitcount(newitem.vec)
 							elif LCFRSItem_fused is FatChartItem:
-								left = anextset(newitem.vec, 0, SLOTS)
-						if estimatetype == SX:
-							right = lensent - length - left
-							score += outside[rule.lhs, left, right, 0]
-							if score > MAX_LOGPROB:
+								length = abitcount(newitem.vec, SLOTS)
+							if estimatetype == SX or estimatetype == SXlrgaps:
+								if LCFRSItem_fused is SmallChartItem:
+									left = nextset(newitem.vec, 0)
+								elif LCFRSItem_fused is FatChartItem:
+									left = anextset(newitem.vec, 0, SLOTS)
+							if estimatetype == SX:
+								right = lensent - length - left
+								score += outside[rule.lhs, left, right, 0]
+								if score > MAX_LOGPROB:
+									continue
+							elif estimatetype == SXlrgaps:
+								if LCFRSItem_fused is SmallChartItem:
+									gaps = bitlength(
+											newitem.vec) - length - left
+								elif LCFRSItem_fused is FatChartItem:
+									gaps = abitlength(newitem.vec, SLOTS
+											) - length - left
+								right = lensent - length - left - gaps
+								score += outside[
+										rule.lhs, length, left + right, gaps]
+								if score > MAX_LOGPROB:
+									continue
+							else:
+								score += length * MAX_LOGPROB
+							if process_edge[LCFRSItem_fused, LCFRSChart_fused](
+									newitem, newprob, score, rule, sibidx, sib,
+									agenda, chart, estimatetype, whitelist,
+									splitprune
+										and grammar.fanout[rule.lhs] != 1,
+									markorigin,
+									beam_beta if length <= beam_delta
+										else 0.0):
+								pass
+							else:
+								blocked += 1
+				# binary production, item from agenda is on the left
+				for n in range(grammar.numbinary):
+					rule = &(grammar.lbinary[item.label][n])
+					if rule.rhs1 != item.label:
+						break
+					# elif chart.probs[rule.rhs2] is None:
+					# 	continue
+					elif usemask and TESTBIT(&(grammar.mask[0]), rule.no):
+						continue
+					tmpitem.label = rule.rhs2
+					itemidxit = chart.itemindex.lower_bound(tmpitem)
+					sibvec.clear()
+					while (itemidxit != chart.itemindex.end()
+							and dereference(itemidxit).first.label
+								== rule.rhs2):
+						sib = dereference(itemidxit).first
+						sibidx = dereference(itemidxit).second
+						sibvec.push_back(sibidx)
+						postincrement(itemidxit)
+					for sibidx in sibvec:
+						sib = chart.items[sibidx]
+						if concat[LCFRSItem_fused](rule, &item, &sib):
+							newitem.label = rule.lhs
+							combine_item[LCFRSItem_fused](
+									&newitem, &item, &sib)
+							siblingprob = chart.probs[sibidx]
+							if siblingprob == INFINITY:
 								continue
-						elif estimatetype == SXlrgaps:
+							score = newprob = prob + siblingprob + rule.prob
 							if LCFRSItem_fused is SmallChartItem:
-								gaps = bitlength(newitem.vec) - length - left
+								length = bitcount(newitem.vec)
 							elif LCFRSItem_fused is FatChartItem:
-								gaps = abitlength(newitem.vec, SLOTS
-										) - length - left
-							right = lensent - length - left - gaps
-							score += outside[rule.lhs, length,
-									left + right, gaps]
-							if score > MAX_LOGPROB:
-								continue
-						else:
-							score += length * MAX_LOGPROB
-						if process_edge[LCFRSItem_fused, LCFRSChart_fused](
-								newitem, newprob, score, rule, itemidx, item,
-								agenda, chart, estimatetype, whitelist,
-								splitprune and grammar.fanout[rule.lhs] != 1,
-								markorigin,
-								beam_beta if length <= beam_delta else 0.0):
-							pass
-						else:
-							blocked += 1
-		if agenda.size() > maxA:
-			maxA = agenda.size()
-	msg = ('%s, blocked %d, agenda max %d, now %d' % (
-			chart.stats(), blocked, maxA, agenda.size()))
+								length = abitcount(newitem.vec, SLOTS)
+							if estimatetype == SX or estimatetype == SXlrgaps:
+								if LCFRSItem_fused is SmallChartItem:
+									left = nextset(newitem.vec, 0)
+								elif LCFRSItem_fused is FatChartItem:
+									left = anextset(newitem.vec, 0, SLOTS)
+							if estimatetype == SX:
+								right = lensent - length - left
+								score += outside[rule.lhs, left, right, 0]
+								if score > MAX_LOGPROB:
+									continue
+							elif estimatetype == SXlrgaps:
+								if LCFRSItem_fused is SmallChartItem:
+									gaps = bitlength(
+											newitem.vec) - length - left
+								elif LCFRSItem_fused is FatChartItem:
+									gaps = abitlength(newitem.vec, SLOTS
+											) - length - left
+								right = lensent - length - left - gaps
+								score += outside[rule.lhs, length,
+										left + right, gaps]
+								if score > MAX_LOGPROB:
+									continue
+							else:
+								score += length * MAX_LOGPROB
+							if process_edge[LCFRSItem_fused, LCFRSChart_fused](
+									newitem, newprob, score, rule, itemidx,
+									item, agenda, chart, estimatetype,
+									whitelist,
+									splitprune
+										and grammar.fanout[rule.lhs] != 1,
+									markorigin,
+									beam_beta if length <= beam_delta
+										else 0.0):
+								pass
+							else:
+								blocked += 1
+				binarytime += walltime() - end
+			if agenda.size() > maxA:
+				maxA = agenda.size()
+	chart.unarytime += unarytime
+	chart.binarytime += binarytime
+	msg = ('%s, blocked %d, agenda max %d, now %d%s' % (
+			chart.stats(), blocked, maxA, agenda.size(),
+			', stopped early' if stopped else ''))
 	if not chart:
 		return chart, 'no parse; ' + msg
 	return chart, msg
@@ -604,7 +659,7 @@ cdef inline bint process_edge(LCFRSItem_fused newitem,
 		ItemNo leftitemidx, LCFRSItem_fused& left,
 		Agenda[ItemNo, pair[Prob, Prob]]& agenda, LCFRSChart_fused chart,
 		int estimatetype, Whitelist whitelist, bint splitprune,
-		bint markorigin, Prob beam):
+		bint markorigin, Prob beam) nogil:
 	"""Decide what to do with a newly derived edge.
 
 	:returns: ``True`` when edge is accepted in the chart, ``False`` when
@@ -614,61 +669,64 @@ cdef inline bint process_edge(LCFRSItem_fused newitem,
 	cdef bint inagenda, inchart
 	cdef pair[Prob, Prob] scoreprob
 	cdef Prob curprob
-	# avoid generating code for spurious fused type combinations
+	# avoid generating code for spurious fused type combinations;
+	# NB: a positive test, so that the types of the iterators below are
+	# inferred in the remaining specializations.
 	if ((LCFRSItem_fused is SmallChartItem
-			and LCFRSChart_fused is FatLCFRSChart)
+			and LCFRSChart_fused is SmallLCFRSChart)
 			or (LCFRSItem_fused is FatChartItem
-			and LCFRSChart_fused is SmallLCFRSChart)):
-		return False
-	itemidxit = chart.itemindex.find(newitem)
-	if itemidxit == chart.itemindex.end():
-		cuprob = INFINITY
-		inagenda = inchart = False
-		itemidx = curprob = 0
-	else:
-		itemidx = dereference(itemidxit).second
-		curprob = chart.subtreeprob(itemidx)
-		inagenda = agenda.member(itemidx)
-		inchart = chart.parseforest[itemidx].size() != 0
-	scoreprob.first = score
-	scoreprob.second = prob
-	if not inagenda and not inchart:
-		# check if we need to prune this item
-		if whitelist is not None and not checkwhitelist(
-				newitem, whitelist, splitprune, markorigin):
-			return False
-		elif beam:
-			label = newitem.label
-			newitem.label = 0
-			it = chart.beambuckets.find(newitem)
-			if (it == chart.beambuckets.end()
-					or prob + beam < dereference(it).second):
-				chart.beambuckets[newitem] = prob + beam
-			elif prob > dereference(it).second:
+			and LCFRSChart_fused is FatLCFRSChart)):
+		itemidxit = chart.itemindex.find(newitem)
+		if itemidxit == chart.itemindex.end():
+			inagenda = inchart = False
+			itemidx = curprob = 0
+		else:
+			itemidx = dereference(itemidxit).second
+			curprob = chart._subtreeprob(itemidx)
+			inagenda = agenda.member(itemidx)
+			inchart = chart.parseforest[itemidx].size() != 0
+		scoreprob.first = score
+		scoreprob.second = prob
+		if not inagenda and not inchart:
+			# check if we need to prune this item
+			if whitelist is not None and not checkwhitelist(
+					newitem, whitelist, splitprune, markorigin):
 				return False
-			newitem.label = label
-		# haven't seen this item before, won't prune, add to agenda
-		itemidx = chart.itemindex[newitem] = chart.items.size()
-		chart.items.push_back(newitem)
-		chart.parseforest.resize(chart.items.size())
-		chart.probs.push_back(INFINITY)
-		agenda.setitem(itemidx, scoreprob)
-	# in agenda (maybe in chart)
-	elif inagenda:
-		# lower score? => decrease-key in agenda
-		agenda.setifbetter(itemidx, scoreprob)
-	# not in agenda => must be in chart
-	elif not inagenda and prob < curprob:
-		# re-add to agenda because we found a better score.
-		agenda.setitem(itemidx, scoreprob)
-		if estimatetype != SXlrgaps:
-			# This should only happen because of an inconsistent or
-			# non-monotonic estimate.
-			logging.warning('WARN: re-adding item to agenda already in chart:'
-					' %s', chart.itemstr(itemidx))
-	# store this edge, regardless of whether the item was new (unary chains)
-	chart.addedge(itemidx, leftitemidx, left, rule)
-	return True
+			elif beam:
+				label = newitem.label
+				newitem.label = 0
+				it = chart.beambuckets.find(newitem)
+				if (it == chart.beambuckets.end()
+						or prob + beam < dereference(it).second):
+					chart.beambuckets[newitem] = prob + beam
+				elif prob > dereference(it).second:
+					return False
+				newitem.label = label
+			# haven't seen this item before, won't prune, add to agenda
+			itemidx = chart.itemindex[newitem] = chart.items.size()
+			chart.items.push_back(newitem)
+			chart.parseforest.resize(chart.items.size())
+			chart.probs.push_back(INFINITY)
+			agenda.setitem(itemidx, scoreprob)
+		# in agenda (maybe in chart)
+		elif inagenda:
+			# lower score? => decrease-key in agenda
+			agenda.setifbetter(itemidx, scoreprob)
+		# not in agenda => must be in chart
+		elif not inagenda and prob < curprob:
+			# re-add to agenda because we found a better score.
+			agenda.setitem(itemidx, scoreprob)
+			if estimatetype != SXlrgaps:
+				# This should only happen because of an inconsistent or
+				# non-monotonic estimate.
+				with gil:
+					logging.warning('WARN: re-adding item to agenda already '
+							'in chart: %s', chart.itemstr(itemidx))
+		# store this edge, regardless of whether the item was new
+		# (unary chains)
+		chart.addedge(itemidx, leftitemidx, left, rule)
+		return True
+	return False
 
 
 cdef populatepos(Grammar grammar,
@@ -876,11 +934,14 @@ cdef inline int process_lexedge(LCFRSItem_fused newitem,
 
 
 cdef inline bint checkwhitelist(LCFRSItem_fused newitem, Whitelist whitelist,
-		bint splitprune, bint markorigin):
+		bint splitprune, bint markorigin) nogil:
 	"""Return False if item is not on whitelist."""
 	cdef uint32_t n, cnt
 	cdef Label label
 	cdef int a, b
+	# NB: local variables instead of globals, for use in concurrent threads.
+	cdef SmallChartItem component
+	cdef FatChartItem fatcomponent
 	if whitelist is None:
 		return True
 	elif splitprune:  # disc. item to be treated as several split items?
@@ -893,22 +954,22 @@ cdef inline bint checkwhitelist(LCFRSItem_fused newitem, Whitelist whitelist,
 			if whitelist.mapping[newitem.label] != 0:
 				return True
 			if LCFRSItem_fused is SmallChartItem:
-				COMPONENT.label = whitelist.splitmapping[
+				component.label = whitelist.splitmapping[
 						newitem.label][0]
 			elif LCFRSItem_fused is FatChartItem:
-				FATCOMPONENT.label = whitelist.splitmapping[
+				fatcomponent.label = whitelist.splitmapping[
 						newitem.label][0]
 		if LCFRSItem_fused is SmallChartItem:
 			a = nextset(newitem.vec, b)
 			while a != -1:
 				b = nextunset(newitem.vec, a)
 				# given a=3, b=6, make bitvector: 1000000 - 1000 = 111000
-				COMPONENT.vec = (1UL << b) - (1UL << a)
+				component.vec = (1UL << b) - (1UL << a)
 				if markorigin:
-					COMPONENT.label = whitelist.splitmapping[
+					component.label = whitelist.splitmapping[
 							newitem.label][cnt]
 					cnt += 1
-				if whitelist.small[COMPONENT.label].count(COMPONENT) == 0:
+				if not smallwhitelisted(whitelist, component):
 					return False
 				a = nextset(newitem.vec, b)
 		elif LCFRSItem_fused is FatChartItem:
@@ -916,22 +977,22 @@ cdef inline bint checkwhitelist(LCFRSItem_fused newitem, Whitelist whitelist,
 			while a != -1:
 				b = anextunset(newitem.vec, a, SLOTS)
 				# given a=3, b=6, make bitvector: 1000000 - 1000 = 111000
-				memset(<void *>FATCOMPONENT.vec, 0, SLOTS * sizeof(uint64_t))
+				memset(<void *>fatcomponent.vec, 0, SLOTS * sizeof(uint64_t))
 				for n in range(a, b):
-					SETBIT(FATCOMPONENT.vec, n)
+					SETBIT(fatcomponent.vec, n)
 				if markorigin:
-					FATCOMPONENT.label = whitelist.splitmapping[
+					fatcomponent.label = whitelist.splitmapping[
 							newitem.label][cnt]
 					cnt += 1
-				if whitelist.fat[FATCOMPONENT.label].count(
-						FATCOMPONENT) == 0:
+				if whitelist.fat[fatcomponent.label].count(
+						fatcomponent) == 0:
 					return False
 				a = anextset(newitem.vec, b, SLOTS)
 	elif whitelist.mapping[newitem.label] != 0:
 		label = newitem.label
 		newitem.label = whitelist.mapping[label]
 		if LCFRSItem_fused is SmallChartItem:
-			if whitelist.small[newitem.label].count(newitem) == 0:
+			if not smallwhitelisted(whitelist, newitem):
 				return False
 		elif LCFRSItem_fused is FatChartItem:
 			if whitelist.fat[newitem.label].count(newitem) == 0:
@@ -941,7 +1002,7 @@ cdef inline bint checkwhitelist(LCFRSItem_fused newitem, Whitelist whitelist,
 
 
 cdef inline void combine_item(LCFRSItem_fused *newitem,
-		LCFRSItem_fused *left, LCFRSItem_fused *right):
+		LCFRSItem_fused *left, LCFRSItem_fused *right) nogil:
 	if LCFRSItem_fused is SmallChartItem:
 		newitem[0].vec = left[0].vec ^ right[0].vec
 	elif LCFRSItem_fused is FatChartItem:
@@ -949,7 +1010,7 @@ cdef inline void combine_item(LCFRSItem_fused *newitem,
 
 
 cdef inline bint concat(ProbRule *rule,
-		LCFRSItem_fused *left, LCFRSItem_fused *right):
+		LCFRSItem_fused *left, LCFRSItem_fused *right) nogil:
 	"""Test whether two bitvectors combine according to a given rule.
 
 	Ranges should be non-overlapping, continuous when they are concatenated,
@@ -205,7 +205,8 @@ def startexp(
 	results = doparsing(parser=theparser, testset=testset, resultdir=resultdir,
 			usetags=usetags, numproc=prm.numproc, deletelabel=deletelabel,
 			deleteword=deleteword, corpusfmt=prm.corpusfmt,
-			morphology=prm.morphology, evalparam=evalparam)
+			morphology=prm.morphology, evalparam=evalparam,
+			sharegrammars=prm.sharegrammars)
 	if prm.numproc == 1:
 		logging.info(
 				'time elapsed during parsing: %gs', process_time() - begin)
@@ -546,7 +547,8 @@ def getgrammars(trees, sents, stages, testmaxwords, resultdir,
 def doparsing(**kwds):
 	"""Parse a set of sentences using worker processes."""
 	params = parser.DictObj(usetags=True, numproc=None, tailmarker='',
-		category=None, deletelabel=(), deleteword=(), corpusfmt='export')
+		category=None, deletelabel=(), deleteword=(), corpusfmt='export',
+		sharegrammars=False)
 	params.update(kwds)
 	results = [parser.DictObj(name=stage.name)
 			for stage in params.parser.stages]
@@ -565,6 +567,10 @@ def doparsing(**kwds):
 		initworker(params)
 		dowork = (worker(a) for a in params.testset.items())
 	else:
+		if params.sharegrammars:
+			# store grammars as resultdir/<stage>.g, shared by worker
+			# processes; also used by 'discodop parser --cache'.
+			parser.sharegrammars(params.parser.stages, params.resultdir)
 		pool = multiprocessing.Pool(processes=params.numproc,
 				initializer=initworker, initargs=(params,))
 		dowork = pool.imap_unordered(
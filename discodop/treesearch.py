@@ -10,7 +10,11 @@ import re
 import csv
 import sys
 import mmap
+import time
 import array
+import pickle
+import sqlite3
+import threading
 import tempfile
 import subprocess
 import multiprocessing
@@ -22,6 +26,7 @@ try:
 	RE2LIB = True
 except ImportError:
 	RE2LIB = False
+import numpy as np
 from roaringbitmap import RoaringBitmap, MultiRoaringBitmap
 from . import treebank, _fragments
 from .tree import (Tree, DrawTree, DiscTree, brackettree, discbrackettree,
@@ -40,6 +45,22 @@ LEAFINDICESWORDS = re.compile(r' ([0-9]+)=([^ ()]+)\)')
 ALPINOLEAVES = re.compile('<sentence>(.*)</sentence>')
 MORPH_TAGS = re.compile(r'([/*\w]+)(?:\[[^ ]*\]\d?)?((?:-\w+)?(?:\*\d+)? )')
 FUNC_TAGS = re.compile(r'-\w+')
+# Corpora and vocabularies kept open for fragment queries in this process;
+# filled by the initializer of worker processes, or by a FragmentSearcher
+# that runs queries in the main process.
+_FRAGCORPORA = {}  # filename => Ctrees
+_FRAGVOCAB = {}  # vocabpath => Vocabulary
+# with multiple processes, fragment queries on corpora with more nodes than
+# this are divided over the worker processes.
+MINSHARDNODES = 100000
+# trigrams of plain text corpora are hashed to 2 ** TRIGRAMBITS buckets.
+TRIGRAMBITS = 16
+# The start of a group in a regex, after the opening parenthesis; optionally
+# with flags. Cf. _regex_literals().
+REGEXGROUP = re.compile(
+		br'\?(?:[:=!>]|<[=!]|P<|([aiLmsux]*(?:-[imsx]+)?)[:)])|(?!\?)')
+# The repetition count of a quantifier, after the opening brace.
+REGEXREPEAT = re.compile(br'(\d*)(?:,\d*)?\}')
 
 CorpusInfo = namedtuple('CorpusInfo',
 		['len', 'numwords', 'numnodes', 'maxnodes'])
@@ -48,12 +69,17 @@ CorpusInfo = namedtuple('CorpusInfo',
 class CorpusSearcher(object):
 	"""Abstract base class to wrap corpus files that can be queried."""
 
-	def __init__(self, files, macros=None, numproc=None):
+	engine = None
+
+	def __init__(self, files, macros=None, numproc=None, cache=None):
 		"""
 		:param files: a sequence of filenames of corpora
 		:param macros: a filename with macros that can be used in queries.
 		:param numproc: the number of concurrent threads / processes to use;
-			pass 1 to use a single core."""
+			pass 1 to use a single core.
+		:param cache: where to cache query results; None for an in-memory
+			LRU cache, a filename for a persistent ``SqliteCache``, or a
+			mapping object such as an ``LRUCache``."""
 		if not isinstance(files, (list, tuple, set, dict)):
 			raise ValueError('"files" argument must be a sequence.')
 		for a in files:
@@ -63,7 +89,11 @@ class CorpusSearcher(object):
 		self.files = OrderedDict.fromkeys(files)
 		self.macros = macros
 		self.numproc = numproc or cpu_count()
-		self.cache = FIFOOrederedDict(CACHESIZE)
+		if cache is None:
+			cache = LRUCache(CACHESIZE)
+		elif isinstance(cache, str):
+			cache = SqliteCache(cache)
+		self.cache = QueryCache(self.engine, cache)
 		self.pool = concurrent.futures.ThreadPoolExecutor(self.numproc)
 		if not self.files:
 			raise ValueError('no files found: %s' % files)
@@ -219,7 +249,9 @@ class CorpusSearcher(object):
 class TgrepSearcher(CorpusSearcher):
 	"""Search a corpus with tgrep2."""
 
-	def __init__(self, files, macros=None, numproc=None):
+	engine = 'tgrep2'
+
+	def __init__(self, files, macros=None, numproc=None, cache=None):
 		def convert(filename):
 			"""Create tgrep2 indexed files (.t2c) if necessary."""
 			if not os.path.exists(self._internalfilename(filename)):
@@ -243,7 +275,7 @@ class TgrepSearcher(CorpusSearcher):
 						os.unlink(origfile)
 			return filename
 
-		super().__init__(files, macros, numproc)
+		super().__init__(files, macros, numproc, cache)
 		self._compressext = 'gz'  # the compression format to use for t2c files
 		if which('zstd', exception=False):  # https://facebook.github.io/zstd/
 			self._compressext = 'zst'
@@ -295,8 +327,13 @@ class TgrepSearcher(CorpusSearcher):
 		# %s the sentence number
 		# %p the number of the matching pattern
 		fmt = r'%s\n%p:::\n'
+		queries = tuple(queries)
 		for filename in subset:
-			# NB: not using cache
+			result = self.cache.get((
+					'batchcounts', queries, filename, start, end))
+			if result is not None:
+				yield filename, result
+				continue
 			jobs[self._submit(
 					lambda x: [cnt for _, cnt in sorted(Counter(int(queryno)
 						for _, queryno in self._query(
@@ -304,41 +341,54 @@ class TgrepSearcher(CorpusSearcher):
 					filename)] = filename
 		for future in self._as_completed(jobs):
 			filename = jobs[future]
-			yield filename, future.result()
+			self.cache['batchcounts', queries, filename, start, end
+					] = result = future.result()
+			yield filename, result
 
 	def batchsents(self, queries, subset=None, start=None, end=None,
 			maxresults=100, brackets=False):
-		# FIXME: this is highly similar to sents(), but no caching
+		# FIXME: this is highly similar to sents()
 		subset = subset or self.files
 		# %s the sentence number
 		# %w complete tree in bracket notation
 		# %h the tree matched by the head (first) node of the pattern
 		# %yh %zh the terminal index of the first/last terminal in the match
 		fmt = r'%s\n%w\n%h\n%yh\n%zh:::\n'
+		queries = tuple(queries)
 		jobs = {}
 		for filename in subset:
-			jobs[self._submit(
-					lambda x: list(self._query(
-						queries, x, fmt, start, end, maxresults)),
-					filename)] = filename
+			try:
+				x, maxresults2 = self.cache['batchsents', queries, filename,
+						start, end, brackets]
+			except KeyError:
+				maxresults2 = 0
+			if not maxresults or maxresults > maxresults2:
+				jobs[self._submit(
+						lambda x: list(self._query(
+							queries, x, fmt, start, end, maxresults)),
+						filename)] = filename
+			else:
+				yield filename, x[:maxresults]
 		for future in self._as_completed(jobs):
 			filename = jobs[future]
 			result = []
 			for sentno, line in future.result():
-				sent, match, begin, end = line.splitlines()
+				sent, match, begin, last = line.splitlines()
 				if brackets:
 					match1 = match
 					match2 = ''
 				else:
-					begin, end = int(begin) - 1, int(end)
+					begin, last = int(begin) - 1, int(last)
 					tokens = [ptbunescape(token)
 							for token in GETLEAVES.findall(sent)]
 					sent = ' '.join(tokens)
 					prelen = len(' '.join(tokens[:begin]))
-					match = ' '.join(tokens[begin:end])
+					match = ' '.join(tokens[begin:last])
 					match1 = set(range(prelen, prelen + len(match) + 1))
 					match2 = set()
 				result.append((sentno, sent, match1, match2))
+			self.cache['batchsents', queries, filename, start, end,
+					brackets] = result, maxresults
 			yield filename, result
 
 	def trees(self, query, subset=None, start=None, end=None, maxresults=10,
@@ -426,17 +476,17 @@ class TgrepSearcher(CorpusSearcher):
 			filename = jobs[future]
 			x = []
 			for sentno, line in future.result():
-				sent, match, begin, end = line.splitlines()
+				sent, match, begin, last = line.splitlines()
 				if brackets:
 					match1 = match
 					match2 = ''
 				else:
-					begin, end = int(begin) - 1, int(end)
+					begin, last = int(begin) - 1, int(last)
 					tokens = [ptbunescape(token)
 							for token in GETLEAVES.findall(sent)]
 					sent = ' '.join(tokens)
 					prelen = len(' '.join(tokens[:begin]))
-					match = ' '.join(tokens[begin:end])
+					match = ' '.join(tokens[begin:last])
 					match1 = set(range(prelen, prelen + len(match) + 1))
 					match2 = set()
 				x.append((filename, sentno, sent, match1, match2))
@@ -551,9 +601,12 @@ class FragmentSearcher(CorpusSearcher):
 		an occurrence of ``'{name}'`` will be replaced with ``fragment`` when
 		it appears in a query.
 	:param inmemory: if True, keep all corpora in memory; otherwise,
-		load them from disk with each query.
+		load them from disk with each query. With multiple processes, each
+		worker process opens the corpora once when it is started.
 	"""
 
+	engine = 'frag'
+
 	# TODO: allow single terminals as queries: word
 	# 		alternatively, allow wildcard: (* word)
 	# TODO: allow regex labels: /label/
@@ -561,8 +614,9 @@ class FragmentSearcher(CorpusSearcher):
 	# TODO: interpret multiple fragments in a single query as AND query,
 	# 		optionally with order constraint: (NN cat) (NN dog)
 	# TODO: compiled query set, re-usable on new documents.
-	def __init__(self, files, macros=None, numproc=None, inmemory=True):
-		super().__init__(files, macros, numproc)
+	def __init__(self, files, macros=None, numproc=None, inmemory=True,
+			cache=None):
+		super().__init__(files, macros, numproc, cache)
 		self.disc = False
 		newvocab = True
 		path = os.path.dirname(next(iter(sorted(files))))
@@ -588,22 +642,44 @@ class FragmentSearcher(CorpusSearcher):
 				corpus = _fragments.readtreebank(filename, self.vocab, fmt=fmt)
 				corpus.indextrees(self.vocab)
 				corpus.tofile('%s.ct' % filename)
+				corpus.indexpairs('%s.pairidx' % filename)
 				newvocab = True
+			elif not (os.path.exists('%s.pairidx' % filename)
+					and os.stat('%s.pairidx' % filename).st_mtime
+					>= os.stat('%s.ct' % filename).st_mtime):
+				with Ctrees.fromfile('%s.ct' % filename) as corpus:
+					corpus.indexpairs('%s.pairidx' % filename)
 			if inmemory:
-				self.files[filename] = Ctrees.fromfile('%s.ct' % filename)
+				self.files[filename] = _openctrees(filename)
 		if newvocab:
 			self.vocab.tofile(self.vocabpath)
 		self.macros = None
 		if macros:
 			with openread(macros) as tmp:
 				self.macros = dict(line.strip().split('=', 1) for line in tmp)
-		self.pool = concurrent.futures.ProcessPoolExecutor(self.numproc)
+		if self.numproc == 1:  # queries run in this process
+			_FRAGCORPORA.update((filename, corpus)
+					for filename, corpus in self.files.items()
+					if corpus is not None)
+			_FRAGVOCAB[self.vocabpath] = self.vocab
+		self.pool = concurrent.futures.ProcessPoolExecutor(
+				self.numproc, initializer=_frag_init,
+				initargs=(list(self.files) if inmemory else [],
+					self.vocabpath))
 
 	def close(self):
+		if self.files is None:
+			return
+		self.pool.shutdown(wait=False)
+		if _FRAGVOCAB.get(self.vocabpath) is self.vocab:
+			del _FRAGVOCAB[self.vocabpath]
 		if hasattr(self.vocab, 'close'):
 			self.vocab.close()
-		for a in self.files:
-			a.close()
+		for filename, a in self.files.items():
+			if a is not None:
+				if _FRAGCORPORA.get(filename) is a:
+					del _FRAGCORPORA[filename]
+				a.close()
 		self.vocab = self.files = None
 
 	def counts(self, query, subset=None, start=None, end=None, indices=False,
@@ -622,7 +698,7 @@ class FragmentSearcher(CorpusSearcher):
 			query = query.format(**self.macros)
 		result = OrderedDict()
 		jobs = {}
-		cquery = None
+		cquery = bitsets = maxnodes = None
 		for filename in subset:
 			try:
 				tmp = self.cache[
@@ -635,14 +711,10 @@ class FragmentSearcher(CorpusSearcher):
 				if cquery is None:
 					cquery, bitsets, maxnodes = self._parse_query(
 							query, disc=self.disc)
-				jobs[self._submit(
-						_frag_query if self.numproc == 1 else _frag_query_mp,
-						cquery, bitsets, maxnodes, filename, self.vocabpath,
-						start, end, None, indices=indices, trees=False,
-						)] = filename
-		for future in self._as_completed(jobs):
-			filename = jobs[future]
-			tmp = future.result()
+				jobs[filename] = self._submit_shards(
+						cquery, bitsets, maxnodes, filename,
+						start, end, None, indices=indices, trees=False)
+		for filename, tmp in self._completed_shards(jobs):
 			self.cache['counts', query, filename, start, end, indices] = tmp
 			if indices:
 				result[filename] = [b for a in tmp for b in a]
@@ -655,17 +727,23 @@ class FragmentSearcher(CorpusSearcher):
 		jobs = {}
 		if self.macros is not None:
 			queries = [query.format(**self.macros) for query in queries]
-		cqueries, bitsets, maxnodes = self._parse_query(queries, disc=self.disc)
+		queries = tuple(queries)
+		cqueries = bitsets = maxnodes = None
 		for filename in subset:
-			# NB: not using cache.
-			jobs[self._submit(
-					_frag_query,
-					cqueries, bitsets, maxnodes, filename, self.vocabpath,
-					start, end, None, indices=False, trees=False,
-					)] = filename
-		for future in self._as_completed(jobs):
-			filename = jobs[future]
-			yield filename, future.result()
+			result = self.cache.get((
+					'batchcounts', queries, filename, start, end))
+			if result is not None:
+				yield filename, result
+				continue
+			if cqueries is None:
+				cqueries, bitsets, maxnodes = self._parse_query(
+						list(queries), disc=self.disc)
+			jobs[filename] = self._submit_shards(
+					cqueries, bitsets, maxnodes, filename,
+					start, end, None, indices=False, trees=False)
+		for filename, result in self._completed_shards(jobs):
+			self.cache['batchcounts', queries, filename, start, end] = result
+			yield filename, result
 
 	def trees(self, query, subset=None, start=None, end=None, maxresults=10,
 			nofunc=False, nomorph=False, detectdisc=True, mergedisc=False):
@@ -674,7 +752,7 @@ class FragmentSearcher(CorpusSearcher):
 			query = query.format(**self.macros)
 		result = []
 		jobs = {}
-		cquery = None
+		cquery = bitsets = maxnodes = None
 		for filename in subset:
 			try:
 				x, maxresults2 = self.cache['trees', query, filename,
@@ -685,17 +763,14 @@ class FragmentSearcher(CorpusSearcher):
 				if cquery is None:
 					cquery, bitsets, maxnodes = self._parse_query(
 							query, disc=self.disc)
-				jobs[self._submit(
-						_frag_query if self.numproc == 1 else _frag_query_mp,
-						cquery, bitsets, maxnodes, filename, self.vocabpath,
-						start, end, maxresults, indices=True, trees=True,
-						)] = filename
+				jobs[filename] = self._submit_shards(
+						cquery, bitsets, maxnodes, filename,
+						start, end, maxresults, indices=True, trees=True)
 			else:
 				result.extend(x[:maxresults])
-		for future in self._as_completed(jobs):
-			filename = jobs[future]
+		for filename, tmp in self._completed_shards(jobs, maxresults):
 			x = []
-			for matches in future.result():
+			for matches in tmp:
 				for sentno, treestr, match in matches:
 					treestr = filterlabels(treestr, nofunc, nomorph)
 					# FIXME: this highlights the whole subtree, of which
@@ -726,7 +801,7 @@ class FragmentSearcher(CorpusSearcher):
 			query = query.format(**self.macros)
 		result = []
 		jobs = {}
-		cquery = None
+		cquery = bitsets = maxnodes = None
 		for filename in subset:
 			try:
 				x, maxresults2 = self.cache['sents', query, filename,
@@ -737,17 +812,14 @@ class FragmentSearcher(CorpusSearcher):
 				if cquery is None:
 					cquery, bitsets, maxnodes = self._parse_query(
 							query, disc=self.disc)
-				jobs[self._submit(
-						_frag_query if self.numproc == 1 else _frag_query_mp,
-						cquery, bitsets, maxnodes, filename, self.vocabpath,
-						start, end, maxresults, indices=True, trees=True,
-						)] = filename
+				jobs[filename] = self._submit_shards(
+						cquery, bitsets, maxnodes, filename,
+						start, end, maxresults, indices=True, trees=True)
 			else:
 				result.extend(x[:maxresults])
-		for future in self._as_completed(jobs):
-			filename = jobs[future]
+		for filename, tmp in self._completed_shards(jobs, maxresults):
 			x = []
-			for frag, matches in zip(query.splitlines(), future.result()):
+			for frag, matches in zip(query.splitlines(), tmp):
 				for sentno, treestr, match in matches:
 					if brackets:
 						sent = treestr
@@ -796,6 +868,58 @@ class FragmentSearcher(CorpusSearcher):
 		return CorpusInfo(len=corpus.len, numwords=corpus.numwords,
 				numnodes=corpus.numnodes, maxnodes=corpus.maxnodes)
 
+	def _submit_shards(self, cquery, bitsets, maxnodes, filename,
+			start, end, maxresults, indices, trees):
+		"""Submit a fragment query on a file to the worker processes.
+
+		With multiple processes, large files are divided into ranges of
+		sentences with roughly the same number of nodes, each of which is a
+		separate job.
+
+		:returns: a list of futures with the results of each range."""
+		ranges = [(start, end)]
+		if self.numproc != 1:
+			corpus = self.files[filename]
+			if corpus is None:
+				corpus = Ctrees.fromfile('%s.ct' % filename)
+			numshards = min(self.numproc, corpus.numnodes // MINSHARDNODES)
+			if numshards > 1:
+				ranges = [(a + 1, b) for a, b in corpus.shards(
+						numshards, start - 1 if start else 0, end or 0)]
+			if self.files[filename] is None:
+				corpus.close()
+		return [self._submit(
+				_frag_query if self.numproc == 1 else _frag_query_mp,
+				cquery, bitsets, maxnodes, filename, self.vocabpath,
+				a, b, maxresults, indices=indices, trees=trees)
+				for a, b in ranges]
+
+	def _completed_shards(self, jobs, maxresults=None):
+		"""Yield the results of fragment queries as files are completed.
+
+		:param jobs: a dict with lists of futures returned by
+			``_submit_shards()`` for each file.
+		:yields: tuples ``(filename, result)``, where the results of the
+			ranges of a file are merged."""
+		futures = {future: filename
+				for filename, fs in jobs.items() for future in fs}
+		remaining = {filename: len(fs) for filename, fs in jobs.items()}
+		for future in self._as_completed(futures):
+			filename = futures[future]
+			remaining[filename] -= 1
+			if remaining[filename]:
+				continue
+			results = [future.result() for future in jobs[filename]]
+			if len(results) == 1:
+				yield filename, results[0]
+			elif isinstance(results[0], array.array):  # counts
+				yield filename, array.array(results[0].typecode,
+						map(sum, zip(*results)))
+			else:  # indices or matches for each fragment
+				yield filename, [
+						[b for a in matches for b in a][:maxresults]
+						for matches in zip(*results)]
+
 	def _parse_query(self, query, disc=False):
 		"""Prepare fragment query."""
 		if isinstance(query, list):
@@ -817,6 +941,24 @@ class FragmentSearcher(CorpusSearcher):
 		return queries, bitsets, maxnodes
 
 
+def _openctrees(filename):
+	"""Load the indexed trees of a corpus, with its pair index if available.
+
+	The pair index is the index of parent-child pairs of productions."""
+	corpus = Ctrees.fromfile('%s.ct' % filename)
+	if os.path.exists('%s.pairidx' % filename):
+		corpus.pairindex = MultiRoaringBitmap.fromfile(
+				'%s.pairidx' % filename)
+	return corpus
+
+
+def _frag_init(filenames, vocabpath):
+	"""Initializer of worker processes; open corpora and vocabulary once."""
+	for filename in filenames:
+		_FRAGCORPORA[filename] = _openctrees(filename)
+	_FRAGVOCAB[vocabpath] = FixedVocabulary.fromfile(vocabpath)
+
+
 @workerfunc
 def _frag_query_mp(queries, bitsets, maxnodes, filename, vocabpath,
 		start=None, end=None, maxresults=None, indices=True, trees=False):
@@ -829,7 +971,9 @@ def _frag_query_mp(queries, bitsets, maxnodes, filename, vocabpath,
 def _frag_query(queries, bitsets, maxnodes, filename, vocabpath,
 		start=None, end=None, maxresults=None, indices=True, trees=False):
 	"""Run a prepared fragment query on a single file."""
-	corpus = Ctrees.fromfile('%s.ct' % filename)
+	corpus = _FRAGCORPORA.get(filename)
+	if corpus is None:
+		corpus = _openctrees(filename)
 	if start:
 		start -= 1
 	results = _fragments.exactcountsslice(
@@ -838,7 +982,9 @@ def _frag_query(queries, bitsets, maxnodes, filename, vocabpath,
 			maxnodes=maxnodes, start=start, end=end,
 			maxresults=maxresults)
 	if indices and trees:
-		vocab = FixedVocabulary.fromfile(vocabpath)
+		vocab = _FRAGVOCAB.get(vocabpath)
+		if vocab is None:
+			vocab = FixedVocabulary.fromfile(vocabpath)
 		results = [[(n + 1,
 					corpus.extract(n, vocab, disc=True),
 					corpus.extract(n, vocab, disc=True, node=m))
@@ -858,11 +1004,16 @@ class RegexSearcher(CorpusSearcher):
 	:param macros: a file containing lines of the form ``'name=regex'``;
 		an occurrence of ``'{name}'`` will be replaced with ``regex`` when it
 		appears in a query.
-	:param ignorecase: ignore case in all queries."""
+	:param ignorecase: ignore case in all queries.
+	:param trigramindex: if True, create an index of the lines in which each
+		trigram occurs; queries with literal strings of at least three
+		characters only search the lines containing those strings."""
+
+	engine = 'regex'
 
 	def __init__(self, files, macros=None, numproc=None, ignorecase=False,
-			inmemory=False):
-		super().__init__(files, macros, numproc)
+			inmemory=False, cache=None, trigramindex=False):
+		super().__init__(files, macros, numproc, cache)
 		self.macros = None
 		self.flags = re.MULTILINE
 		if ignorecase:
@@ -884,6 +1035,24 @@ class RegexSearcher(CorpusSearcher):
 		else:
 			tmp = [_indexfile(name) for name in sorted(files)]
 			self.lineindex = MultiRoaringBitmap(tmp, filename=self.lineidxpath)
+		self.trigramidxpath = None
+		if trigramindex:
+			self.trigramidxpath = os.path.join(path, 'treesearchtrigram.idx')
+			numbitmaps, mtime = 0, 0
+			if os.path.exists(self.trigramidxpath):
+				mtime = os.stat(self.trigramidxpath).st_mtime
+				tmp = MultiRoaringBitmap.fromfile(self.trigramidxpath)
+				numbitmaps = len(tmp)
+				if hasattr(tmp, 'close'):
+					tmp.close()
+			if (numbitmaps != len(files) << TRIGRAMBITS
+					or mtime <= maxmtime):
+				tmp = [bitmap for name in sorted(files)
+						for bitmap in _indextrigrams(
+							name, self.lineindex[self.fileno[name]])]
+				tmp = MultiRoaringBitmap(tmp, filename=self.trigramidxpath)
+				if hasattr(tmp, 'close'):
+					tmp.close()
 		if inmemory:
 			for filename in self.files:
 				fileno = os.open(filename, os.O_RDONLY)
@@ -923,7 +1092,7 @@ class RegexSearcher(CorpusSearcher):
 						_regex_run_query,
 						pattern, filename, self.fileno[filename],
 						self.lineidxpath, start, end, None, indices, False,
-						breakdown,
+						breakdown, self.trigramidxpath,
 						)] = filename
 		for future in self._as_completed(jobs):
 			filename = jobs[future]
@@ -951,15 +1120,15 @@ class RegexSearcher(CorpusSearcher):
 						_regex_query if self.numproc == 1 else _regex_query_mp,
 						query, filename, self.fileno[filename],
 						self.lineidxpath, self.flags, start, end, maxresults,
-						True, True,
+						True, True, False, self.trigramidxpath,
 						)] = filename
 			else:
 				result.extend(x[:maxresults])
 		for future in self._as_completed(jobs):
 			filename = jobs[future]
 			x = []
-			for sentno, sent, start, end in future.result():
-				highlight = range(start, end)
+			for sentno, sent, begin, last in future.result():
+				highlight = range(begin, last)
 				x.append((filename, sentno, sent, highlight, ()))
 			self.cache['sents', query, filename, start, end, True, True
 					] = x, maxresults
@@ -980,14 +1149,19 @@ class RegexSearcher(CorpusSearcher):
 		chunksize = max(int(len(patterns) / (self.numproc * 4)), 1)
 		chunkedpatterns = [patterns[n:n + chunksize]
 				for n in range(0, len(patterns), chunksize)]
-		result = OrderedDict((name, [])
-				for name in subset or self.files)
+		queries = tuple(queries)
 		for filename in subset or self.files:
-			result = array.array('I')
-			for tmp in self._map(_regex_run_batch, chunkedpatterns,
-					filename=filename, fileno=self.fileno[filename],
-					lineidxpath=self.lineidxpath, start=start, end=end):
-				result.extend(tmp)
+			result = self.cache.get((
+					'batchcounts', queries, filename, start, end))
+			if result is None:
+				result = array.array('I')
+				for tmp in self._map(_regex_run_batch, chunkedpatterns,
+						filename=filename, fileno=self.fileno[filename],
+						lineidxpath=self.lineidxpath, start=start, end=end,
+						trigramidxpath=self.trigramidxpath):
+					result.extend(tmp)
+				self.cache['batchcounts', queries, filename, start, end
+						] = result
 			yield filename, result
 
 	def batchsents(self, queries, subset=None, start=None, end=None,
@@ -1004,15 +1178,21 @@ class RegexSearcher(CorpusSearcher):
 		chunksize = max(int(len(patterns) / (self.numproc * 4)), 1)
 		chunkedpatterns = [patterns[n:n + chunksize]
 				for n in range(0, len(patterns), chunksize)]
-		result = OrderedDict((name, [])
-				for name in subset or self.files)
+		queries = tuple(queries)
 		for filename in subset or self.files:
-			result = []
-			for tmp in self._map(_regex_run_batch, chunkedpatterns,
-					filename=filename, fileno=self.fileno[filename],
-					lineidxpath=self.lineidxpath, start=start, end=end,
-					maxresults=maxresults, sents=True):
-				result.extend(tmp)
+			# maxresults applies to each query, so it is part of the key
+			result = self.cache.get((
+					'batchsents', queries, filename, start, end, maxresults))
+			if result is None:
+				result = []
+				for tmp in self._map(_regex_run_batch, chunkedpatterns,
+						filename=filename, fileno=self.fileno[filename],
+						lineidxpath=self.lineidxpath, start=start, end=end,
+						maxresults=maxresults, sents=True,
+						trigramidxpath=self.trigramidxpath):
+					result.extend(tmp)
+				self.cache['batchsents', queries, filename, start, end,
+						maxresults] = result
 			yield filename, result
 
 	def extract(self, filename, indices, nofunc=False, nomorph=False,
@@ -1051,20 +1231,20 @@ class RegexSearcher(CorpusSearcher):
 @workerfunc
 def _regex_query_mp(query, filename, fileno, lineidxpath, flags,
 		start=None, end=None, maxresults=None, indices=True, sents=False,
-		breakdown=False):
+		breakdown=False, trigramidxpath=None):
 	"""Multiprocessing wrapper."""
 	return _regex_query(query, filename, fileno, lineidxpath, flags,
-			start, end, maxresults, indices, sents, breakdown)
+			start, end, maxresults, indices, sents, breakdown, trigramidxpath)
 
 
 def _regex_query(query, filename, fileno, lineidxpath, flags,
 		start=None, end=None, maxresults=None, indices=True, sents=False,
-		breakdown=False):
+		breakdown=False, trigramidxpath=None):
 	"""Run a query on a single file."""
 	pattern = _regex_parse_query(query, flags)
 	return _regex_run_query(pattern, filename, fileno, lineidxpath,
 			start=start, end=end, maxresults=maxresults, indices=indices,
-			sents=sents, breakdown=breakdown)
+			sents=sents, breakdown=breakdown, trigramidxpath=trigramidxpath)
 
 
 def _regex_parse_query(query, flags):
@@ -1084,7 +1264,7 @@ def _regex_parse_query(query, flags):
 
 def _regex_run_query(pattern, filename, fileno, lineidxpath,
 		start=None, end=None, maxresults=None, indices=False, sents=False,
-		breakdown=False):
+		breakdown=False, trigramidxpath=None):
 	"""Run a prepared query on a single file."""
 	mrb = MultiRoaringBitmap.fromfile(lineidxpath)
 	lineindex = mrb.get(fileno)
@@ -1103,8 +1283,13 @@ def _regex_run_query(pattern, filename, fileno, lineidxpath,
 		return result
 	startidx = lineindex.select(start - 1 if start else 0)
 	endidx = lineindex.select(end)
+	candidates = None
+	if trigramidxpath is not None:
+		candidates = _regex_candidates(pattern, fileno, trigramidxpath)
+		if candidates is not None:
+			candidates = candidates.clamp(start or 1, end + 1)
 	with open(filename, 'rb') as tmp:
-		if startidx == 0 and lastline:
+		if (startidx == 0 and lastline) or candidates is not None:
 			chunkoffset = 0
 			data = mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ)
 		else:
@@ -1116,8 +1301,8 @@ def _regex_run_query(pattern, filename, fileno, lineidxpath,
 			if (start or 0) >= len(lineindex):
 				return result
 			if indices or sents:
-				for match in islice(
-						pattern.finditer(data, startidx, endidx), maxresults):
+				for match in islice(_regex_finditer(pattern, data,
+						startidx, endidx, lineindex, candidates), maxresults):
 					mstart = match.start()
 					mend = match.end()
 					lineno = lineindex.rank(mstart + chunkoffset)
@@ -1134,14 +1319,13 @@ def _regex_run_query(pattern, filename, fileno, lineidxpath,
 					result.append((lineno, sent, mstart, mend))
 			else:
 				if breakdown:
-					matches = pattern.findall(
-							data, startidx, endidx)[:maxresults]
+					matches = [a for b, c in _regex_ranges(
+							startidx, endidx, lineindex, candidates)
+							for a in pattern.findall(data, b, c)][:maxresults]
 					result.update(a.decode('utf8') for a in matches)
 				else:
-					try:
-						result = pattern.count(data, startidx, endidx)
-					except AttributeError:
-						result = len(pattern.findall(data, startidx, endidx))
+					result = _regex_count(pattern, data,
+							startidx, endidx, lineindex, candidates)
 					result = max(result, maxresults or 0)
 		finally:
 			if isinstance(data, mmap.mmap):
@@ -1153,7 +1337,8 @@ def _regex_run_query(pattern, filename, fileno, lineidxpath,
 
 
 def _regex_run_batch(patterns, filename, fileno, lineidxpath,
-		start=None, end=None, maxresults=None, sents=False):
+		start=None, end=None, maxresults=None, sents=False,
+		trigramidxpath=None):
 	"""Run a batch of queries on a single file."""
 	mrb = MultiRoaringBitmap.fromfile(lineidxpath)
 	lineindex = mrb.get(fileno)
@@ -1163,16 +1348,24 @@ def _regex_run_batch(patterns, filename, fileno, lineidxpath,
 		result = array.array('I')
 	if start and start >= len(lineindex):
 		return result
+	lastline = (end if end is not None and end < len(lineindex)
+			else len(lineindex) - 1)
 	with open(filename, 'rb') as tmp:
 		data = mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ)
 		try:
 			startidx = lineindex.select(start - 1 if start else 0)
 			endidx = (lineindex.select(end) if end is not None
 					and end < len(lineindex) else len(data))
-			if sents:
-				for pattern in patterns:
-					for match in islice(
-							pattern.finditer(data, startidx, endidx),
+			for pattern in patterns:
+				candidates = None
+				if trigramidxpath is not None:
+					candidates = _regex_candidates(
+							pattern, fileno, trigramidxpath)
+					if candidates is not None:
+						candidates = candidates.clamp(start or 1, lastline + 1)
+				if sents:
+					for match in islice(_regex_finditer(pattern, data,
+							startidx, endidx, lineindex, candidates),
 							maxresults):
 						mstart = match.start()
 						mend = match.end()
@@ -1184,13 +1377,9 @@ def _regex_run_batch(patterns, filename, fileno, lineidxpath,
 						mend = len(data[offset:mend].decode('utf8'))
 						# sentno, sent, high1, high2
 						result.append((lineno, sent, range(mstart, mend), ()))
-			else:
-				for pattern in patterns:
-					try:
-						result.append(pattern.count(data, startidx, endidx))
-					except AttributeError:
-						result.append(len(pattern.findall(
-								data, startidx, endidx)))
+				else:
+					result.append(_regex_count(pattern, data,
+							startidx, endidx, lineindex, candidates))
 		finally:
 			data.close()
 			if hasattr(mrb, 'close'):
@@ -1199,6 +1388,205 @@ def _regex_run_batch(patterns, filename, fileno, lineidxpath,
 	return result
 
 
+def _regex_ranges(startidx, endidx, lineindex, candidates):
+	"""Yield the byte ranges to search for a regex.
+
+	This is the given range, or when there is a bitmap of candidate line
+	numbers, the range of each candidate line."""
+	if candidates is None:
+		yield startidx, endidx
+	else:
+		for lineno in candidates:
+			yield lineindex.select(lineno - 1), lineindex.select(lineno)
+
+
+def _regex_finditer(pattern, data, startidx, endidx, lineindex, candidates):
+	"""Iterate over matches in the ranges given by ``_regex_ranges()``."""
+	for a, b in _regex_ranges(startidx, endidx, lineindex, candidates):
+		yield from pattern.finditer(data, a, b)
+
+
+def _regex_count(pattern, data, startidx, endidx, lineindex, candidates):
+	"""Count matches in the ranges given by ``_regex_ranges()``."""
+	try:
+		return sum(pattern.count(data, a, b) for a, b
+				in _regex_ranges(startidx, endidx, lineindex, candidates))
+	except AttributeError:
+		return sum(len(pattern.findall(data, a, b)) for a, b
+				in _regex_ranges(startidx, endidx, lineindex, candidates))
+
+
+def _regex_candidates(pattern, fileno, trigramidxpath):
+	"""Look up the lines that may match pattern in the trigram index.
+
+	:returns: a bitmap of line numbers, or None if the index cannot be used
+		for this pattern."""
+	literals = _regex_literals(pattern)
+	if not literals:
+		return None
+	buckets = {(fileno << TRIGRAMBITS) + bucket for literal in literals
+			for bucket in _trigrambuckets(literal).tolist()}
+	mrb = MultiRoaringBitmap.fromfile(trigramidxpath)
+	try:
+		result = mrb.intersection(sorted(buckets))
+		# None if one of the buckets is empty; copy the result because
+		# with a single bucket it may refer to the mmap'd index.
+		result = RoaringBitmap() if result is None else RoaringBitmap(result)
+	finally:
+		if hasattr(mrb, 'close'):
+			mrb.close()
+		del mrb
+	return result
+
+
+def _regex_literals(pattern):
+	"""Return lowercased strings that occur in every match of a regex.
+
+	Only strings of at least three bytes are returned. The regex is scanned
+	conservatively: literals are only collected outside of groups and
+	character classes, and an empty list is returned if there is an
+	alternative at the top level, if a match may span more than one line
+	(the trigram index is based on lines), or if the regex contains syntax
+	that is not recognized, e.g., syntax specific to re2."""
+	query = getattr(pattern, 'pattern', None)
+	flags = getattr(pattern, 'flags', 0)
+	if isinstance(query, str):
+		query = query.encode('utf8')
+	if not isinstance(query, bytes) or flags & (re.DOTALL | re.VERBOSE):
+		return []
+	ignorecase = flags & re.IGNORECASE
+	result = []
+	literal = bytearray()  # run of consecutive literal bytes
+	depth = pos = 0
+	while pos < len(query):
+		char = query[pos]
+		pos += 1
+		atom = None  # a literal byte, or None for any other part of regex
+		if char == 92:  # backslash
+			escaped = query[pos:pos + 1]
+			pos += 1
+			if not escaped.isalnum():
+				atom = ord(escaped)
+			elif escaped not in (b'b', b'B', b'A', b'Z', b'd', b'w'):
+				return []  # e.g., \n, \s, backreferences
+		elif char == 91:  # [
+			pos = _regex_classend(query, pos)
+			if pos == -1:
+				return []
+		elif char == 40:  # (
+			match = REGEXGROUP.match(query, pos)
+			if match is None:
+				return []  # e.g., conditionals, comments, backreferences
+			pos = match.end()
+			if re.search(b'[sx]', match.group(1) or b''):
+				return []  # dotall or verbose flag
+			elif match.group(0).endswith(b')'):  # global flags
+				ignorecase = ignorecase or b'i' in match.group(1)
+				continue
+			depth += 1
+		elif char == 41:  # )
+			depth -= 1
+		elif char == 124 and depth == 0:  # |
+			return []
+		elif char in b'*+?{':
+			if char == 123:  # {
+				match = REGEXREPEAT.match(query, pos)
+				if match is None:
+					return []
+				pos = match.end()
+			if char != 43 and (char != 123 or not int(match.group(1) or 0)):
+				# the last character is optional; remove it
+				while literal and 128 <= literal[-1] < 192:
+					literal.pop()  # UTF-8 continuation byte
+				if literal:
+					literal.pop()
+		elif char == 10:
+			return []
+		elif char not in b'.^$|':
+			atom = char
+		if depth == 0 and atom is not None and not (ignorecase and (
+				atom > 127 or atom in b'kKsS')):
+			# with unicode case folding, k and s also match non-ASCII chars
+			literal.append(atom)
+		else:
+			result.append(bytes(literal).lower())
+			literal = bytearray()
+	result.append(bytes(literal).lower())
+	return [a for a in result if len(a) >= 3]
+
+
+def _regex_classend(query, pos):
+	"""Return the index after a character class that starts at ``pos``.
+
+	:returns: -1 if the class may match a newline, or uses syntax that is
+		not recognized."""
+	if query.startswith(b'^', pos):
+		return -1
+	start = pos
+	while pos < len(query):
+		char = query[pos]
+		if char == 93 and pos > start:  # ]
+			return pos + 1
+		elif char == 92:  # backslash
+			escaped = query[pos + 1:pos + 2]
+			if not escaped or escaped.isalnum() and escaped not in (
+					b'd', b'w'):
+				return -1
+			pos += 2
+			continue
+		elif char <= 10 or char == 91:  # control characters; nested [
+			return -1
+		pos += 1
+	return -1
+
+
+def _trigrambuckets(data):
+	"""Return an array with the hash bucket of each byte trigram in data."""
+	buf = np.frombuffer(data, dtype=np.uint8).astype(np.uint32)
+	codes = buf[:-2] << 16 | buf[1:-1] << 8 | buf[2:]
+	# multiplicative hashing; the high bits are used as bucket.
+	return (codes * np.uint32(2654435761)) >> np.uint32(32 - TRIGRAMBITS)
+
+
+def _indextrigrams(filename, lineindex, chunksize=1 << 22):
+	"""Create a bitmap with line numbers for each bucket of trigrams.
+
+	The text is lowercased; trigrams with a newline are not indexed.
+	The file is processed in chunks of about ``chunksize`` bytes.
+	:returns: a list of ``2 ** TRIGRAMBITS`` bitmaps (None for empty ones)."""
+	result = [None] * (1 << TRIGRAMBITS)
+	offsets = np.fromiter(lineindex, dtype=np.int64, count=len(lineindex))
+	first = 0
+	with open(filename, 'rb') as inp:
+		while first < len(offsets) - 1:
+			last = min(max(first + 1, int(np.searchsorted(
+					offsets, offsets[first] + chunksize))), len(offsets) - 1)
+			inp.seek(offsets[first])
+			data = inp.read(offsets[last] - offsets[first]).lower()
+			buckets = _trigrambuckets(data)
+			newline = np.frombuffer(data, dtype=np.uint8) == 10
+			valid = ~(newline[:-2] | newline[1:-1] | newline[2:])
+			# line number of each trigram: the rank of its offset.
+			linenos = first + np.searchsorted(
+					offsets[first:last] - offsets[first],
+					np.arange(len(buckets)), side='right')
+			pairs = np.unique(buckets[valid].astype(np.uint64)
+					<< np.uint64(32) | linenos[valid].astype(np.uint64))
+			first = last
+			if len(pairs) == 0:
+				continue
+			keys = pairs >> np.uint64(32)
+			bounds = [0] + (np.flatnonzero(np.diff(keys)) + 1).tolist()
+			# NB: updating bitmaps with lists is faster than with arrays.
+			lines = (pairs & np.uint64(0xffffffff)).tolist()
+			for a, b in zip(bounds, bounds[1:] + [len(lines)]):
+				bucket = int(keys[a])
+				if result[bucket] is None:
+					result[bucket] = RoaringBitmap()
+				result[bucket].update(lines[a:b])
+	return result
+
+
 def _getoffsets(lineno, lineindex, data):
 	"""Return the (start, end) byte offsets for a given 1-based line number."""
 	offset = 0
@@ -1238,6 +1626,170 @@ class NoFuture(object):
 		return self._result
 
 
+class QueryCache(object):
+	"""Front for a cache of query results, shared by the files of a searcher.
+
+	Keys are of the form ``(method, query, filename, ...)``; the key under
+	which a result is stored is extended with the query engine and the
+	modification time of ``filename``, so that results for a corpus file
+	become unreachable when it changes (and are eventually evicted).
+	Fragment queries are normalized with respect to whitespace.
+
+	:param engine: name of the query engine.
+	:param backend: a mapping object with ``get()`` and LRU eviction,
+		e.g., an ``LRUCache`` or ``SqliteCache``."""
+
+	def __init__(self, engine, backend):
+		self.engine = engine
+		self.backend = backend
+
+	def _key(self, key):
+		method, query, filename = key[:3]
+		if self.engine == 'frag':
+			if isinstance(query, tuple):
+				query = tuple(_normquery(a) for a in query)
+			else:
+				query = _normquery(query)
+		return (self.engine, method, query, filename,
+				os.stat(filename).st_mtime_ns) + key[3:]
+
+	def __getitem__(self, key):
+		return self.backend[self._key(key)]
+
+	def __setitem__(self, key, value):
+		self.backend[self._key(key)] = value
+
+	def __contains__(self, key):
+		return self._key(key) in self.backend
+
+	def get(self, key, default=None):
+		"""Return cached value for key, or ``default`` if not in cache."""
+		return self.backend.get(self._key(key), default)
+
+	def clear(self):
+		"""Remove all cached results."""
+		self.backend.clear()
+
+
+class LRUCache(OrderedDict):
+	"""LRU cache with maximum number of elements based on OrderedDict."""
+
+	def __init__(self, limit):
+		super().__init__()
+		self.limit = limit
+
+	def __getitem__(self, key):
+		value = super().__getitem__(key)
+		self.move_to_end(key)
+		return value
+
+	def __setitem__(self, key, value):  # pylint: disable=arguments-differ
+		if self.limit == 0:
+			return
+		elif key in self:
+			self.move_to_end(key)
+		elif len(self) >= self.limit:
+			self.popitem(last=False)
+		super().__setitem__(key, value)
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+
+class SqliteCache(object):
+	"""Persistent LRU cache stored in an SQLite database.
+
+	Values are pickled; the database can be shared by several processes,
+	e.g., the workers of a web server, and survives restarts.
+
+	:param filename: the database file; created if it does not exist.
+	:param limit: maximum number of entries.
+	:param maxbytes: if given, maximum total size of pickled values."""
+
+	def __init__(self, filename, limit=CACHESIZE, maxbytes=None):
+		self.filename = filename
+		self.limit = limit
+		self.maxbytes = maxbytes
+		self.lock = threading.Lock()
+		self.conn = sqlite3.connect(filename, timeout=60,
+				isolation_level=None, check_same_thread=False)
+		self.conn.execute('PRAGMA journal_mode=WAL')
+		self.conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+				'key TEXT PRIMARY KEY, value BLOB, size INTEGER, atime REAL)')
+		self.conn.execute(
+				'CREATE INDEX IF NOT EXISTS cacheatime ON cache (atime)')
+
+	def __getitem__(self, key):
+		key = repr(key)
+		with self.lock:
+			row = self.conn.execute('SELECT value FROM cache WHERE key = ?',
+					(key, )).fetchone()
+			if row is None:
+				raise KeyError(key)
+			self.conn.execute('UPDATE cache SET atime = ? WHERE key = ?',
+					(time.time(), key))
+		return pickle.loads(row[0])
+
+	def __setitem__(self, key, value):
+		if self.limit == 0:
+			return
+		value = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+		with self.lock:
+			self.conn.execute('INSERT OR REPLACE INTO cache '
+					'VALUES (?, ?, ?, ?)',
+					(repr(key), value, len(value), time.time()))
+			self._evict()
+
+	def __contains__(self, key):
+		with self.lock:
+			return self.conn.execute('SELECT 1 FROM cache WHERE key = ?',
+					(repr(key), )).fetchone() is not None
+
+	def __len__(self):
+		with self.lock:
+			return self.conn.execute(
+					'SELECT COUNT(*) FROM cache').fetchone()[0]
+
+	def get(self, key, default=None):
+		"""Return cached value for key, or ``default`` if not in cache."""
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def clear(self):
+		"""Remove all entries."""
+		with self.lock:
+			self.conn.execute('DELETE FROM cache')
+
+	def close(self):
+		"""Close the database connection."""
+		self.conn.close()
+
+	def _evict(self):
+		"""Remove least recently used entries until within limits."""
+		numentries, numbytes = self.conn.execute(
+				'SELECT COUNT(*), TOTAL(size) FROM cache').fetchone()
+		if numentries > self.limit:
+			self.conn.execute('DELETE FROM cache WHERE key IN ('
+					'SELECT key FROM cache ORDER BY atime LIMIT ?)',
+					(numentries - self.limit, ))
+			numbytes = self.conn.execute(
+					'SELECT TOTAL(size) FROM cache').fetchone()[0]
+		if self.maxbytes is not None and numbytes > self.maxbytes:
+			keys = []
+			for key, size in self.conn.execute(
+					'SELECT key, size FROM cache ORDER BY atime'):
+				if numbytes <= self.maxbytes:
+					break
+				keys.append((key, ))
+				numbytes -= size
+			self.conn.executemany('DELETE FROM cache WHERE key = ?', keys)
+
+
 class FIFOOrederedDict(OrderedDict):
 	"""FIFO cache with maximum number of elements based on OrderedDict."""
 
@@ -1255,6 +1807,11 @@ class FIFOOrederedDict(OrderedDict):
 		super().__setitem__(key, value)
 
 
+def _normquery(query):
+	"""Normalize whitespace in a fragment query."""
+	return '\n'.join(' '.join(line.split()) for line in query.splitlines())
+
+
 def filterlabels(line, nofunc, nomorph):
 	"""Remove morphological and/or grammatical function labels from tree(s)."""
 	if nofunc:
@@ -1506,5 +2063,6 @@ def main():
 
 
 __all__ = ['CorpusSearcher', 'TgrepSearcher', 'RegexSearcher',
-		'FragmentSearcher', 'NoFuture', 'FIFOOrederedDict', 'filterlabels',
-		'cpu_count', 'charindices', 'applyhighlight']
+		'FragmentSearcher', 'NoFuture', 'QueryCache', 'LRUCache',
+		'SqliteCache', 'FIFOOrederedDict', 'filterlabels', 'cpu_count',
+		'charindices', 'applyhighlight']
@@ -3,12 +3,15 @@ import os
 import re
 import sys
 import gzip
+import time
 import codecs
 import traceback
 import subprocess
 from contextlib import contextmanager
 from heapq import heapify, heappush, heappop, heapreplace
 from functools import wraps
+from itertools import islice
+from collections import deque
 from collections.abc import Set, Iterable
 import grapheme
 
@@ -41,6 +44,64 @@ def workerfunc(func):
 	return wrapper
 
 
+def _mapchunk(func, chunk):
+	"""Apply function to each element of a chunk (multiprocessing helper)."""
+	return [func(a) for a in chunk]
+
+
+def boundedimap(pool, func, iterable, chunksize=1, window=8):
+	"""Streaming, order-preserving version of ``pool.imap()``.
+
+	Unlike ``pool.imap()``, the input is consumed lazily: at most ``window``
+	chunks of ``chunksize`` elements are in flight at any moment, so memory
+	use is bounded regardless of the size of the input, and results are
+	yielded in input order as soon as each prefix is complete.
+
+	:param pool: a ``multiprocessing.Pool`` object.
+	:param func: a picklable function.
+	:param chunksize: number of elements sent to a worker in a single task;
+		larger values reduce communication overhead for short tasks.
+	:param window: maximum number of chunks submitted but not yet yielded."""
+	if chunksize < 1 or window < 1:
+		raise ValueError('chunksize and window should be positive.')
+	iterable = iter(iterable)
+	pending = deque()
+	while True:
+		while len(pending) < window:
+			chunk = list(islice(iterable, chunksize))
+			if not chunk:
+				break
+			pending.append(pool.apply_async(_mapchunk, (func, chunk)))
+		if not pending:
+			break
+		yield from pending.popleft().get()
+
+
+class PhaseTimer(object):
+	"""Accumulate wall clock and CPU time of named phases.
+
+	>>> timer = PhaseTimer()
+	>>> timer.lap('parse')
+	>>> sorted(timer.phases)
+	['parse']
+	"""
+	def __init__(self):
+		self.phases = {}  # name => (wall time, cpu time)
+		self.reset()
+
+	def reset(self):
+		"""Start timing a new phase."""
+		self.wall, self.cpu = time.perf_counter(), time.process_time()
+
+	def lap(self, name):
+		"""Add the time since the last call or reset to phase ``name``."""
+		wall, cpu = time.perf_counter(), time.process_time()
+		prevwall, prevcpu = self.phases.get(name, (0.0, 0.0))
+		self.phases[name] = (prevwall + wall - self.wall,
+				prevcpu + cpu - self.cpu)
+		self.wall, self.cpu = wall, cpu
+
+
 @contextmanager
 def genericdecompressor(cmd, filename, encoding='utf8'):
 	"""Run command line decompressor on file and return file object.
@@ -482,6 +543,7 @@ ANSICOLOR = {
 		'white': 37,
 }
 
-__all__ = ['which', 'workerfunc', 'genericdecompressor', 'genericcompressor',
-		'openread', 'readbytes', 'slice_bounds', 'merge', 'tokenize', 'run',
-		'OrderedSet', 'PyAgenda', 'ANSICOLOR']
+__all__ = ['which', 'workerfunc', 'boundedimap', 'genericdecompressor',
+		'genericcompressor', 'openread', 'readbytes', 'slice_bounds', 'merge',
+		'tokenize', 'run',
+		'OrderedSet', 'PyAgenda', 'PhaseTimer', 'ANSICOLOR']
@@ -234,7 +234,7 @@ description = u'Disco-DOP Documentation'
 authors = [u'Andreas van Cranenburgh']
 man_pages = [('discodop', 'discodop', description, authors, 1)] + [
 		('cli/' + sub, 'discodop-' + sub, description, authors, 1)
-		for sub in ('eval fragments gen grammar parser runexp '
+		for sub in ('bench eval fragments gen grammar parser runexp '
 			'treedraw treesearch treetransforms').split()]
 
 # If true, show URL addresses after external links.
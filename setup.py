@@ -121,6 +121,10 @@ if __name__ == '__main__':
 	else:
 		extra_compile_args += ['-O3', '-march=native', '-DNDEBUG']
 		extra_link_args = ['-DNDEBUG']
+	if sys.platform != 'darwin':  # Apple's clang does not support OpenMP
+		# used for prange; without it, loops are executed serially.
+		extra_compile_args += ['-fopenmp']
+		extra_link_args += ['-fopenmp']
 	if USE_CYTHON:
 		ext_modules = cythonize(
 				[Extension(
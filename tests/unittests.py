@@ -8,6 +8,7 @@ import pickle
 from unittest import TestCase
 from itertools import count, islice
 from operator import itemgetter
+from collections import defaultdict
 from discodop.tree import Tree, ParentedTree, HEAD
 from discodop.treebank import incrementaltreereader
 from discodop.treetransforms import (binarize, unbinarize, canonicalize,
@@ -529,6 +530,172 @@ def test_grammar(debug=False):
 	Grammar(treebankgrammar([tree], [[str(a) for a in range(10)]]))
 
 
+def test_chartreuse():
+	from discodop.grammar import treebankgrammar
+	from discodop import pcfg, plcfrs
+	from discodop.containers import Grammar
+	from discodop.treebank import NegraCorpusReader
+	from discodop.treetransforms import addfanoutmarkers, splitdiscnodes
+	corpus = NegraCorpusReader('alpinosample.export', punct='move')
+	sents = list(corpus.sents().values())
+	trees = [addfanoutmarkers(binarize(a.copy(True), horzmarkov=1))
+			for a in corpus.trees().values()]
+	cfgtrees = [addfanoutmarkers(binarize(splitdiscnodes(a.copy(True)),
+			horzmarkov=1)) for a in corpus.trees().values()]
+	for parser, grammar in (
+			(pcfg, Grammar(treebankgrammar(cfgtrees, sents),
+				start=trees[0].label)),
+			(plcfrs, Grammar(treebankgrammar(trees, sents),
+				start=trees[0].label))):
+		chart = None
+		for sent in sents[::-1]:
+			expected, _ = parser.parse(sent, grammar)
+			prev = chart
+			chart, _ = parser.parse(sent, grammar, chart=chart)
+			assert prev is None or chart is prev
+			assert str(chart) == str(expected)
+
+
+def test_pcfgunary():
+	from discodop.containers import Grammar
+	from discodop.pcfg import parse
+	grammar = Grammar([((('ROOT', 'S'), ((0,),)), 0.25),
+			((('ROOT', 'X'), ((0,),)), 0.75),
+			((('X', 'S'), ((0,),)), 1.0),
+			((('S', 'A', 'B'), ((0, 1),)), 0.5),
+			((('S', 'A', 'A'), ((0, 1),)), 0.5),
+			((('A', 'Epsilon'), ('a',)), 1.0),
+			((('B', 'Epsilon'), ('b',)), 1.0)], start='ROOT')
+	chart, _ = parse(['a', 'b'], grammar)
+	vitprobs = dict(line.split()[:2] for line in str(chart).splitlines()
+			if 'vitprob=' in line)
+	assert vitprobs['S[0:2]'] == 'vitprob=0.5'
+	assert vitprobs['X[0:2]'] == 'vitprob=0.5'
+	assert vitprobs['ROOT[0:2]'] == 'vitprob=0.375'
+
+
+def test_pcfgthreads():
+	from discodop.grammar import treebankgrammar
+	from discodop import pcfg
+	from discodop.containers import Grammar
+	from discodop.kbest import lazykbest
+	from discodop.treebank import NegraCorpusReader
+	from discodop.treetransforms import addfanoutmarkers, splitdiscnodes
+	corpus = NegraCorpusReader('alpinosample.export', punct='move')
+	sents = list(corpus.sents().values())
+	trees = [addfanoutmarkers(binarize(splitdiscnodes(a.copy(True)),
+			horzmarkov=1)) for a in corpus.trees().values()]
+	grammar = Grammar(treebankgrammar(trees, sents), start=trees[0].label)
+	for sent in sents:
+		for beam_beta in (0.0, 2.0):
+			expected, msg1 = pcfg.parse(sent, grammar, beam_beta=beam_beta)
+			chart, msg2 = pcfg.parse(sent, grammar, beam_beta=beam_beta,
+					numthreads=3)
+			assert msg1 == msg2
+			assert str(chart) == str(expected)
+			assert lazykbest(chart, 10) == lazykbest(expected, 10)
+
+
+def test_posteriorthreshold():
+	from discodop.containers import Grammar
+	from discodop.pcfg import parse
+	from discodop.coarsetofine import posteriorthreshold
+	grammar = Grammar([((('ROOT', 'S'), ((0,),)), 1.0),
+			((('S', 'S', 'S'), ((0, 1),)), 1.0),
+			((('S', 'Epsilon'), ('a',)), 1.0),
+			((('S', 'Epsilon'), ('b',)), 1e12)], start='ROOT')
+	chart, _ = parse(['a'] * 5, grammar)
+	items, _ = posteriorthreshold(chart, 1e-5, logspace=False)
+	chart, _ = parse(['a'] * 5, grammar)
+	assert posteriorthreshold(chart, 1e-5, logspace=True)[0] == items
+	# plain probabilities underflow
+	chart, _ = parse(['a'] * 40, grammar)
+	items, _ = posteriorthreshold(chart, 1e-5, logspace=True)
+	assert len(items) > 40
+	# with a budget, only the most probable items remain
+	budgeted, _ = posteriorthreshold(chart, 1e-5, logspace=True, maxitems=10)
+	assert 10 <= len(budgeted) < len(items)
+	assert set(budgeted) <= set(items) and chart.root() in budgeted
+
+
+def ppattachmentchart():
+	"""Parse a sentence with a DOP reduction of PP attachment examples."""
+	from discodop.grammar import dopreduction
+	from discodop import plcfrs
+	from discodop.containers import Grammar
+	from discodop.treetransforms import addfanoutmarkers
+	trees = [addfanoutmarkers(binarize(Tree(a), horzmarkov=1)) for a in (
+			'(S (NP (PN 0)) (VP (V 1) (NP (DT 2) (N 3)) '
+				'(PP (P 4) (NP (DT 5) (N 6)))))',
+			'(S (NP (PN 0)) (VP (V 1) (NP (NP (DT 2) (N 3)) '
+				'(PP (P 4) (NP (DT 5) (N 6))))))',
+			'(S (NP (PN 0)) (VP (V 1) (NP (PN 2)) (PP (P 3) (NP (PN 4)))))')]
+	sents = [a.split() for a in ('I saw the man with the telescope',
+			'I saw the man with the hat', 'I saw John with Mary')]
+	grammar = Grammar(dopreduction(trees, sents)[0], start='S')
+	chart, _ = plcfrs.parse('John saw the man with the hat'.split(), grammar,
+			exhaustive=True)
+	return chart
+
+
+def test_maxruleparse():
+	from discodop.disambiguation import getderivations, marginalize
+	chart = ppattachmentchart()
+	getderivations(chart, 10000)
+	mpp, _ = marginalize('mpp', chart)
+	besttree = max(mpp, key=itemgetter(1))[0]
+	for objective in ('max-rule-product', 'max-rule-sum', 'max-recall'):
+		parses, _ = marginalize(objective, chart)
+		assert len(parses) == 1 and parses[0][0] == besttree
+	# compare expected recall with the one based on k-best derivations
+	posteriors = defaultdict(float)
+	for treestr, prob, _ in mpp:
+		for node in Tree(treestr).subtrees(lambda n: '|<' not in n.label):
+			posteriors[node.label, tuple(node.leaves())] += prob / sum(
+					prob for _, prob, _ in mpp)
+	assert abs(parses[0][1] - sum(posteriors[node.label, tuple(node.leaves())]
+			for node in Tree(besttree).subtrees())) < 1e-3
+
+
+def test_derivtrees():
+	"""Parse trees from ranked edges match those from derivation strings."""
+	from math import exp
+	from discodop.disambiguation import (getderivations, marginalize,
+			REMOVEIDS)
+	chart = ppattachmentchart()
+	getderivations(chart, 1000)
+	expected = defaultdict(float)
+	for deriv, prob in chart.derivations:
+		expected[REMOVEIDS.sub('', deriv)] += exp(-prob)
+	expectedmpd = REMOVEIDS.sub('', chart.derivations[0][0])
+	for derivstrings in (True, False):
+		getderivations(chart, 1000, derivstrings=derivstrings)
+		mpp = {a: b for a, b, _ in marginalize('mpp', chart)[0]}
+		assert set(mpp) == set(expected)
+		assert all(abs(mpp[a] - expected[a]) < 1e-9 for a in mpp)
+		mpd = marginalize('mpd', chart)[0]
+		assert max(mpd, key=itemgetter(1))[0] == expectedmpd
+
+
+def test_samplederivations():
+	from discodop.disambiguation import (getderivations, samplederivations,
+			marginalize)
+	chart = ppattachmentchart()
+	getderivations(chart, 10000)
+	exact = dict((a, b) for a, b, _ in marginalize('mpp', chart)[0])
+	samplederivations(chart, 10000, seed=1)
+	derivations = chart.derivations
+	sampled = dict((a, b) for a, b, _ in marginalize('mpp', chart)[0])
+	assert set(sampled) <= set(exact)
+	# the weights of the samples sum to the inside probability of the root
+	assert abs(sum(sampled.values()) - sum(exact.values())) < 1e-3 * sum(
+			exact.values())
+	for treestr, prob in exact.items():
+		assert abs(sampled.get(treestr, 0) - prob) < 0.05 * sum(exact.values())
+	samplederivations(chart, 10000, seed=1)
+	assert chart.derivations == derivations
+
+
 def test_optimalbinarize():
 	"""Verify that all optimal parsing complexities are lower than or
 	equal to the complexities of right-to-left binarizations."""
@@ -817,6 +984,132 @@ def test_runexp():
 	cli.runexp(['sample.prm'])
 
 
+def loadsample():
+	"""Return parameters with the grammars of ``sample.prm``, and sentences."""
+	from discodop.parser import readparam, readgrammars
+	from discodop.treebank import NegraCorpusReader
+	if not os.path.exists('sample/params.prm'):
+		test_runexp()
+	params = readparam('sample/params.prm')
+	params.update(resultdir='sample', verbosity=0)
+	readgrammars('sample', params.stages, params.postagging,
+			params.transformations)
+	corpus = NegraCorpusReader('alpinosample.export', punct='move')
+	return params, list(corpus.sents().values())
+
+
+def test_parsebatch():
+	"""Parse a batch with the grammars of ``sample.prm``."""
+	from discodop.parser import Parser
+	params, sents = loadsample()
+	parser = Parser(params)
+	sents = sents[::-1]
+	results = parser.parsebatch(sents)
+	assert len(results) == len(sents)
+	for sent, result in zip(sents, results):
+		expected = list(parser.parse(sent))
+		assert [a.name for a in result] == [a.name for a in expected]
+		assert str(result[-1].parsetree) == str(expected[-1].parsetree)
+		assert result[-1].prob == expected[-1].prob
+
+
+def test_threadedparsing(tmp_path):
+	"""Parse with threads or processes sharing the grammars of sample.prm."""
+	from discodop.parser import Parser, doparsing
+	params, sents = loadsample()
+	parser = Parser(params)
+	sents = [' '.join(sent) + '\n' for sent in sents]
+	results = []
+	for n, (numproc, threads, share) in enumerate((
+			(1, False, False), (2, True, False), (2, False, True))):
+		filename = str(tmp_path / ('out%d' % n))
+		with open(filename, 'w') as out:
+			doparsing(parser, sents, out, False, True, False, 1, numproc,
+					'bracket', None, False, threads=threads, share=share)
+		with open(filename) as inp:
+			results.append(inp.read())
+	assert results[0] == results[1] == results[2]
+	# the grammars of the parser itself were not replaced by shared copies
+	for stage in parser.stages:
+		assert stage.grammar.binfile is None
+		pickle.loads(pickle.dumps(stage.grammar))
+	parser.stages[-1].objective = 'sl-dop-simple'
+	try:
+		doparsing(parser, sents, None, False, True, False, 1, 2,
+				'bracket', None, False, threads=True)
+	except ValueError:
+		pass
+	else:
+		raise AssertionError('expected ValueError')
+
+
+def test_profile():
+	"""Write timings and chart statistics as JSON lines."""
+	import json
+	from io import StringIO
+	from discodop.parser import Parser, doparsing
+	params, sents = loadsample()
+	parser = Parser(params, profile=True)
+	sent = sents[0]
+	profile = StringIO()
+	with open(os.devnull, 'w') as out:
+		doparsing(parser, [' '.join(sent) + '\n'], out, False, True, False,
+				1, 1, 'bracket', None, False, profile=profile)
+	records = [json.loads(line) for line in profile.getvalue().splitlines()]
+	assert [a['stage'] for a in records] == [a.name for a in parser.stages]
+	for record in records:
+		assert record['sentid'] == 1 and record['len'] == len(sent)
+		assert not record['noparse']
+		assert record['numitems'] > 0 and record['numedges'] > 0
+		assert record['chartmemory'] > 0
+		assert {'parse', 'kbest', 'marginalize', 'postprocess'} <= set(
+				record['phases'])
+		assert all(a['cpu'] >= 0 and a['wall'] >= 0
+				for a in record['phases'].values())
+		assert set(record['parsephases']) == {
+				'pos', 'binary', 'unary', 'recoverfragments'}
+		assert all(a >= 0 for a in record['parsephases'].values())
+		assert record['parsephases']['binary'] > 0
+	assert 'prune' in records[-1]['phases']
+	assert all(a.numitems > 0 and a.numedges == a.chartmemory == 0
+			for a in Parser(params).parse(sent))
+
+
+def test_parsebudget():
+	"""Stop parsing when an item limit or time limit is exceeded."""
+	from discodop.parser import Parser
+	params, sents = loadsample()
+	sent = sents[0]
+	params.stages[-1].itemlimit = 100
+	results = list(Parser(params).parse(sent))
+	assert [a.stopped for a in results] == [None, None, 'itemlimit']
+	assert results[-1].noparse
+	assert results[-1].parsetree == results[-2].parsetree
+	params.stages[-1].itemlimit = 0
+	params.timeout = 1e-9
+	results = list(Parser(params).parse(sent))
+	assert all(a.stopped == 'timeout' and a.noparse for a in results)
+
+
+def test_chartcache():
+	"""Reuse the coarse chart when a sentence is parsed with constraints."""
+	from discodop.parser import Parser
+	params, sents = loadsample()
+	sent = sents[0]
+	parser = Parser(params, chartcache=1)
+	results = list(parser.parse(sent))
+	node = next(node for node in results[-1].parsetree.subtrees()
+			if 1 < len(node.leaves()) < len(sent))
+	block = [(node.label, tuple(node.leaves()))]
+	results = list(parser.parse(sent, block=block))
+	assert 'reused chart' in results[0].msg
+	expected = list(Parser(params).parse(sent, block=block))
+	assert [(a.parsetree, a.prob) for a in results] == [
+			(a.parsetree, a.prob) for a in expected]
+	list(parser.parse(sent[:-1]))
+	assert len(parser.chartcache) == 1
+
+
 def test_serialization(tmp_path):
 	# assumes current working directory is project root
 	tb = readtreebanks('alpinosample.export', fmt='export')
@@ -879,6 +1172,51 @@ def test_serialization(tmp_path):
 	assert trees.__getstate__() == trees1.__getstate__()
 
 
+def test_grammarbinfile(tmp_path):
+	from discodop.grammar import doubledop
+	from discodop.containers import Grammar
+	from discodop.treebank import NegraCorpusReader
+	from discodop.treetransforms import addfanoutmarkers
+	corpus = NegraCorpusReader('alpinosample.export', punct='move')
+	sents = list(corpus.sents().values())
+	trees = [addfanoutmarkers(binarize(a.copy(True), horzmarkov=1))
+			for a in list(corpus.trees().values())[:10]]
+	grammarx, backtransform, altweights, _ = doubledop(trees, sents,
+			debug=False, numproc=1)
+	grammar = Grammar(grammarx, start=trees[0].label,
+			altweights=altweights, backtransform=backtransform)
+	grammar.getmapping(None, neverblockre=re.compile('.+}<'), debug=False)
+	tmp = str(tmp_path / 'tmp.g')
+	grammar.tobinfile(tmp)
+	grammar1 = Grammar.frombinfile(tmp)
+	assert str(grammar) == str(grammar1)
+	assert grammar.backtransform == list(grammar1.backtransform)
+	assert grammar.tblabelmapping == grammar1.tblabelmapping
+	assert grammar1.testgrammar()[0]
+	grammar1.switch('ewe')
+	grammar.switch('ewe')
+	assert str(grammar) == str(grammar1)
+	grammar2 = pickle.loads(pickle.dumps(grammar1))  # loads from file
+	assert grammar2.currentmodel == 'ewe'
+	assert str(grammar) == str(grammar2)
+	assert grammar.backtransform == list(grammar2.backtransform)
+
+
+def test_longweights(tmp_path):
+	"""Read a text grammar with weights written with many digits."""
+	from discodop.containers import Grammar
+	from discodop.plcfrs import parse
+	weight = '0.' + '3' * 80
+	(tmp_path / 'g.rules').write_text('S\tA\tB\t01\t%s\n' % weight)
+	(tmp_path / 'g.lex').write_text('a\tA %s\nb\tB %s\n' % (
+			weight, weight))
+	grammar = Grammar(str(tmp_path / 'g.rules'), str(tmp_path / 'g.lex'),
+			start='S')
+	assert grammar.numbinary == 1
+	chart, _ = parse(['a', 'b'], grammar)
+	assert chart
+
+
 def test_issue51():
 	from discodop.containers import Grammar
 	from discodop.plcfrs import parse
@@ -888,3 +1226,174 @@ def test_issue51():
 			start='S')
 	chart, _msg = parse(['b'], g)
 	chart.filter()
+
+
+def test_serverstats():
+	from discodop.parser import ServerStats
+	stats = ServerStats()
+	stats.submit()
+	stats.submit()
+	assert stats.summary()['queued'] == 2
+	stats.done(0.0, 0.5, False, [('pcfg', 0.1), ('dop', 0.3)])
+	result = stats.summary()
+	assert result['queued'] == 1 and result['parsed'] == 1
+	assert result['meanwait'] == 0.5
+	assert result['stages']['dop'] == dict(meancputime=0.3, maxcputime=0.3)
+
+
+def test_serverrequests(tmp_path):
+	"""Malformed requests to the parser server get an error response."""
+	import json
+	import socket
+	import threading
+	from multiprocessing.pool import ThreadPool
+	from discodop.parser import Parser, ThreadingUnixServer, initworker
+	params, sents = loadsample()
+	pool = ThreadPool(1, initworker,
+			(Parser(params), False, False, 1, 'bracket', None))
+	address = str(tmp_path / 'socket')
+	server = ThreadingUnixServer(address, pool, window=1)
+	server.server_bind()
+	server.server_activate()
+	thread = threading.Thread(target=server.serve_forever)
+	thread.start()
+	try:
+		with socket.socket(socket.AF_UNIX) as conn:
+			conn.connect(address)
+			conn.sendall(b'\xff\n{"sent": 1}\n%s\n%s\n' % (
+					' '.join(sents[0]).encode('utf8'),
+					' '.join(sents[1]).encode('utf8')))
+			conn.shutdown(socket.SHUT_WR)
+			responses = [json.loads(line) for line in conn.makefile('rb')]
+	finally:
+		server.shutdown()
+		server.server_close()
+		thread.join()
+		pool.terminate()
+	assert len(responses) == 4
+	assert 'error' in responses[0] and 'error' in responses[1]
+	assert [a['id'] for a in responses[2:]] == [1, 2]
+	assert all('output' in a for a in responses[2:])
+
+
+def test_boundedimap():
+	from multiprocessing import Pool
+	from discodop.util import boundedimap
+	with Pool(2) as pool:
+		result = list(boundedimap(
+				pool, abs, range(-10, 0), chunksize=3, window=2))
+	assert result == list(range(10, 0, -1))
+
+
+def test_fragmentsearcher(tmp_path, monkeypatch):
+	"""Worker processes give the same results as queries in this process,
+	also when a corpus is divided into ranges of sentences."""
+	import shutil
+	from discodop import treesearch
+	filename = str(tmp_path / 't1.mrg')
+	shutil.copy('tests/t1.mrg', filename)
+	query = '(S (RIGHT (X ) (Y )))\n(X x)'
+	results = []
+	for numproc, minshardnodes in ((1, 1), (2, 100000), (2, 1)):
+		monkeypatch.setattr(treesearch, 'MINSHARDNODES', minshardnodes)
+		with treesearch.FragmentSearcher(
+				[filename], numproc=numproc) as searcher:
+			results.append((
+					searcher.counts(query),
+					searcher.counts(query, indices=True, start=2),
+					[list(a) for _, a in searcher.batchcounts(
+						query.splitlines())],
+					[(sentno, str(tree)) for _, sentno, tree, _, _
+						in searcher.trees(query, maxresults=None)]))
+	assert results[0] == results[1] == results[2]
+	assert results[0][0][filename] == 7
+	# same results without the index of production pairs
+	with treesearch.FragmentSearcher([filename], numproc=1) as searcher:
+		assert searcher.files[filename].pairindex is not None
+		searcher.files[filename].pairindex = None
+		assert searcher.counts(query) == results[0][0]
+	with Ctrees.fromfile(filename + '.ct') as corpus:
+		shards = corpus.shards(3)
+		assert shards[0][0] == 0 and shards[-1][1] == corpus.len
+		assert all(a[1] == b[0] for a, b in zip(shards, shards[1:]))
+
+
+def test_querycache(tmp_path):
+	"""Query results persist across searchers and are invalidated when the
+	corpus file changes."""
+	import shutil
+	from discodop import treesearch
+	filename = str(tmp_path / 't1.mrg')
+	shutil.copy('tests/t1.mrg', filename)
+	cachefile = str(tmp_path / 'cache.db')
+	query = '(S (RIGHT (X ) (Y )))\n(X x)'
+	with treesearch.FragmentSearcher(
+			[filename], numproc=1, cache=cachefile) as searcher:
+		assert searcher.counts(query)[filename] == 7
+		batch = [list(a) for _, a in searcher.batchcounts(query.splitlines())]
+		# mark the cached result to detect that it is reused
+		searcher.cache['counts', query, filename, None, None, False] = [42]
+	with treesearch.FragmentSearcher(
+			[filename], numproc=1, cache=cachefile) as searcher:
+		assert searcher.counts(query.replace(' ', '  '))[filename] == 42
+		assert [list(a) for _, a in searcher.batchcounts(
+				query.splitlines())] == batch
+		mtime = os.stat(filename).st_mtime_ns
+		os.utime(filename, ns=(mtime, mtime + 10 ** 9))
+		assert searcher.counts(query)[filename] == 7
+	cache = treesearch.LRUCache(2)
+	cache['a'], cache['b'] = 1, 2
+	assert cache['a'] == 1
+	cache['c'] = 3
+	assert list(cache) == ['a', 'c']
+	cache = treesearch.SqliteCache(
+			str(tmp_path / 'lru.db'), limit=2, maxbytes=100)
+	cache['a'] = cache['b'] = 1
+	cache['c'] = 'x' * 200
+	assert len(cache) == 0
+	cache['a'], cache['b'], cache['c'] = 1, 2, 3
+	assert 'a' not in cache and cache['c'] == 3
+	cache.close()
+
+
+def test_trigramindex(tmp_path):
+	"""Regex queries give the same results with and without trigram index."""
+	from discodop import treesearch
+	text = ('The cat sat on the mat\n\nthe dog ran\n   \n'
+			'a cat ran on the mat\nCAT SAT\nthe cat\nran on\n')
+	results = []
+	for name, trigramindex in (('a', False), ('b', True)):
+		os.mkdir(str(tmp_path / name))
+		filename = str(tmp_path / name / 'text.tok')
+		with open(filename, 'w') as out:
+			out.write(text)
+		with treesearch.RegexSearcher([filename], numproc=1,
+				ignorecase=True, trigramindex=trigramindex) as searcher:
+			results.append([
+					(list(searcher.counts(query).values()),
+					list(searcher.counts(query, start=2, end=5,
+						indices=True)[filename]),
+					[a[1:] for a in searcher.sents(query)])
+					for query in (r'\bcat\b', 'the cat', r'[cr]at sat$',
+						'dog ran on', r'(?-i:CAT) SAT', r'mat\s+the')])
+	assert results[0] == results[1]
+	assert [a[0] for a in results[1]] == [[4], [2], [1], [0], [1], [1]]
+	assert treesearch._regex_literals(treesearch._regex_parse_query(
+			r'(?:the|a) cat\w* sat', 0)) == [b' cat', b' sat']
+	assert treesearch._regex_literals(treesearch._regex_parse_query(
+			r'cat\s+sat', 0)) == []
+	assert treesearch._regex_literals(treesearch._regex_parse_query(
+			r'the cats?|dog', 0)) == []
+	assert treesearch._regex_literals(treesearch._regex_parse_query(
+			r'the cats?\.{2}', 0)) == [b'the cat']
+
+
+def test_bench(tmp_path):
+	"""Run a reduced benchmark and compare it with itself."""
+	from discodop.bench import runbenchmarks, compare
+	results = runbenchmarks('.', str(tmp_path), repeat=1, numsents=5)
+	assert {'grammar/getgrammars', 'parse/pcfg/parse',
+			'fragments/synthetic', 'treesearch/regex'} <= set(results)
+	assert all(a['wall'] >= 0 and a['cpu'] >= 0 for a in results.values())
+	assert not any(regression for _, _, _, regression
+			in compare(results, results))
@@ -36,6 +36,7 @@ LOG = APP.logger
 
 LIMIT = 40  # maximum sentence length
 CACHE = SimpleCache()
+CHARTCACHE = 32  # number of coarse charts to keep per grammar
 PARSERS = {}
 SHOWFUNC = True  # show function tags in results
 SHOWMORPH = True  # show morphological features in results
@@ -217,7 +218,8 @@ def loadparsers():
 			params.resultdir = directory
 			readgrammars(directory, params.stages, params.postagging,
 					params.transformations, top=getattr(params, 'top', 'ROOT'))
-			PARSERS[lang] = Parser(params)
+			# keep coarse charts so that adding constraints is fast
+			PARSERS[lang] = Parser(params, chartcache=CHARTCACHE)
 			LOG.info('Grammar for %s loaded.', lang)
 	assert PARSERS, 'no grammars found!'
 
@@ -38,6 +38,7 @@ from discodop.tree import Tree, DiscTree, DrawTree
 
 DEBUG = False  # when True: enable debugging interface, disable multiprocessing
 INMEMORY = False  # keep corpora in memory
+TRIGRAMINDEX = True  # index trigrams of plain text corpora for regex queries
 NUMPROC = None  # None==use all cores
 MINFREQ = 2  # filter out fragments which occur just once or twice
 MINNODES = 3  # filter out fragments with only three nodes (CFG productions)
@@ -48,6 +49,9 @@ INDICESMAXRESULTS = 1024  # max number of results for which to obtain indices.
 	# Indices are used to display a dispersion plot.
 LANG = 'nl'  # language to use when running style(1) or ucto(1)
 CORPUS_DIR = "corpus/"
+# file in CORPUS_DIR to cache query results across restarts and workers;
+# None to use an in-memory cache.
+CACHEDB = 'treesearchcache.db'
 PASSWD = None  # optionally, dict with user=>pass strings
 
 logging.basicConfig(
@@ -1073,19 +1077,23 @@ def getcorpus():
 			or glob.glob(os.path.join(CORPUS_DIR, '*.export.ct'))
 			)]
 	tokfiles = sorted(glob.glob(os.path.join(CORPUS_DIR, '*.tok')))
+	cache = os.path.join(CORPUS_DIR, CACHEDB) if CACHEDB else None
 	if tfiles:
 		corpora['tgrep2'] = treesearch.TgrepSearcher(
-				tfiles, macros='static/tgrepmacros.txt', numproc=NUMPROC)
+				tfiles, macros='static/tgrepmacros.txt', numproc=NUMPROC,
+				cache=cache)
 		LOG.info('tgrep2 corpus loaded.')
 	if ffiles:
 		corpora['frag'] = treesearch.FragmentSearcher(
 				ffiles, macros='static/fragmacros.txt',
-				inmemory=INMEMORY, numproc=1 if DEBUG else NUMPROC)
+				inmemory=INMEMORY, numproc=1 if DEBUG else NUMPROC,
+				cache=cache)
 		LOG.info('frag corpus loaded.')
 	if tokfiles:
 		corpora['regex'] = treesearch.RegexSearcher(
 				tokfiles, macros='static/regexmacros.txt',
-				inmemory=INMEMORY, numproc=1 if DEBUG else NUMPROC)
+				inmemory=INMEMORY, numproc=1 if DEBUG else NUMPROC,
+				cache=cache, trigramindex=TRIGRAMINDEX)
 		LOG.info('regex corpus loaded.')
 
 	assert tfiles or ffiles or tokfiles, (